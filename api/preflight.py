@@ -0,0 +1,266 @@
+import logging
+import math
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+import magic
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from multipart.multipart import parse_options_header
+from starlette.datastructures import Headers
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_PATH = re.compile(r"^/api/upload/([^/]+)/?$")
+# multipart の区切りとパートヘッダーの分の余裕
+MULTIPART_OVERHEAD = 64 * 1024
+MAGIC_BYTES = 2048
+RATE_LIMIT_PERIOD = 3600
+
+EMPTY_MIMES = {'application/x-empty', 'inode/x-empty'}
+TEXT_EXTENSIONS = {'.txt', '.csv', '.json', '.xml'}
+TEXT_MIMES = {'application/json', 'application/xml', 'application/csv'}
+# 先頭だけでは種類を判別できないことがあるコンテナ形式
+CONTAINER_EXTENSIONS = {'.docx', '.xlsx', '.mp4', '.avi', '.mov', '.mkv', '.webm'}
+
+def size_limit_error() -> HTTPException:
+    return HTTPException(413, f"File size exceeds {Config.MAX_FILE_SIZE // (1024**3)}GB limit")
+
+def check_extension(filename: str) -> str:
+    file_ext = Path(filename).suffix.lower()
+    if file_ext not in Config.ALLOWED_EXTENSIONS:
+        raise HTTPException(415, f"File type not allowed: {file_ext}")
+    return file_ext
+
+def content_allowed(file_ext: str, mime: str) -> bool:
+    if mime in Config.ALLOWED_MIMES or mime in EMPTY_MIMES:
+        return True
+    if file_ext in TEXT_EXTENSIONS:
+        return mime.startswith('text/') or mime in TEXT_MIMES
+    if file_ext in CONTAINER_EXTENSIONS:
+        return mime.startswith(('video/', 'audio/')) or mime == 'application/octet-stream'
+    return False
+
+def check_content(file_ext: str, head: bytes):
+    if not Config.UPLOAD_CONTENT_CHECK:
+        return
+
+    try:
+        mime = magic.from_buffer(head[:MAGIC_BYTES], mime=True)
+    except Exception as e:
+        logger.error(f"Content type detection failed: {e}")
+        return
+
+    if not content_allowed(file_ext, mime):
+        logger.warning(f"Upload rejected by content check: {file_ext} detected as {mime}")
+        raise HTTPException(415, f"File content does not match its type: {file_ext} ({mime})")
+
+def _limits(subject_limits: List[Tuple[Optional[str], str, int, int]]) -> List[Tuple[str, int, int, int]]:
+    return [(f"{subject}:{name}", limit, RATE_LIMIT_PERIOD, cost)
+            for subject, name, limit, cost in subject_limits if subject and limit > 0 and cost > 0]
+
+def upload_limits(session: Dict[str, Any], size: int) -> List[Tuple[str, int, int, int]]:
+    # ユーザーごと・サーバー（ギルド）ごとに、アップロード数と合計バイト数を1時間あたりで制限する
+    user = f"user:{session['discord_user_id']}" if session.get("discord_user_id") else None
+    guild = f"guild:{session['discord_server_id']}" if session.get("discord_server_id") else None
+    return _limits([
+        (user, "uploads", Config.RATE_LIMIT_PER_HOUR, 1),
+        (user, "bytes", Config.RATE_LIMIT_BYTES_PER_HOUR, size),
+        (guild, "uploads", Config.RATE_LIMIT_GUILD_PER_HOUR, 1),
+        (guild, "bytes", Config.RATE_LIMIT_GUILD_BYTES_PER_HOUR, size)
+    ])
+
+def session_limits(user_id: Optional[str], guild_id: Optional[str]) -> List[Tuple[str, int, int, int]]:
+    return _limits([
+        (f"user:{user_id}" if user_id else None, "sessions", Config.RATE_LIMIT_SESSIONS_PER_HOUR, 1),
+        (f"guild:{guild_id}" if guild_id else None, "sessions", Config.RATE_LIMIT_GUILD_SESSIONS_PER_HOUR, 1)
+    ])
+
+def bytes_limited() -> bool:
+    return Config.RATE_LIMIT_ENABLED and (Config.RATE_LIMIT_BYTES_PER_HOUR > 0
+                                          or Config.RATE_LIMIT_GUILD_BYTES_PER_HOUR > 0)
+
+async def enforce_rate_limit(redis_db, limits: List[Tuple[str, int, int, int]], dry_run: bool = False):
+    # 全ての制限を1回のLuaスクリプトで判定し、通る場合だけまとめて消費する
+    if not Config.RATE_LIMIT_ENABLED or not limits:
+        return
+    try:
+        wait = await redis_db.rate_limit(limits, dry_run)
+    except Exception as e:
+        logger.error(f"Rate limit check failed: {e}")
+        return
+    if wait > 0:
+        raise HTTPException(429, "Rate limit exceeded", headers={"Retry-After": str(math.ceil(wait))})
+
+async def session_usage(redis_db, session: Dict[str, Any]) -> int:
+    used = 0
+    for file_id in session.get("files", []):
+        file_info = await redis_db.get_file(session["session_id"], file_id)
+        if file_info:
+            used += file_info.get("size") or 0
+    return used
+
+async def validate_upload(redis_db, token: str, filename: Optional[str] = None,
+                          size: Optional[int] = None) -> Dict[str, Any]:
+    # ファイルIDの一覧は容量の集計にだけ使う
+    session = await redis_db.get_session(token, files=bool(Config.SESSION_QUOTA_BYTES))
+    if not session:
+        raise HTTPException(404, "Invalid session")
+
+    if size is not None and (size < 0 or size > Config.MAX_FILE_SIZE):
+        raise size_limit_error()
+
+    if filename is not None:
+        check_extension(filename)
+
+    if Config.SESSION_QUOTA_BYTES and size:
+        if await session_usage(redis_db, session) + size > Config.SESSION_QUOTA_BYTES:
+            raise HTTPException(413, "Session storage quota exceeded")
+
+    return session
+
+def _part_filename(header_block: bytes) -> Optional[str]:
+    for line in header_block.split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if name.strip().lower() != b"content-disposition":
+            continue
+
+        _, options = parse_options_header(value.strip())
+        if b"filename*" in options:
+            encoded = options[b"filename*"].decode("latin-1")
+            return unquote(encoded.split("''", 1)[-1])
+        if b"filename" in options:
+            return options[b"filename"].decode("utf-8", errors="ignore")
+    return None
+
+def parse_first_part(body: bytes, boundary: bytes) -> Tuple[Optional[str], bytes]:
+    delimiter = b"--" + boundary
+    start = body.find(delimiter)
+    if start < 0:
+        return None, b""
+
+    header_start = start + len(delimiter) + 2
+    header_end = body.find(b"\r\n\r\n", header_start)
+    if header_end < 0:
+        return None, b""
+
+    head = body[header_end + 4:header_end + 4 + MAGIC_BYTES]
+    end = head.find(b"\r\n" + delimiter)
+    if end >= 0:
+        head = head[:end]
+
+    return _part_filename(body[header_start:header_end]), head
+
+class UploadPreflightMiddleware:
+    # ストリーミングアップロード（POST /api/upload/{token}）を本文の受信前・受信直後に検証する。
+    # 受信前に拒否すれば Expect: 100-continue のクライアントは本文を送らない。
+    # 再開可能アップロードは /init で同じ validate_upload を、先頭チャンク（presignedモードは finalize）で check_content を行う
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        match = UPLOAD_PATH.match(scope["path"])
+        if not match:
+            await self.app(scope, receive, send)
+            return
+
+        from api.routes import get_services
+        redis_db, _, _ = get_services()
+        token = match.group(1)
+        headers = Headers(scope=scope)
+
+        try:
+            content_length = int(headers["content-length"]) if "content-length" in headers else None
+        except ValueError:
+            content_length = None
+
+        try:
+            if content_length is not None and content_length > Config.MAX_FILE_SIZE + MULTIPART_OVERHEAD:
+                raise size_limit_error()
+            session = await validate_upload(redis_db, token)
+            if Config.SESSION_QUOTA_BYTES and content_length:
+                if await session_usage(redis_db, session) + content_length - MULTIPART_OVERHEAD > Config.SESSION_QUOTA_BYTES:
+                    raise HTTPException(413, "Session storage quota exceeded")
+            # レート制限はここで消費する（本文を1バイトも受け取る前）
+            if content_length is None and bytes_limited():
+                raise HTTPException(411, "Content-Length is required")
+            await enforce_rate_limit(redis_db, upload_limits(session, content_length or 0))
+        except HTTPException as e:
+            await self._reject(scope, receive, send, e)
+            return
+
+        limit = Config.MAX_FILE_SIZE + MULTIPART_OVERHEAD
+        buffered = []
+        received = 0
+
+        _, options = parse_options_header(headers.get("content-type", ""))
+        boundary = options.get(b"boundary")
+        if boundary:
+            # 最初のパートのヘッダーと先頭バイトが揃うまで本文を先読みする
+            peeked = bytearray()
+            while True:
+                message = await receive()
+                buffered.append(message)
+                if message["type"] != "http.request":
+                    break
+                peeked.extend(message.get("body", b""))
+                header_end = peeked.find(b"\r\n\r\n")
+                if not message.get("more_body", False):
+                    break
+                if header_end >= 0 and len(peeked) >= header_end + 4 + MAGIC_BYTES + len(boundary) + 4:
+                    break
+                if len(peeked) > MULTIPART_OVERHEAD + MAGIC_BYTES:
+                    break
+
+            received = len(peeked)
+            filename, head = parse_first_part(bytes(peeked), boundary)
+            try:
+                if received > limit:
+                    raise size_limit_error()
+                if filename is not None:
+                    check_content(check_extension(filename), head)
+            except HTTPException as e:
+                await self._reject(scope, receive, send, e)
+                return
+
+        exceeded = False
+
+        async def guarded_receive():
+            nonlocal received, exceeded
+            if buffered:
+                return buffered.pop(0)
+
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                # Content-Length の無い（chunked）送信は受信量で打ち切る
+                if received > limit:
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not exceeded:
+                await send(message)
+            elif message["type"] == "http.response.start":
+                error = size_limit_error()
+                await JSONResponse({"detail": error.detail}, status_code=error.status_code)(scope, receive, send)
+
+        await self.app(scope, guarded_receive, guarded_send)
+
+    async def _reject(self, scope, receive, send, error: HTTPException):
+        logger.info(f"Upload rejected before transfer: {scope['path']} - {error.status_code} {error.detail}")
+        response = JSONResponse(
+            {"detail": error.detail},
+            status_code=error.status_code,
+            headers=error.headers
+        )
+        await response(scope, receive, send)
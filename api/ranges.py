@@ -0,0 +1,190 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from starlette.responses import Response
+
+from config import Config
+
+Range = Tuple[int, int]
+
+def file_etag(file_info: Dict[str, Any]) -> Optional[str]:
+    # 内容の SHA-256 を強い検証子として使う（faststart で書き換えた場合は書き換え後の内容）
+    file_hash = file_info.get("content_hash") or file_info.get("virus_scan_hash")
+    return f'"{file_hash}"' if file_hash else None
+
+def file_last_modified(file_info: Dict[str, Any]) -> Optional[datetime]:
+    try:
+        uploaded_at = datetime.fromisoformat(file_info["uploaded_at"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return uploaded_at.replace(tzinfo=timezone.utc, microsecond=0)
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value, usegmt=True)
+
+def parse_http_date(value: str) -> Optional[datetime]:
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def if_range_matches(if_range: Optional[str], etag: Optional[str], last_modified: Optional[datetime]) -> bool:
+    if not if_range:
+        return True
+
+    if_range = if_range.strip()
+    if if_range.startswith(('"', 'W/')):
+        # If-Range は強い比較のみ
+        return etag is not None and if_range == etag
+
+    since = parse_http_date(if_range)
+    return since is not None and last_modified is not None and since == last_modified
+
+def not_modified(if_none_match: Optional[str], if_modified_since: Optional[str],
+                 etag: Optional[str], last_modified: Optional[datetime]) -> bool:
+    # If-None-Match がある場合は If-Modified-Since より優先する（弱い比較）
+    if if_none_match:
+        if etag is None:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return any(tag.removeprefix("W/") == etag for tag in tags)
+
+    if if_modified_since and last_modified:
+        since = parse_http_date(if_modified_since)
+        return since is not None and last_modified <= since
+
+    return False
+
+def cache_headers(max_age: int) -> Dict[str, str]:
+    if max_age <= 0:
+        return {"Cache-Control": "no-cache"}
+    return {
+        "Cache-Control": f"private, max-age={max_age}",
+        "Expires": http_date(datetime.now(timezone.utc) + timedelta(seconds=max_age))
+    }
+
+def parse_range(header: str, size: int) -> Optional[List[Range]]:
+    # 戻り値: None=無視して全体を返す, []=満たせない(416), それ以外=結合済みの (start, end) のリスト
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+
+    ranges = []
+    for item in spec.split(","):
+        first, sep, last = item.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if start < 0 or (last and end < start):
+                    return None
+            else:
+                suffix = int(last)
+                if suffix < 0:
+                    return None
+                start, end = max(0, size - suffix), size - 1
+                if suffix == 0:
+                    continue
+        except ValueError:
+            return None
+
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > Config.DOWNLOAD_MAX_RANGES:
+        return None
+
+    # 重なる・隣接する範囲はまとめて MinIO への要求を減らす
+    merged: List[Range] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def content_range(start: int, end: int, size: int) -> str:
+    return f"bytes {start}-{end}/{size}"
+
+async def read_file_range(file, start: int, length: int):
+    loop = asyncio.get_event_loop()
+    fd = file.fileno()
+    offset, end = start, start + length
+    while offset < end:
+        data = await loop.run_in_executor(None, os.pread, fd, min(Config.DOWNLOAD_CHUNK_SIZE, end - offset), offset)
+        if not data:
+            break
+        offset += len(data)
+        yield data
+
+class OpenFileResponse(Response):
+    # 開いたファイルの一部を配信する。サーバーが ASGI の zerocopy 拡張に対応していれば sendfile に任せる
+    def __init__(self, file, start: int, length: int, status_code: int, headers: Dict[str, str]):
+        super().__init__(status_code=status_code, headers=headers)
+        self.file = file
+        self.start = start
+        self.length = length
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": self.file,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False
+                })
+                return
+
+            async for data in read_file_range(self.file, self.start, self.length):
+                await send({"type": "http.response.body", "body": data, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            self.file.close()
+
+class ByteRangesBody:
+    # multipart/byteranges の本文。各範囲は open_range(start, length) で必要になった時点で取得する
+    def __init__(self, open_range, ranges: List[Range], size: int, content_type: str):
+        self.open_range = open_range
+        self.ranges = ranges
+        self.size = size
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/byteranges; boundary={self.boundary}"
+        self._headers = [
+            (
+                f"\r\n--{self.boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Range: {content_range(start, end, size)}\r\n\r\n"
+            ).encode("latin-1")
+            for start, end in ranges
+        ]
+        self._trailer = f"\r\n--{self.boundary}--\r\n".encode("latin-1")
+
+    @property
+    def content_length(self) -> int:
+        body = sum(end - start + 1 for start, end in self.ranges)
+        return body + sum(len(h) for h in self._headers) + len(self._trailer)
+
+    async def __aiter__(self):
+        for (start, end), header in zip(self.ranges, self._headers):
+            yield header
+            stream = await self.open_range(start, end - start + 1)
+            if stream is None:
+                raise IOError(f"Range not readable: {start}-{end}")
+            async for chunk in stream:
+                yield chunk
+        yield self._trailer
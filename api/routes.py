@@ -1,6 +1,7 @@
 from fastapi import APIRouter, UploadFile, File, HTTPException, Request, WebSocket
-from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, Response
+from fastapi.responses import HTMLResponse, StreamingResponse, JSONResponse, ORJSONResponse, Response, RedirectResponse
 from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
 import aiofiles
 import uuid
 import asyncio
@@ -10,20 +11,42 @@ from datetime import datetime, timedelta
 from pathlib import Path
 from urllib.parse import quote
 from typing import Dict, Any
+from minio.datatypes import Part
 from config import Config
+from services import codec
+from services.bandwidth import BandwidthShaper, shaping_enabled
+from services.zip_bundle import ZipBundle, ZipEntry, entry_name
+from services.compression import accepts, choose_encoding, decode_stream, encoded_name, encoding_of
+from api.preflight import (
+    validate_upload, check_content, enforce_rate_limit, session_limits, upload_limits, MAGIC_BYTES
+)
+from api.ranges import (
+    ByteRangesBody, OpenFileResponse, cache_headers, content_range, file_etag,
+    file_last_modified, http_date, if_range_matches, not_modified, parse_range, read_file_range
+)
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
+# ステータス確認などのJSON応答も、使えるなら orjson で組み立てる
+if codec.codec_name() == "orjson":
+    JSONResponse = ORJSONResponse
+router = APIRouter(default_response_class=JSONResponse)
 templates = Jinja2Templates(directory="templates")
 
 redis_db = None
 minio = None
 integrated_scan = None
+blob_store = None
+disk_cache = None
+previews = None
+faststart = None
+bandwidth = None
+expiry = None
 
 active_connections: Dict[str, WebSocket] = {}
+post_scan_tasks = set()
 
 def get_services():
-    global redis_db, minio, integrated_scan
+    global redis_db, minio, integrated_scan, blob_store, previews, faststart
     
     if redis_db is None:
         from services.redis_db import RedisDB
@@ -40,14 +63,167 @@ def get_services():
         from services.integrated_scan import IntegratedScanService
         integrated_scan = IntegratedScanService()
         integrated_scan.redis_db = redis_db
+        integrated_scan.minio = minio
+        integrated_scan.virustotal.redis_db = redis_db
+        integrated_scan.virustotal.minio = minio
+    
+    if blob_store is None and minio is not None:
+        from services.blob_store import BlobStoreService
+        blob_store = BlobStoreService(redis_db, minio)
+        integrated_scan.blobs = blob_store
+    
+    if previews is None and minio is not None and Config.PREVIEW_ENABLED:
+        from services import preview
+        if preview.available():
+            previews = preview.PreviewService(minio)
+            integrated_scan.previews = previews
+    
+    if faststart is None and minio is not None and Config.FASTSTART_ENABLED:
+        from services.faststart import FaststartService
+        faststart = FaststartService(redis_db, minio)
+        integrated_scan.faststart = faststart
     
     return redis_db, minio, integrated_scan
 
+def get_blob_store():
+    get_services()
+    return blob_store
+
+def get_previews():
+    get_services()
+    return previews
+
+def get_faststart():
+    get_services()
+    return faststart
+
+def get_expiry():
+    global expiry
+    
+    if expiry is None and Config.EXPIRY_REAPER_ENABLED:
+        redis_db, minio, _ = get_services()
+        if minio is not None:
+            from services.expiry import ExpiryReaper
+            expiry = ExpiryReaper(redis_db, minio)
+    
+    return expiry
+
+def get_bandwidth():
+    global bandwidth
+    
+    if bandwidth is None and shaping_enabled():
+        bandwidth = BandwidthShaper()
+    
+    return bandwidth
+
+def _shaped(stream, token: str):
+    shaper = get_bandwidth()
+    return shaper.shape(stream, token) if shaper else stream
+
+def get_disk_cache():
+    global disk_cache
+    
+    if disk_cache is None and Config.DOWNLOAD_CACHE_DIR:
+        _, minio, _ = get_services()
+        if minio is not None:
+            from services.disk_cache import DiskCacheService
+            try:
+                disk_cache = DiskCacheService(minio)
+            except Exception as e:
+                logger.error(f"Failed to initialize disk cache: {e}")
+    
+    return disk_cache
+
+def _progress_notifier(token: str):
+    async def progress_callback(percent: float, message: str):
+        if token in active_connections:
+            try:
+                await active_connections[token].send_json({
+                    "type": "progress",
+                    "percent": percent,
+                    "message": message
+                })
+            except:
+                pass
+    
+    return progress_callback
+
+async def _notify_error(token: str, message: str):
+    if token in active_connections:
+        try:
+            await active_connections[token].send_json({
+                "type": "error",
+                "message": message
+            })
+        except:
+            pass
+
+async def _save_file_record(redis_db, token: str, session: Dict[str, Any], file_id: str,
+                            filename: str, content_type: str, file_path: str,
+                            scan_result: Dict[str, Any], blob_hash: str = None) -> Dict[str, Any]:
+    file_size = scan_result['file_size']
+
+    configured_tz = Config.get_timezone()
+    upload_time_local = datetime.now(configured_tz)
+    
+    file_info_data = {
+        "original_name": filename,
+        "stored_name": file_path,
+        "size": file_size,
+        "mime_type": content_type,
+        "uploaded_at": datetime.utcnow().isoformat(),
+        "uploaded_at_local": upload_time_local.strftime('%Y-%m-%d %H:%M:%S'),
+        "virus_scan": scan_result['overall_status'],
+        "clamav_result": scan_result['clamav_result'],
+        "virustotal_result": scan_result['virustotal_result'],
+        "virus_scan_hash": scan_result['file_hash'],
+        "minio_path": file_path,
+        "download_enabled": True
+    }
+    if blob_hash:
+        file_info_data["blob_hash"] = blob_hash
+    if encoding_of(file_path):
+        file_info_data["content_encoding"] = encoding_of(file_path)
+    
+    await redis_db.set_file(session["session_id"], file_id, file_info_data)
+    
+    previews = get_previews()
+    if previews:
+        previews.schedule(file_info_data)
+    
+    faststart = get_faststart()
+    if faststart:
+        faststart.schedule(session["session_id"], file_id, file_info_data)
+    
+    await redis_db.add_session_file(token, file_id)
+    
+    logger.info(f"File uploaded successfully: {filename} ({file_size} bytes)")
+    
+    warning = None
+    if scan_result['overall_status'] == 'suspicious':
+        warning = "File was flagged as suspicious but upload was allowed"
+    elif scan_result['virustotal_result'] == 'unknown':
+        warning = "VirusTotal verification not available, but ClamAV marked file as safe"
+    
+    return {
+        "success": True,
+        "file_id": file_id,
+        "filename": filename,
+        "size": file_size,
+        "virus_scan": scan_result['overall_status'],
+        "clamav_result": scan_result['clamav_result'],
+        "virustotal_result": scan_result['virustotal_result'],
+        "download_url": f"/file/{token}/{file_id}",
+        "warning": warning
+    }
+
 @router.post("/api/create_session")
 async def create_session(data: dict):
     try:
         redis_db, _, _ = get_services()
         
+        await enforce_rate_limit(redis_db, session_limits(data.get("discord_user_id"), data.get("discord_server_id")))
+        
         token = str(uuid.uuid4())
         session_data = {
             "session_id": str(uuid.uuid4()),
@@ -64,6 +240,8 @@ async def create_session(data: dict):
         logger.info(f"Session created: {token} for user {data['discord_username']}")
         
         return {"token": token, "expires_at": session_data["expires_at"]}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error creating session: {e}")
         raise HTTPException(500, "Failed to create session")
@@ -72,7 +250,7 @@ async def create_session(data: dict):
 async def upload_page(token: str, request: Request):
     redis_db, _, _ = get_services()
     
-    session = await redis_db.get_session(token)
+    session = await redis_db.get_session(token, files=False)
     if not session:
         return templates.TemplateResponse("error.html", {
             "request": request,
@@ -82,7 +260,9 @@ async def upload_page(token: str, request: Request):
     return templates.TemplateResponse("upload.html", {
         "request": request,
         "token": token,
-        "expires_at": session["expires_at"]
+        "expires_at": session["expires_at"],
+        "upload_mode": Config.UPLOAD_MODE,
+        "resumable_chunk_size": Config.RESUMABLE_CHUNK_SIZE
     })
 
 @router.websocket("/ws/upload/{token}")
@@ -101,38 +281,23 @@ async def upload_websocket(websocket: WebSocket, token: str):
 
 @router.post("/api/upload/{token}")
 async def upload_file(token: str, file: UploadFile = File(...)):
+    upload = None
+    blob_hash = None
+    blob_held = False
+    committed_path = None
     try:
         redis_db, minio, scan_service = get_services()
         
         if minio is None:
             raise HTTPException(503, "Storage service is unavailable")
         
-        session = await redis_db.get_session(token)
-        if not session:
-            raise HTTPException(404, "Invalid session")
-        
-        contents = await file.read()
-        file_size = len(contents)
-        
-        if file_size > Config.MAX_FILE_SIZE:
-            raise HTTPException(413, f"File size exceeds {Config.MAX_FILE_SIZE // (1024**3)}GB limit")
-        
+        file_size = file.size
+        session = await validate_upload(redis_db, token, file.filename, file_size)
         file_ext = Path(file.filename).suffix.lower()
-        if file_ext not in Config.ALLOWED_EXTENSIONS:
-            raise HTTPException(415, f"File type not allowed: {file_ext}")
         
         file_id = str(uuid.uuid4())
         
-        async def progress_callback(percent: float, message: str):
-            if token in active_connections:
-                try:
-                    await active_connections[token].send_json({
-                        "type": "progress",
-                        "percent": percent,
-                        "message": message
-                    })
-                except:
-                    pass
+        progress_callback = _progress_notifier(token)
         
         await progress_callback(5, "スキャン準備中...")
         
@@ -149,107 +314,560 @@ async def upload_file(token: str, file: UploadFile = File(...)):
             "discord_username": session.get("discord_username")
         }
         
-        scan_result = await scan_service.scan_file(
-            contents,
+        # 圧縮しやすい形式は MinIO へ書き込む際に圧縮する（ハッシュとスキャンは元の内容に対して行う）
+        encoding = choose_encoding(file_ext)
+        safe_filename = file.filename.encode('utf-8', 'ignore').decode('utf-8')
+        file_path = encoded_name(f"uploads/{datetime.utcnow().strftime('%Y-%m-%d')}/{file_id}_{safe_filename}", encoding)
+        
+        stored_path = None
+        if Config.STORAGE_DEDUP:
+            # 先に手元の一時ファイルからハッシュを求め、同じ内容が保存済みならMinIOへの書き込みを省く
+            blob_hash = await blob_store.hash_file(file.file)
+            file_info["sha256"] = blob_hash
+            stored_path = await blob_store.acquire(blob_hash, session["session_id"], file_id)
+            blob_held = stored_path is not None
+            file_path = stored_path or encoded_name(blob_store.object_name(blob_hash, file_id), encoding)
+        elif (Config.VERDICT_CACHE_ENABLED or Config.SCAN_SINGLE_FLIGHT) and not Config.SCAN_QUEUE_ENABLED:
+            # 判定キャッシュや進行中のスキャンはハッシュで引くので、手元の一時ファイルから先に求めておく
+            file_info["sha256"] = await blob_store.hash_file(file.file)
+        
+        # 同じ内容が保存済みでなければ MinIO への書き込みを始める（完了させるのはスキャンで clean と判定されてから）
+        if not stored_path:
+            upload = await minio.start_multipart_upload(file_path, file.content_type, encoding)
+        
+        async def read_chunks():
+            while True:
+                chunk = await file.read(Config.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        
+        async def rewind():
+            await file.seek(0)
+            return file.file
+        
+        async def commit():
+            # 書き込んだオブジェクトはレコードを保存するまで、失敗時に消す対象として覚えておく
+            nonlocal upload, committed_path
+            success = await upload.complete()
+            upload = None
+            if not success:
+                raise HTTPException(500, "Failed to save file")
+            committed_path = file_path
+        
+        async def store():
+            stored = upload
+            async for chunk in read_chunks():
+                await stored.write(chunk)
+            await commit()
+            return stored.sha256.hexdigest(), stored.size
+        
+        async def share():
+            # 初めての内容は書き込んだオブジェクトを共有オブジェクトとして登録する（以降は参照の解放で片付く）
+            nonlocal file_path, blob_held, committed_path
+            file_path = await blob_store.register(blob_hash, session["session_id"], file_id, file_path)
+            blob_held = True
+            committed_path = None
+        
+        if Config.SCAN_QUEUE_ENABLED:
+            # 転送と保存だけを行い、スキャンはキューのワーカーに任せる
+            if upload:
+                file_info["sha256"], file_info["size"] = await store()
+                if blob_hash:
+                    await share()
+            
+            await progress_callback(95, "ファイル保存中...")
+            
+            scan_result = _pending_scan_result(file_info["size"])
+            scan_result["file_hash"] = file_info["sha256"]
+            
+            response = await _save_file_record(
+                redis_db, token, session, file_id,
+                file.filename, file.content_type, file_path, scan_result, blob_hash
+            )
+            blob_held = False
+            committed_path = None
+            await _schedule_scan(session["session_id"], file_id, file_path, file_info, session_info)
+            
+            await progress_callback(100, "完了！")
+            
+            return JSONResponse(response)
+        
+        # スキャンしながら MinIO へ書き込み、clean と判定された場合だけ完了させる
+        scan_result = await scan_service.scan_stream(
+            read_chunks(),
             file_info,
             session_info,
-            progress_callback
+            progress_callback,
+            sink=upload,
+            rewind=rewind
         )
         
         if not scan_result['allow_upload']:
             logger.warning(f"File rejected: {file.filename} - {scan_result['rejection_reason']}")
-            
-            if token in active_connections:
-                await active_connections[token].send_json({
-                    "type": "error",
-                    "message": scan_result['rejection_reason']
-                })
-            
+            await _notify_error(token, scan_result['rejection_reason'])
             raise HTTPException(400, scan_result['rejection_reason'])
         
         await progress_callback(95, "ファイル保存中...")
         
-        await file.seek(0)
+        if upload:
+            await commit()
+            if blob_hash:
+                await share()
+
+        response = await _save_file_record(
+            redis_db, token, session, file_id,
+            file.filename, file.content_type, file_path, scan_result, blob_hash
+        )
+        blob_held = False
+        committed_path = None
         
-        safe_filename = file.filename.encode('utf-8', 'ignore').decode('utf-8')
-        file_path = f"uploads/{datetime.utcnow().strftime('%Y-%m-%d')}/{file_id}_{safe_filename}"
+        await progress_callback(100, "完了！")
         
-        success = await minio.upload_file(file, file_path)
-        if not success:
-            raise HTTPException(500, "Failed to save file")
-
-        configured_tz = Config.get_timezone()
-        upload_time_local = datetime.now(configured_tz)
+        return JSONResponse(response)
         
-        file_info_data = {
-            "original_name": file.filename,
-            "stored_name": file_path,
-            "size": file_size,
-            "mime_type": file.content_type,
-            "uploaded_at": datetime.utcnow().isoformat(),
-            "uploaded_at_local": upload_time_local.strftime('%Y-%m-%d %H:%M:%S'),
-            "virus_scan": scan_result['overall_status'],
-            "clamav_result": scan_result['clamav_result'],
-            "virustotal_result": scan_result['virustotal_result'],
-            "virus_scan_hash": scan_result['file_hash'],
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Upload error: {e}")
+        raise HTTPException(500, f"Error occurred during upload: {str(e)}")
+    finally:
+        if upload:
+            await upload.abort()
+        if blob_held:
+            await blob_store.release(blob_hash, session["session_id"], file_id)
+        elif committed_path:
+            await minio.delete_file(committed_path)
+
+def _pending_scan_result(file_size: int) -> Dict[str, Any]:
+    return {
+        "file_size": file_size,
+        "file_hash": None,
+        "overall_status": "pending",
+        "clamav_result": "pending",
+        "virustotal_result": "pending"
+    }
+
+async def _schedule_scan(session_id: str, file_id: str, file_path: str,
+                         file_info: Dict[str, Any], session_info: Dict[str, Any]):
+    if Config.SCAN_QUEUE_ENABLED:
+        redis_db, _, _ = get_services()
+        job = {
+            "job_id": file_id,
+            "session_id": session_id,
+            "file_id": file_id,
             "minio_path": file_path,
-            "download_enabled": True
+            "file_info": file_info,
+            "session_info": session_info,
+            "queued_at": datetime.utcnow().isoformat()
         }
+        if await redis_db.enqueue_scan_job(file_id, job):
+            logger.info(f"Scan job queued for {file_id}")
+            return
+        logger.warning(f"Failed to queue scan job for {file_id}, scanning in-process")
+    
+    task = asyncio.create_task(_post_scan(session_id, file_id, file_path, file_info, session_info))
+    post_scan_tasks.add(task)
+    task.add_done_callback(post_scan_tasks.discard)
+
+async def _post_scan(session_id: str, file_id: str, file_path: str,
+                     file_info: Dict[str, Any], session_info: Dict[str, Any]):
+    _, _, scan_service = get_services()
+    
+    try:
+        scan_result = await scan_service.scan_object(file_path, file_info, session_info)
+    except Exception as e:
+        logger.error(f"Post-upload scan failed for {file_id}: {e}")
+        scan_result = scan_service.error_result(file_info, str(e))
+    
+    await scan_service.apply_scan_result(session_id, file_id, file_path, scan_result)
+    logger.info(f"Post-upload scan finished for {file_id}: {scan_result['overall_status']}")
+
+def _resumable_offset(parts: Dict[int, Dict[str, Any]]) -> int:
+    offset = 0
+    part_number = 1
+    while part_number in parts:
+        offset += parts[part_number]["size"]
+        part_number += 1
+    return offset
+
+async def _get_upload_parts(redis_db, minio, upload_id: str, upload: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+    # presignedモードではブラウザがMinIOへ直接書き込むため、パート一覧はMinIOに問い合わせる
+    if upload.get("mode") == "presigned":
+        return await minio.list_parts(upload["minio_path"], upload["multipart_id"])
+    return await redis_db.get_upload_parts(upload_id)
+
+async def _get_resumable_upload(redis_db, token: str, upload_id: str) -> Dict[str, Any]:
+    upload = await redis_db.get_upload(upload_id)
+    if not upload or upload["token"] != token:
+        raise HTTPException(404, "Upload not found")
+    return upload
+
+@router.post("/api/upload/{token}/preflight")
+async def preflight_upload(token: str, data: dict):
+    # 本文を送る前にセッション・サイズ・拡張子・レート制限を確認する
+    redis_db, _, _ = get_services()
+    
+    filename = data.get("filename")
+    if not filename:
+        raise HTTPException(400, "filename is required")
+    
+    try:
+        file_size = int(data.get("size"))
+    except (TypeError, ValueError):
+        raise HTTPException(400, "size is required")
+    
+    session = await validate_upload(redis_db, token, filename, file_size)
+    await enforce_rate_limit(redis_db, upload_limits(session, file_size), dry_run=True)
+    
+    return {
+        "ok": True,
+        "max_size": Config.MAX_FILE_SIZE,
+        "chunk_size": Config.RESUMABLE_CHUNK_SIZE,
+        "mode": Config.UPLOAD_MODE
+    }
+
+@router.post("/api/upload/{token}/init")
+async def init_resumable_upload(token: str, data: dict):
+    try:
+        redis_db, minio, _ = get_services()
         
-        await redis_db.set_file(session["session_id"], file_id, file_info_data)
+        if minio is None:
+            raise HTTPException(503, "Storage service is unavailable")
         
-        session["files"].append(file_id)
-        session["status"] = "uploaded"
-        await redis_db.set_session(token, session)
+        filename = data.get("filename")
+        if not filename:
+            raise HTTPException(400, "filename is required")
         
-        await progress_callback(100, "完了！")
+        try:
+            file_size = int(data.get("size"))
+        except (TypeError, ValueError):
+            raise HTTPException(400, "size is required")
         
-        logger.info(f"File uploaded successfully: {file.filename} ({file_size} bytes)")
+        session = await validate_upload(redis_db, token, filename, file_size)
+        await enforce_rate_limit(redis_db, upload_limits(session, file_size))
+        file_ext = Path(filename).suffix.lower()
         
-        warning = None
-        if scan_result['overall_status'] == 'suspicious':
-            warning = "File was flagged as suspicious but upload was allowed"
-        elif scan_result['virustotal_result'] == 'unknown':
-            warning = "VirusTotal verification not available, but ClamAV marked file as safe"
+        content_type = data.get("content_type") or "application/octet-stream"
+        file_id = str(uuid.uuid4())
+        safe_filename = filename.encode('utf-8', 'ignore').decode('utf-8')
+        file_path = f"uploads/{datetime.utcnow().strftime('%Y-%m-%d')}/{file_id}_{safe_filename}"
         
-        return JSONResponse({
-            "success": True,
+        upload_id = str(uuid.uuid4())
+        upload_data = {
+            "token": token,
             "file_id": file_id,
-            "filename": file.filename,
+            "filename": filename,
             "size": file_size,
-            "virus_scan": scan_result['overall_status'],
-            "clamav_result": scan_result['clamav_result'],
-            "virustotal_result": scan_result['virustotal_result'],
-            "download_url": f"/file/{token}/{file_id}",
-            "warning": warning
-        })
+            "extension": file_ext,
+            "content_type": content_type,
+            "minio_path": file_path,
+            "multipart_id": await minio.create_multipart_upload(file_path, content_type),
+            "chunk_size": Config.RESUMABLE_CHUNK_SIZE,
+            "mode": Config.UPLOAD_MODE,
+            "status": "uploading",
+            "created_at": datetime.utcnow().isoformat()
+        }
+        
+        await redis_db.set_upload(upload_id, upload_data)
+        logger.info(f"Resumable upload started: {upload_id} ({filename}, {file_size} bytes) for session {token}")
+        
+        return {
+            "upload_id": upload_id,
+            "chunk_size": upload_data["chunk_size"],
+            "mode": upload_data["mode"],
+            "offset": 0
+        }
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Upload error: {e}")
+        logger.error(f"Error starting resumable upload: {e}")
+        raise HTTPException(500, "Failed to start upload")
+
+@router.head("/api/upload/{token}/{upload_id}")
+async def get_upload_offset(token: str, upload_id: str):
+    redis_db, minio, _ = get_services()
+    
+    upload = await _get_resumable_upload(redis_db, token, upload_id)
+    parts = {}
+    if upload["status"] == "uploading":
+        if minio is None:
+            raise HTTPException(503, "Storage service is unavailable")
+        parts = await _get_upload_parts(redis_db, minio, upload_id, upload)
+    
+    return Response(status_code=200, headers={
+        "Upload-Offset": str(_resumable_offset(parts) if parts else 0),
+        "Upload-Length": str(upload["size"]),
+        "Upload-Chunk-Size": str(upload["chunk_size"]),
+        "Upload-Mode": upload.get("mode", "proxy"),
+        "Upload-Status": upload["status"],
+        "Cache-Control": "no-store"
+    })
+
+@router.patch("/api/upload/{token}/{upload_id}")
+async def upload_chunk(token: str, upload_id: str, request: Request):
+    try:
+        redis_db, minio, _ = get_services()
+        
+        if minio is None:
+            raise HTTPException(503, "Storage service is unavailable")
+        
+        upload = await _get_resumable_upload(redis_db, token, upload_id)
+        if upload["status"] != "uploading":
+            raise HTTPException(409, "Upload is already finalized")
+        if upload.get("mode") == "presigned":
+            raise HTTPException(409, "Chunks must be uploaded directly to storage")
+        
+        try:
+            offset = int(request.headers["Upload-Offset"])
+        except (KeyError, ValueError):
+            raise HTTPException(400, "Upload-Offset header is required")
+        
+        chunk_size = upload["chunk_size"]
+        parts = await redis_db.get_upload_parts(upload_id)
+        current_offset = _resumable_offset(parts)
+        
+        # チャンク境界 = MinIOのパート境界。既に受け取ったパートの再送は上書きになるだけなので許可する
+        if offset % chunk_size != 0 or offset > current_offset:
+            raise HTTPException(409, "Offset mismatch", headers={"Upload-Offset": str(current_offset)})
+        
+        expected = min(chunk_size, upload["size"] - offset)
+        if expected <= 0:
+            raise HTTPException(400, "Offset is beyond the end of the file")
+        
+        body = bytearray()
+        async for data in request.stream():
+            body.extend(data)
+            if len(body) > expected:
+                raise HTTPException(413, "Chunk is larger than expected")
+        
+        if len(body) != expected:
+            raise HTTPException(400, "Incomplete chunk", headers={"Upload-Offset": str(current_offset)})
+        
+        if offset == 0:
+            check_content(upload["extension"], bytes(body[:MAGIC_BYTES]))
+        
+        chunk_hash = hashlib.sha256(body).hexdigest()
+        client_hash = request.headers.get("X-Chunk-SHA256")
+        if client_hash and client_hash.lower() != chunk_hash:
+            raise HTTPException(400, "Chunk checksum mismatch", headers={"Upload-Offset": str(current_offset)})
+        
+        part_number = offset // chunk_size + 1
+        etag = await minio.upload_part(upload["minio_path"], upload["multipart_id"], part_number, bytes(body))
+        
+        part_info = {"etag": etag, "size": len(body), "sha256": chunk_hash}
+        await redis_db.set_upload_part(upload_id, part_number, part_info)
+        parts[part_number] = part_info
+        
+        return Response(status_code=204, headers={"Upload-Offset": str(_resumable_offset(parts))})
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Chunk upload error for {upload_id}: {e}")
+        raise HTTPException(500, "Failed to store chunk")
+
+@router.get("/api/upload/{token}/{upload_id}/part/{part_number}")
+async def get_part_upload_url(token: str, upload_id: str, part_number: int):
+    redis_db, minio, _ = get_services()
+    
+    if minio is None:
+        raise HTTPException(503, "Storage service is unavailable")
+    
+    upload = await _get_resumable_upload(redis_db, token, upload_id)
+    if upload.get("mode") != "presigned":
+        raise HTTPException(409, "Upload is not in presigned mode")
+    if upload["status"] != "uploading":
+        raise HTTPException(409, "Upload is already finalized")
+    
+    part_count = max(1, -(-upload["size"] // upload["chunk_size"]))
+    if part_number < 1 or part_number > part_count:
+        raise HTTPException(400, "Invalid part number")
+    
+    offset = (part_number - 1) * upload["chunk_size"]
+    
+    return JSONResponse({
+        "url": minio.presigned_upload_part_url(upload["minio_path"], upload["multipart_id"], part_number),
+        "offset": offset,
+        "length": min(upload["chunk_size"], upload["size"] - offset),
+        "expires_in": Config.PRESIGNED_URL_EXPIRY
+    }, headers={"Cache-Control": "no-store"})
+
+@router.post("/api/upload/{token}/{upload_id}/finalize")
+async def finalize_upload(token: str, upload_id: str):
+    lock_key = f"upload:{upload_id}:finalize"
+    locked = False
+    try:
+        redis_db, minio, scan_service = get_services()
+        
+        if minio is None:
+            raise HTTPException(503, "Storage service is unavailable")
+        
+        upload = await _get_resumable_upload(redis_db, token, upload_id)
+        
+        if upload["status"] == "completed":
+            return JSONResponse(upload["result"])
+        if upload["status"] == "rejected":
+            raise HTTPException(400, upload["rejection_reason"])
+        
+        session = await redis_db.get_session(token, files=False)
+        if not session:
+            raise HTTPException(404, "Invalid session")
+        
+        # 再試行された finalize が同時にスキャンを走らせないようにする
+        locked = await redis_db.set_if_absent(lock_key, upload_id, expire=Config.CLAMAV_TIMEOUT + 300)
+        if not locked:
+            return JSONResponse({"status": "scanning"}, status_code=202)
+        
+        upload = await _get_resumable_upload(redis_db, token, upload_id)
+        if upload["status"] == "completed":
+            return JSONResponse(upload["result"])
+        
+        file_path = upload["minio_path"]
+        
+        if upload["status"] == "uploading":
+            parts = await _get_upload_parts(redis_db, minio, upload_id, upload)
+            offset = _resumable_offset(parts)
+            if offset != upload["size"]:
+                raise HTTPException(409, "Upload is incomplete", headers={"Upload-Offset": str(offset)})
+            
+            if not parts:
+                parts[1] = {"etag": await minio.upload_part(file_path, upload["multipart_id"], 1, b""), "size": 0}
+            
+            part_count = max(1, -(-upload["size"] // upload["chunk_size"]))
+            await minio.complete_multipart_upload(
+                file_path,
+                upload["multipart_id"],
+                [Part(n, parts[n]["etag"]) for n in range(1, part_count + 1)]
+            )
+            
+            # presignedモードの先頭チャンクはAPIを通らないので、保存後に内容の種類を確認する
+            if upload.get("mode") == "presigned":
+                try:
+                    check_content(upload["extension"], await minio.get_bytes(file_path, 0, MAGIC_BYTES) or b"")
+                except HTTPException as e:
+                    await minio.delete_file(file_path)
+                    upload["status"] = "rejected"
+                    upload["rejection_reason"] = e.detail
+                    await redis_db.set_upload(upload_id, upload)
+                    raise
+            
+            upload["status"] = "scanning"
+            await redis_db.set_upload(upload_id, upload)
+        
+        file_info = {
+            "uuid": upload["file_id"],
+            "name": upload["filename"],
+            "size": upload["size"],
+            "extension": upload["extension"]
+        }
+        
+        session_info = {
+            "token": token,
+            "discord_user_id": session.get("discord_user_id"),
+            "discord_username": session.get("discord_username")
+        }
+        
+        if upload.get("mode") == "presigned" or Config.SCAN_QUEUE_ENABLED:
+            # pending として登録し、スキャンはバックグラウンドで行う
+            response = await _save_file_record(
+                redis_db, token, session, upload["file_id"],
+                upload["filename"], upload["content_type"], file_path,
+                _pending_scan_result(upload["size"])
+            )
+            
+            upload["status"] = "completed"
+            upload["result"] = response
+            await redis_db.set_upload(upload_id, upload)
+            
+            await _schedule_scan(session["session_id"], upload["file_id"], file_path, file_info, session_info)
+            
+            return JSONResponse(response)
+        
+        progress_callback = _progress_notifier(token)
+        await progress_callback(5, "スキャン準備中...")
+        
+        scan_result = await scan_service.scan_object(file_path, file_info, session_info, progress_callback)
+        
+        if not scan_result['allow_upload']:
+            logger.warning(f"File rejected: {upload['filename']} - {scan_result['rejection_reason']}")
+            await minio.delete_file(file_path)
+            
+            upload["status"] = "rejected"
+            upload["rejection_reason"] = scan_result['rejection_reason']
+            await redis_db.set_upload(upload_id, upload)
+            
+            await _notify_error(token, scan_result['rejection_reason'])
+            raise HTTPException(400, scan_result['rejection_reason'])
+        
+        blob_hash = None
+        if Config.STORAGE_DEDUP and scan_result['file_hash']:
+            stored_path = await blob_store.adopt(
+                scan_result['file_hash'], session["session_id"], upload["file_id"], file_path
+            )
+            if stored_path:
+                file_path = stored_path
+                blob_hash = scan_result['file_hash']
+        
+        response = await _save_file_record(
+            redis_db, token, session, upload["file_id"],
+            upload["filename"], upload["content_type"], file_path, scan_result, blob_hash
+        )
+        
+        upload["status"] = "completed"
+        upload["result"] = response
+        await redis_db.set_upload(upload_id, upload)
+        
+        await progress_callback(100, "完了！")
+        
+        return JSONResponse(response)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Finalize error for {upload_id}: {e}")
         raise HTTPException(500, f"Error occurred during upload: {str(e)}")
+    finally:
+        if locked:
+            await redis_db.delete(lock_key)
+
+@router.delete("/api/upload/{token}/{upload_id}")
+async def abort_resumable_upload(token: str, upload_id: str):
+    redis_db, minio, _ = get_services()
+    
+    upload = await _get_resumable_upload(redis_db, token, upload_id)
+    if upload["status"] != "uploading":
+        raise HTTPException(409, "Upload is already finalized")
+    
+    if minio:
+        await minio.abort_multipart_upload(upload["minio_path"], upload["multipart_id"])
+    await redis_db.delete_upload(upload_id)
+    
+    return Response(status_code=204)
 
 @router.get("/file/{token}/{file_id}")
 async def file_info_page(token: str, file_id: str, request: Request):
     try:
         redis_db, _, scan_service = get_services()
         
-        session = await redis_db.get_session(token)
-        if not session or file_id not in session["files"]:
+        # セッション・ファイル情報・スキャン結果は1往復でまとめて読む
+        context = await redis_db.get_file_context(token, file_id, scan_result=True)
+        if not context:
             return templates.TemplateResponse("error.html", {
                 "request": request,
                 "error": "File not found"
             })
         
-        file_info = await redis_db.get_file(session["session_id"], file_id)
+        session, file_info, scan_status, _ = context
         if not file_info:
             return templates.TemplateResponse("error.html", {
                 "request": request,
                 "error": "File information not found"
             })
         
-        scan_status = await scan_service.get_scan_status(file_id)
+        if not scan_status:
+            scan_status = await scan_service.find_scan_log(file_id)
         
         size = file_info['size']
         if size < 1024:
@@ -266,12 +884,16 @@ async def file_info_page(token: str, file_id: str, request: Request):
         is_image = mime_type.startswith('image/')
         is_audio = mime_type.startswith('audio/')
         is_pdf = mime_type == 'application/pdf'
+        previews = get_previews()
+        has_preview = previews is not None and previews.can_preview(file_info)
         
         allow_download = True
         if file_info.get('virus_scan') == 'infected':
             allow_download = False
         elif file_info.get('virus_scan') == 'pending' and not Config.ALLOW_PENDING_DOWNLOAD:
             allow_download = False
+        elif not file_info.get('download_enabled', True):
+            allow_download = False
         
         return templates.TemplateResponse("download.html", {
             "request": request,
@@ -285,6 +907,7 @@ async def file_info_page(token: str, file_id: str, request: Request):
             "virustotal_status": file_info.get('virustotal_result', 'unknown'),
             "is_video": is_video,
             "is_image": is_image,
+            "has_preview": has_preview,
             "is_audio": is_audio,
             "is_pdf": is_pdf,
             "mime_type": mime_type,
@@ -305,15 +928,16 @@ async def get_file_status(token: str, file_id: str):
     try:
         redis_db, _, scan_service = get_services()
         
-        session = await redis_db.get_session(token)
-        if not session or file_id not in session["files"]:
+        context = await redis_db.get_file_context(token, file_id, scan_result=True)
+        if not context:
             raise HTTPException(404, "File not found")
         
-        file_info = await redis_db.get_file(session["session_id"], file_id)
+        _, file_info, scan_status, _ = context
         if not file_info:
             raise HTTPException(404, "File information not found")
         
-        scan_status = await scan_service.get_scan_status(file_id)
+        if not scan_status:
+            scan_status = await scan_service.find_scan_log(file_id)
         
         return JSONResponse({
             "virus_scan": file_info.get("virus_scan", "unknown"),
@@ -329,8 +953,8 @@ async def get_file_status(token: str, file_id: str):
         logger.error(f"Error getting file status: {e}")
         raise HTTPException(500, "Failed to retrieve status")
 
-@router.get("/download/{token}/{file_id}")
-async def download_file(token: str, file_id: str):
+@router.get("/download/{token}/bundle")
+async def download_bundle(token: str, request: Request):
     try:
         redis_db, minio, _ = get_services()
         
@@ -338,10 +962,108 @@ async def download_file(token: str, file_id: str):
             raise HTTPException(503, "Storage service is unavailable")
         
         session = await redis_db.get_session(token)
-        if not session or file_id not in session["files"]:
+        if not session:
+            raise HTTPException(404, "File not found")
+        
+        entries = []
+        used_names = {}
+        pending = False
+        for file_id in session["files"]:
+            file_info = await redis_db.get_file(session["session_id"], file_id)
+            if not file_info:
+                continue
+            # 個別ダウンロードでブロックされるファイルは含めない
+            if file_info.get("virus_scan") == "infected" or file_info.get("clamav_result") == "infected":
+                continue
+            if file_info.get("virus_scan") == "pending" and not Config.ALLOW_PENDING_DOWNLOAD:
+                continue
+            if not file_info.get("download_enabled", True):
+                continue
+            
+            pending = pending or file_info.get("virus_scan") == "pending"
+            try:
+                modified = datetime.strptime(file_info["uploaded_at_local"], '%Y-%m-%d %H:%M:%S')
+            except (KeyError, ValueError):
+                modified = datetime.utcnow()
+            entries.append(ZipEntry(
+                entry_name(file_info["original_name"], used_names),
+                file_info["minio_path"], file_info["size"], modified,
+                file_info.get("content_hash") or file_info.get("virus_scan_hash")
+            ))
+        
+        if not entries:
+            raise HTTPException(404, "No downloadable files in this session")
+        
+        crcs = await redis_db.get_crc32s([entry.file_hash for entry in entries if entry.file_hash])
+        for entry in entries:
+            entry.crc = crcs.get(entry.file_hash)
+        
+        bundle = ZipBundle(minio, entries)
+        etag = bundle.etag
+        max_age = 0 if pending else await redis_db.get_session_ttl(token)
+        validators = {"ETag": etag, **cache_headers(max_age)}
+        
+        if not_modified(request.headers.get("if-none-match"), None, etag, None):
+            return Response(status_code=304, headers=validators)
+        
+        headers = {
+            "Content-Disposition": f"attachment; filename=\"discshare-{token[:8]}.zip\"",
+            "Content-Type": "application/zip",
+            # CRC-32 が揃うまで（最初の全体ダウンロードが終わるまで）は Range に応じられない
+            "Accept-Ranges": "bytes" if bundle.crcs_known() else "none",
+            **validators
+        }
+        
+        ranges = None
+        range_header = request.headers.get("range")
+        if range_header and bundle.crcs_known() and \
+                if_range_matches(request.headers.get("if-range"), etag, None):
+            ranges = parse_range(range_header, bundle.content_length)
+            if ranges == []:
+                return Response(status_code=416, headers={"Content-Range": f"bytes */{bundle.content_length}"})
+        
+        if ranges and len(ranges) > 1:
+            body = ByteRangesBody(bundle.open_range, ranges, bundle.content_length, "application/zip")
+            headers["Content-Type"] = body.content_type
+            headers["Content-Length"] = str(body.content_length)
+            return StreamingResponse(_shaped(body, token), status_code=206, media_type=body.content_type, headers=headers)
+        
+        if ranges:
+            start, end = ranges[0]
+            headers["Content-Range"] = content_range(start, end, bundle.content_length)
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(
+                _shaped(await bundle.open_range(start, end - start + 1), token),
+                status_code=206, media_type="application/zip", headers=headers
+            )
+        
+        async def save_crc(entry, crc):
+            if entry.file_hash:
+                await redis_db.set_crc32(entry.file_hash, crc)
+        
+        logger.info(f"Bundle downloaded: {len(entries)} files ({bundle.content_length} bytes) from session {token}")
+        headers["Content-Length"] = str(bundle.content_length)
+        return StreamingResponse(_shaped(bundle.stream(save_crc), token), media_type="application/zip", headers=headers)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Bundle download error: {e}")
+        raise HTTPException(500, "Error occurred during download")
+
+@router.get("/download/{token}/{file_id}")
+async def download_file(token: str, file_id: str, request: Request):
+    try:
+        redis_db, minio, _ = get_services()
+        
+        if minio is None:
+            raise HTTPException(503, "Storage service is unavailable")
+        
+        context = await redis_db.get_file_context(token, file_id)
+        if not context:
             raise HTTPException(404, "File not found")
         
-        file_info = await redis_db.get_file(session["session_id"], file_id)
+        _, file_info, _, session_ttl = context
         if not file_info:
             raise HTTPException(404, "File information not found")
         
@@ -351,33 +1073,171 @@ async def download_file(token: str, file_id: str):
         if file_info.get("virus_scan") == "pending" and not Config.ALLOW_PENDING_DOWNLOAD:
             raise HTTPException(403, "Security scan in progress. Please wait for completion")
         
+        if not file_info.get("download_enabled", True):
+            raise HTTPException(403, "Download is disabled for this file")
+        
         if file_info.get("virus_scan") == "suspicious":
             logger.warning(f"Suspicious file downloaded: {file_info['original_name']} by session {token}")
         
-        file_stream = await minio.get_file_stream(file_info["minio_path"])
-        if not file_stream:
-            raise HTTPException(404, "File not found")
-        
-        logger.info(f"File downloaded: {file_info['original_name']} from session {token}")
-        
         original_name = file_info['original_name']
         ascii_name = original_name.encode('ascii', 'ignore').decode('ascii')
         if not ascii_name:
             ascii_name = f"file_{file_id}{Path(original_name).suffix}"
         
-        encoded_name = quote(original_name.encode('utf-8'))
-        content_disposition = f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{encoded_name}"
+        quoted_name = quote(original_name.encode('utf-8'))
+        content_disposition = f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quoted_name}"
+        
+        object_name = file_info["minio_path"]
+        mime_type = file_info.get("mime_type", "application/octet-stream")
+        # 圧縮して保存したファイルは、対応するクライアントには圧縮したまま、それ以外には展開して返す
+        encoding = encoding_of(object_name)
+        send_encoded = encoding is not None and accepts(request.headers.get("accept-encoding"), encoding)
+        etag = file_etag(file_info)
+        if etag and send_encoded:
+            etag = f'{etag[:-1]}-{encoding}"'
+        last_modified = file_last_modified(file_info)
+        
+        validators = {}
+        if etag:
+            validators["ETag"] = etag
+        if last_modified:
+            validators["Last-Modified"] = http_date(last_modified)
+        if encoding:
+            validators["Vary"] = "Accept-Encoding"
+        
+        # スキャン中のファイルは判定が変わるので毎回再検証させる。確定後はセッションの期限まで再利用できる
+        max_age = 0 if file_info.get("virus_scan") == "pending" else session_ttl
+        validators.update(cache_headers(max_age))
+        
+        # 上のチェックを通った後なので、304 でもブロック済みのファイルが返ることはない
+        if not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since"),
+                        etag, last_modified):
+            return Response(status_code=304, headers=validators)
+        
+        if Config.DOWNLOAD_MODE == "redirect" and (not encoding or send_encoded):
+            try:
+                url = minio.presigned_download_url(
+                    object_name, content_disposition, mime_type, encoding if send_encoded else None
+                )
+                logger.info(f"File download redirected: {file_info['original_name']} from session {token}")
+                # 署名付きURLは短命なのでリダイレクト自体はキャッシュさせない
+                return RedirectResponse(url, status_code=302, headers={"Cache-Control": "no-store"})
+            except Exception as e:
+                logger.error(f"Presigned download URL error, falling back to proxy: {e}")
+        
+        file_size = file_info.get("size")
+        
+        headers = {
+            "Content-Disposition": content_disposition,
+            "Content-Type": mime_type,
+            "Accept-Ranges": "bytes",
+            "X-Virus-Scan-Status": file_info.get("virus_scan", "unknown"),
+            "X-ClamAV-Status": file_info.get("clamav_result", "unknown"),
+            "X-VirusTotal-Status": file_info.get("virustotal_result", "unknown"),
+            **validators
+        }
+        
+        cached = None
+        stored_size = None if encoding else file_size
+        disk_cache = get_disk_cache()
+        if disk_cache is not None:
+            cached = disk_cache.open(object_name)
+            if cached:
+                stored_size = cached[1]
+        if stored_size is None and encoding:
+            stat = await minio.get_file_info(object_name)
+            stored_size = stat["size"] if stat else None
+        if disk_cache is not None and cached is None and stored_size is not None:
+            disk_cache.fill(object_name, stored_size)
+        
+        if encoding and not send_encoded:
+            # 展開後の位置を指定して読むことはできないので Range には応じない
+            headers["Accept-Ranges"] = "none"
+            if file_size is not None:
+                headers["Content-Length"] = str(file_size)
+            if cached:
+                source = read_file_range(cached[0], 0, cached[1])
+                disk_cache.record_served(cached[1])
+            else:
+                source = await minio.get_file_stream(object_name)
+                if not source:
+                    raise HTTPException(404, "File not found")
+            
+            logger.info(f"File downloaded: {file_info['original_name']} from session {token} (decoded)")
+            return StreamingResponse(
+                _shaped(decode_stream(source, encoding), token), media_type=mime_type, headers=headers,
+                background=BackgroundTask(cached[0].close) if cached else None
+            )
+        
+        if send_encoded:
+            headers["Content-Encoding"] = encoding
+        size = stored_size
+        
+        ranges = None
+        range_header = request.headers.get("range")
+        if range_header and size is not None and \
+                if_range_matches(request.headers.get("if-range"), etag, last_modified):
+            ranges = parse_range(range_header, size)
+            if ranges == []:
+                if cached:
+                    cached[0].close()
+                return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        
+        if ranges and len(ranges) > 1:
+            if cached:
+                cached_file = cached[0]
+                async def open_range(start, length):
+                    return read_file_range(cached_file, start, length)
+                disk_cache.record_served(sum(end - start + 1 for start, end in ranges))
+            else:
+                async def open_range(start, length):
+                    return await minio.get_file_stream(object_name, start, length)
+            
+            body = ByteRangesBody(open_range, ranges, size, mime_type)
+            headers["Content-Type"] = body.content_type
+            headers["Content-Length"] = str(body.content_length)
+            return StreamingResponse(
+                _shaped(body, token), status_code=206, media_type=body.content_type, headers=headers,
+                background=BackgroundTask(cached[0].close) if cached else None
+            )
+        
+        if ranges:
+            start, end = ranges[0]
+            headers["Content-Range"] = content_range(start, end, size)
+            status_code = 206
+        else:
+            start, end = 0, (size - 1 if size is not None else None)
+            status_code = 200
+        
+        if status_code == 200 or start == 0:
+            logger.info(f"File downloaded: {file_info['original_name']} from session {token}{' (cache)' if cached else ''}")
+        
+        if end is not None:
+            headers["Content-Length"] = str(end - start + 1)
+        
+        if cached:
+            disk_cache.record_served(end - start + 1)
+            if get_bandwidth():
+                # 帯域制限が有効な場合は zerocopy を使わず、読み出しごとに制限をかける
+                return StreamingResponse(
+                    _shaped(read_file_range(cached[0], start, end - start + 1), token),
+                    status_code=status_code, media_type=mime_type, headers=headers,
+                    background=BackgroundTask(cached[0].close)
+                )
+            return OpenFileResponse(cached[0], start, end - start + 1, status_code, headers)
+        
+        if ranges:
+            file_stream = await minio.get_file_stream(object_name, start, end - start + 1)
+        else:
+            file_stream = await minio.get_file_stream(object_name)
+        if not file_stream:
+            raise HTTPException(404, "File not found")
         
         return StreamingResponse(
-            file_stream,
-            media_type=file_info.get("mime_type", "application/octet-stream"),
-            headers={
-                "Content-Disposition": content_disposition,
-                "Content-Type": file_info.get("mime_type", "application/octet-stream"),
-                "X-Virus-Scan-Status": file_info.get("virus_scan", "unknown"),
-                "X-ClamAV-Status": file_info.get("clamav_result", "unknown"),
-                "X-VirusTotal-Status": file_info.get("virustotal_result", "unknown")
-            }
+            _shaped(file_stream, token),
+            status_code=status_code,
+            media_type=mime_type,
+            headers=headers
         )
         
     except HTTPException:
@@ -386,16 +1246,85 @@ async def download_file(token: str, file_id: str):
         logger.error(f"Download error: {e}")
         raise HTTPException(500, "Error occurred during download")
 
+@router.get("/preview/{token}/{file_id}")
+async def preview_file(token: str, file_id: str, request: Request):
+    try:
+        redis_db, _, _ = get_services()
+        
+        context = await redis_db.get_file_context(token, file_id)
+        if not context:
+            raise HTTPException(404, "File not found")
+        
+        _, file_info, _, session_ttl = context
+        if not file_info:
+            raise HTTPException(404, "File information not found")
+        
+        # プレビューはスキャンで clean になった画像だけ。それ以外はページ側で元ファイルを表示する
+        previews = get_previews()
+        if previews is None or not previews.can_preview(file_info):
+            raise HTTPException(404, "Preview not available")
+        
+        etag = file_etag(file_info)
+        if etag:
+            etag = f'{etag[:-1]}-preview"'
+        last_modified = file_last_modified(file_info)
+        
+        headers = cache_headers(session_ttl)
+        if etag:
+            headers["ETag"] = etag
+        if last_modified:
+            headers["Last-Modified"] = http_date(last_modified)
+        
+        if not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since"),
+                        etag, last_modified):
+            return Response(status_code=304, headers=headers)
+        
+        data = await previews.get(file_info)
+        if data is None:
+            raise HTTPException(404, "Preview not available")
+        
+        return Response(content=data, media_type=previews.media_type, headers=headers)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Preview error: {e}")
+        raise HTTPException(500, "Error occurred while creating preview")
+
 @router.get("/api/scan/stats")
 async def get_scan_statistics():
     try:
-        _, _, scan_service = get_services()
+        redis_db, _, scan_service = get_services()
         stats = await scan_service.db.get_statistics()
+        stats["scan_queue"] = await redis_db.get_scan_queue_stats()
         return JSONResponse(stats)
     except Exception as e:
         logger.error(f"Error getting statistics: {e}")
         raise HTTPException(500, "Failed to retrieve statistics")
 
+@router.get("/api/cache/stats")
+async def get_cache_statistics():
+    disk_cache = get_disk_cache()
+    if disk_cache is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **disk_cache.get_stats()})
+
+@router.get("/api/bandwidth/stats")
+async def get_bandwidth_statistics():
+    shaper = get_bandwidth()
+    if shaper is None:
+        return JSONResponse({"enabled": False})
+    return JSONResponse({"enabled": True, **shaper.get_stats()})
+
+@router.get("/api/redis/stats")
+async def get_redis_statistics():
+    from services.redis_db import pool_stats
+    redis_db, _, _ = get_services()
+    stats = pool_stats()
+    stats["metadata_cache"] = redis_db.cache_stats()
+    stats["object_expiry"] = await redis_db.get_object_expiry_stats()
+    return JSONResponse(stats)
+
 @router.get("/api/health")
 async def health():
     try:
@@ -3,8 +3,12 @@ from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.exceptions import HTTPException as StarletteHTTPException
+import asyncio
 import logging
-from api.routes import router
+from services.redis_db import close_pool, get_client
+from api.routes import router, get_services, get_blob_store, get_disk_cache, get_previews, get_faststart, get_expiry
+from api.preflight import UploadPreflightMiddleware
+from config import Config
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +18,9 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# CORS より内側に置き、拒否レスポンスにも CORS ヘッダーが付くようにする
+app.add_middleware(UploadPreflightMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -34,10 +41,69 @@ async def not_found_handler(request: Request, exc):
 
 app.include_router(router)
 
+scan_workers = None
+blob_gc_task = None
+expiry_task = None
+metadata_cache_task = None
+
 @app.on_event("startup")
 async def startup_event():
+    global scan_workers, blob_gc_task, expiry_task, metadata_cache_task
+    
+    # Redisの接続プールはリクエストが来る前に1つだけ作っておく
+    redis_db, _, _ = get_services()
+    if not await redis_db.ping():
+        logger.warning("Redis is not reachable at startup")
+    else:
+        migrated = await redis_db.migrate_sessions()
+        if migrated:
+            logger.info(f"Migrated {migrated} legacy sessions to hash layout")
+    
+    if redis_db.cache:
+        metadata_cache_task = asyncio.create_task(redis_db.cache.run(get_client()))
+    
+    if Config.SCAN_QUEUE_ENABLED and Config.SCAN_WORKERS > 0:
+        from services.scan_worker import ScanWorkerPool
+        redis_db, _, scan_service = get_services()
+        scan_workers = ScanWorkerPool(redis_db, scan_service)
+        scan_workers.start()
+    
+    if Config.STORAGE_DEDUP:
+        blob_gc_task = asyncio.create_task(get_blob_store().run_gc())
+    
+    expiry = get_expiry()
+    if expiry:
+        expiry_task = asyncio.create_task(expiry.run())
+    
     logger.info("FastAPI server started")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    if scan_workers:
+        await scan_workers.stop()
+    
+    if blob_gc_task:
+        blob_gc_task.cancel()
+    
+    if expiry_task:
+        expiry_task.cancel()
+    
+    if metadata_cache_task:
+        metadata_cache_task.cancel()
+        await asyncio.gather(metadata_cache_task, return_exceptions=True)
+    
+    disk_cache = get_disk_cache()
+    if disk_cache:
+        await disk_cache.close()
+    
+    previews = get_previews()
+    if previews:
+        await previews.close()
+    
+    faststart = get_faststart()
+    if faststart:
+        await faststart.close()
+    
+    await close_pool()
+    
     logger.info("FastAPI server shutting down")
\ No newline at end of file
@@ -87,6 +87,9 @@ class FileCommands(commands.Cog):
                         embed.set_footer(text=get_message('discord.upload.footer'))
 
                         await interaction.followup.send(embed=embed)
+                    elif resp.status == 429:
+                        minutes = max(1, -(-int(resp.headers.get('Retry-After', '60')) // 60))
+                        await interaction.followup.send(get_message('discord.error.rate_limited', minutes=minutes))
                     else:
                         await interaction.followup.send(get_message('discord.error.generation_failed'))
                         
@@ -149,6 +152,9 @@ class FileCommands(commands.Cog):
                         embed.set_footer(text=get_message('discord.upload.footer'))
 
                         await interaction.followup.send(embed=embed)
+                    elif resp.status == 429:
+                        minutes = max(1, -(-int(resp.headers.get('Retry-After', '60')) // 60))
+                        await interaction.followup.send(get_message('discord.error.rate_limited', minutes=minutes))
                     else:
                         await interaction.followup.send(get_message('discord.error.generation_failed'))
                         
@@ -10,11 +10,25 @@ class Config:
     DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
     REQUIRED_ROLE = os.getenv("REQUIRED_ROLE", "FileUploader")
     REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+    REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", "5"))
+    REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "5"))
+    REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "10"))
+    REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+    REDIS_RETRY_ON_TIMEOUT = os.getenv("REDIS_RETRY_ON_TIMEOUT", "true").lower() == "true"
+    REDIS_RETRIES = int(os.getenv("REDIS_RETRIES", "3"))
+    SERIALIZATION_CODEC = os.getenv("SERIALIZATION_CODEC", "orjson").lower()
+    METADATA_CACHE_ENABLED = os.getenv("METADATA_CACHE_ENABLED", "false").lower() == "true"
+    METADATA_CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", "10000"))
+    METADATA_CACHE_TTL = float(os.getenv("METADATA_CACHE_TTL", "30"))
     MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT")
     MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY")
     MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY")
     MINIO_BUCKET = "fileshare01"
     MINIO_USE_SSL = os.getenv("MINIO_USE_SSL", "false").lower() == "true"
+    MINIO_PUBLIC_ENDPOINT = os.getenv("MINIO_PUBLIC_ENDPOINT", "")
+    MINIO_PUBLIC_USE_SSL = os.getenv("MINIO_PUBLIC_USE_SSL", "false").lower() == "true"
+    MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
     VIRUSTOTAL_API_KEY = os.getenv("VIRUSTOTAL_API_KEY", "")
     CLAMAV_HOST = os.getenv("CLAMAV_HOST", "clamav")
     CLAMAV_PORT = os.getenv("CLAMAV_PORT", "3310")
@@ -22,6 +36,58 @@ class Config:
     SERVICE_URL = os.getenv("SERVICE_URL", "http://localhost:8000")
     API_PORT = int(os.getenv("API_PORT", "8000"))
     MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "5368709120"))
+    UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", "1048576"))
+    MINIO_PART_SIZE = int(os.getenv("MINIO_PART_SIZE", "5242880"))
+    MINIO_PART_CONCURRENCY = int(os.getenv("MINIO_PART_CONCURRENCY", "4"))
+    MINIO_IO_THREADS = int(os.getenv("MINIO_IO_THREADS", "16"))
+    DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", "262144"))
+    DOWNLOAD_READ_AHEAD = int(os.getenv("DOWNLOAD_READ_AHEAD", "4"))
+    DOWNLOAD_MAX_RANGES = int(os.getenv("DOWNLOAD_MAX_RANGES", "16"))
+    DOWNLOAD_RATE_LIMIT = int(os.getenv("DOWNLOAD_RATE_LIMIT", "0"))
+    DOWNLOAD_TOKEN_RATE_LIMIT = int(os.getenv("DOWNLOAD_TOKEN_RATE_LIMIT", "0"))
+    DOWNLOAD_GLOBAL_RATE_LIMIT = int(os.getenv("DOWNLOAD_GLOBAL_RATE_LIMIT", "0"))
+    DOWNLOAD_CACHE_DIR = os.getenv("DOWNLOAD_CACHE_DIR", "")
+    DOWNLOAD_CACHE_MAX_BYTES = int(os.getenv("DOWNLOAD_CACHE_MAX_BYTES", str(10 * 1024**3)))
+    DOWNLOAD_CACHE_MAX_OBJECT = int(os.getenv("DOWNLOAD_CACHE_MAX_OBJECT", str(1024**3)))
+    STORAGE_COMPRESSION = os.getenv("STORAGE_COMPRESSION", "").lower()
+    STORAGE_COMPRESSION_LEVEL = int(os.getenv("STORAGE_COMPRESSION_LEVEL", "6"))
+    COMPRESSIBLE_EXTENSIONS = {'.txt', '.csv', '.json', '.xml'}
+    PREVIEW_ENABLED = os.getenv("PREVIEW_ENABLED", "false").lower() == "true"
+    PREVIEW_FORMAT = os.getenv("PREVIEW_FORMAT", "webp").lower()
+    PREVIEW_MAX_DIMENSION = int(os.getenv("PREVIEW_MAX_DIMENSION", "800"))
+    PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "80"))
+    PREVIEW_MAX_SOURCE_BYTES = int(os.getenv("PREVIEW_MAX_SOURCE_BYTES", str(100 * 1024 * 1024)))
+    PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "2"))
+    FASTSTART_ENABLED = os.getenv("FASTSTART_ENABLED", "false").lower() == "true"
+    FASTSTART_MAX_MOOV_BYTES = int(os.getenv("FASTSTART_MAX_MOOV_BYTES", str(64 * 1024 * 1024)))
+    FASTSTART_CONCURRENCY = int(os.getenv("FASTSTART_CONCURRENCY", "2"))
+    STORAGE_DEDUP = os.getenv("STORAGE_DEDUP", "false").lower() == "true"
+    BLOB_GC_INTERVAL = int(os.getenv("BLOB_GC_INTERVAL", "300"))
+    BLOB_GC_BATCH_SIZE = int(os.getenv("BLOB_GC_BATCH_SIZE", "100"))
+    EXPIRY_REAPER_ENABLED = os.getenv("EXPIRY_REAPER_ENABLED", "false").lower() == "true"
+    EXPIRY_INTERVAL = int(os.getenv("EXPIRY_INTERVAL", "300"))
+    EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "100"))
+    EXPIRY_BATCH_DELAY = float(os.getenv("EXPIRY_BATCH_DELAY", "1.0"))
+    EXPIRY_LEASE = int(os.getenv("EXPIRY_LEASE", "600"))
+    EXPIRY_SWEEP_INTERVAL = int(os.getenv("EXPIRY_SWEEP_INTERVAL", "86400"))
+    EXPIRY_SWEEP_GRACE_DAYS = int(os.getenv("EXPIRY_SWEEP_GRACE_DAYS", "1"))
+    RESUMABLE_CHUNK_SIZE = int(os.getenv("RESUMABLE_CHUNK_SIZE", "8388608"))
+    UPLOAD_MODE = os.getenv("UPLOAD_MODE", "proxy").lower()
+    PRESIGNED_URL_EXPIRY = int(os.getenv("PRESIGNED_URL_EXPIRY", "3600"))
+    DOWNLOAD_MODE = os.getenv("DOWNLOAD_MODE", "proxy").lower()
+    DOWNLOAD_URL_EXPIRY = int(os.getenv("DOWNLOAD_URL_EXPIRY", "300"))
+    SCAN_QUEUE_ENABLED = os.getenv("SCAN_QUEUE_ENABLED", "false").lower() == "true"
+    SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "2"))
+    SCAN_JOB_TIMEOUT = int(os.getenv("SCAN_JOB_TIMEOUT", "900"))
+    SCAN_MAX_ATTEMPTS = int(os.getenv("SCAN_MAX_ATTEMPTS", "3"))
+    SCAN_RETRY_DELAY = int(os.getenv("SCAN_RETRY_DELAY", "30"))
+    SCAN_QUEUE_POLL_INTERVAL = float(os.getenv("SCAN_QUEUE_POLL_INTERVAL", "1.0"))
+    VERDICT_CACHE_ENABLED = os.getenv("VERDICT_CACHE_ENABLED", "false").lower() == "true"
+    VERDICT_CACHE_TTL = int(os.getenv("VERDICT_CACHE_TTL", "604800"))
+    VERDICT_CACHE_VT_MAX_AGE = int(os.getenv("VERDICT_CACHE_VT_MAX_AGE", "86400"))
+    VERDICT_CACHE_VERSION_TTL = int(os.getenv("VERDICT_CACHE_VERSION_TTL", "60"))
+    SCAN_SINGLE_FLIGHT = os.getenv("SCAN_SINGLE_FLIGHT", "false").lower() == "true"
+    SCAN_FLIGHT_RESULT_TTL = int(os.getenv("SCAN_FLIGHT_RESULT_TTL", "300"))
     URL_EXPIRY_DAYS = int(os.getenv("URL_EXPIRY_DAYS", "3"))
     TIMEZONE = os.getenv("TIMEZONE", "UTC")
     APP_LANGUAGE = os.getenv("APP_LANGUAGE", "en")
@@ -31,8 +97,15 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "change-this-in-production")
     CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:8000").split(',')
     ALLOW_PENDING_DOWNLOAD = os.getenv("ALLOW_PENDING_DOWNLOAD", "false").lower() == "true"
-    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true"
     RATE_LIMIT_PER_HOUR = int(os.getenv("RATE_LIMIT_PER_HOUR", "10"))
+    RATE_LIMIT_BYTES_PER_HOUR = int(os.getenv("RATE_LIMIT_BYTES_PER_HOUR", "0"))
+    RATE_LIMIT_SESSIONS_PER_HOUR = int(os.getenv("RATE_LIMIT_SESSIONS_PER_HOUR", "20"))
+    RATE_LIMIT_GUILD_PER_HOUR = int(os.getenv("RATE_LIMIT_GUILD_PER_HOUR", "0"))
+    RATE_LIMIT_GUILD_BYTES_PER_HOUR = int(os.getenv("RATE_LIMIT_GUILD_BYTES_PER_HOUR", "0"))
+    RATE_LIMIT_GUILD_SESSIONS_PER_HOUR = int(os.getenv("RATE_LIMIT_GUILD_SESSIONS_PER_HOUR", "0"))
+    UPLOAD_CONTENT_CHECK = os.getenv("UPLOAD_CONTENT_CHECK", "true").lower() == "true"
+    SESSION_QUOTA_BYTES = int(os.getenv("SESSION_QUOTA_BYTES", "0"))
     DEBUG = os.getenv("DEBUG", "false").lower() == "true"
     ALLOWED_EXTENSIONS = {'.pdf', '.docx', '.xlsx', '.zip', '.jpg', '.jpeg', '.png',
                          '.mp4', '.avi', '.mov', '.mkv', '.webm',
@@ -85,6 +158,136 @@ class Config:
         if cls.MAX_FILE_SIZE < 1024:
             errors.append("MAX_FILE_SIZE is too small (<1KB)")
 
+        if cls.MINIO_PART_SIZE < 5 * 1024 * 1024:
+            errors.append("MINIO_PART_SIZE must be at least 5MB")
+
+        if cls.MINIO_PART_CONCURRENCY < 1:
+            errors.append("MINIO_PART_CONCURRENCY must be at least 1")
+
+        if cls.MINIO_IO_THREADS < 1:
+            errors.append("MINIO_IO_THREADS must be at least 1")
+
+        if cls.DOWNLOAD_CHUNK_SIZE < 1024:
+            errors.append("DOWNLOAD_CHUNK_SIZE is too small (<1KB)")
+
+        if cls.DOWNLOAD_READ_AHEAD < 1:
+            errors.append("DOWNLOAD_READ_AHEAD must be at least 1")
+
+        if cls.REDIS_MAX_CONNECTIONS < 1:
+            errors.append("REDIS_MAX_CONNECTIONS must be at least 1")
+
+        if cls.REDIS_POOL_TIMEOUT <= 0 or cls.REDIS_CONNECT_TIMEOUT <= 0 or cls.REDIS_SOCKET_TIMEOUT <= 0:
+            errors.append("REDIS_POOL_TIMEOUT, REDIS_CONNECT_TIMEOUT and REDIS_SOCKET_TIMEOUT must be positive")
+
+        if cls.SERIALIZATION_CODEC not in ("orjson", "json"):
+            errors.append(f"Invalid SERIALIZATION_CODEC: {cls.SERIALIZATION_CODEC} (orjson or json)")
+
+        if cls.METADATA_CACHE_ENABLED and (cls.METADATA_CACHE_MAX_ENTRIES < 1 or cls.METADATA_CACHE_TTL <= 0):
+            errors.append("METADATA_CACHE_MAX_ENTRIES and METADATA_CACHE_TTL must be positive when METADATA_CACHE_ENABLED=true")
+
+        if cls.DOWNLOAD_MAX_RANGES < 1:
+            errors.append("DOWNLOAD_MAX_RANGES must be at least 1")
+
+        for name in ("RATE_LIMIT_PER_HOUR", "RATE_LIMIT_BYTES_PER_HOUR", "RATE_LIMIT_SESSIONS_PER_HOUR",
+                     "RATE_LIMIT_GUILD_PER_HOUR", "RATE_LIMIT_GUILD_BYTES_PER_HOUR",
+                     "RATE_LIMIT_GUILD_SESSIONS_PER_HOUR"):
+            if getattr(cls, name) < 0:
+                errors.append(f"{name} must be 0 (unlimited) or positive")
+
+        for name in ("DOWNLOAD_RATE_LIMIT", "DOWNLOAD_TOKEN_RATE_LIMIT", "DOWNLOAD_GLOBAL_RATE_LIMIT"):
+            if getattr(cls, name) < 0:
+                errors.append(f"{name} must be 0 (unlimited) or positive")
+
+        if cls.DOWNLOAD_MODE == "redirect" and (cls.DOWNLOAD_RATE_LIMIT or cls.DOWNLOAD_TOKEN_RATE_LIMIT
+                                                or cls.DOWNLOAD_GLOBAL_RATE_LIMIT):
+            warnings.append("Download rate limits do not apply to DOWNLOAD_MODE=redirect (MinIO serves the body)")
+
+        if cls.DOWNLOAD_CACHE_DIR and cls.DOWNLOAD_CACHE_MAX_BYTES < 1:
+            errors.append("DOWNLOAD_CACHE_MAX_BYTES must be positive when DOWNLOAD_CACHE_DIR is set")
+
+        if cls.BLOB_GC_BATCH_SIZE < 1:
+            errors.append("BLOB_GC_BATCH_SIZE must be at least 1")
+
+        if not 1 <= cls.EXPIRY_BATCH_SIZE <= 1000:
+            errors.append("EXPIRY_BATCH_SIZE must be between 1 and 1000")
+
+        if cls.EXPIRY_INTERVAL < 1:
+            errors.append("EXPIRY_INTERVAL must be at least 1")
+
+        if cls.EXPIRY_BATCH_DELAY < 0:
+            errors.append("EXPIRY_BATCH_DELAY must not be negative")
+
+        if cls.EXPIRY_LEASE < 60:
+            errors.append("EXPIRY_LEASE must be at least 60 seconds")
+
+        if cls.EXPIRY_SWEEP_GRACE_DAYS < 0:
+            errors.append("EXPIRY_SWEEP_GRACE_DAYS must not be negative")
+
+        if cls.RESUMABLE_CHUNK_SIZE < 5 * 1024 * 1024:
+            errors.append("RESUMABLE_CHUNK_SIZE must be at least 5MB")
+
+        if cls.UPLOAD_MODE not in ("proxy", "presigned"):
+            errors.append(f"Invalid UPLOAD_MODE: {cls.UPLOAD_MODE} (proxy or presigned)")
+
+        if cls.DOWNLOAD_MODE not in ("proxy", "redirect"):
+            errors.append(f"Invalid DOWNLOAD_MODE: {cls.DOWNLOAD_MODE} (proxy or redirect)")
+
+        if cls.DOWNLOAD_MODE == "redirect" and not (1 <= cls.DOWNLOAD_URL_EXPIRY <= 604800):
+            errors.append("DOWNLOAD_URL_EXPIRY must be between 1 and 604800 seconds")
+
+        if cls.DOWNLOAD_MODE == "redirect" and not cls.MINIO_PUBLIC_ENDPOINT:
+            warnings.append("DOWNLOAD_MODE=redirect but MINIO_PUBLIC_ENDPOINT is not set; browsers must be able to reach MINIO_ENDPOINT")
+
+        if cls.UPLOAD_MODE == "presigned" and not cls.MINIO_PUBLIC_ENDPOINT:
+            warnings.append("UPLOAD_MODE=presigned but MINIO_PUBLIC_ENDPOINT is not set; browsers must be able to reach MINIO_ENDPOINT")
+
+        if cls.SCAN_WORKERS < 0:
+            errors.append("SCAN_WORKERS must not be negative")
+
+        if cls.SCAN_MAX_ATTEMPTS < 1:
+            errors.append("SCAN_MAX_ATTEMPTS must be at least 1")
+
+        if cls.SCAN_QUEUE_ENABLED and cls.SCAN_JOB_TIMEOUT < cls.CLAMAV_TIMEOUT:
+            warnings.append("SCAN_JOB_TIMEOUT is shorter than CLAMAV_TIMEOUT; long scans may be picked up twice")
+
+        if cls.VERDICT_CACHE_ENABLED and cls.VERDICT_CACHE_TTL < 1:
+            errors.append("VERDICT_CACHE_TTL must be at least 1 second")
+
+        if cls.STORAGE_COMPRESSION not in ("", "gzip", "zstd"):
+            errors.append(f"Invalid STORAGE_COMPRESSION: {cls.STORAGE_COMPRESSION} (gzip, zstd or empty)")
+
+        if cls.STORAGE_COMPRESSION == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                errors.append("STORAGE_COMPRESSION=zstd requires the zstandard package")
+
+        if cls.PREVIEW_FORMAT not in ("webp", "jpeg"):
+            errors.append(f"Invalid PREVIEW_FORMAT: {cls.PREVIEW_FORMAT} (webp or jpeg)")
+
+        if cls.PREVIEW_MAX_DIMENSION < 16:
+            errors.append("PREVIEW_MAX_DIMENSION is too small (<16px)")
+
+        if cls.PREVIEW_ENABLED:
+            try:
+                from PIL import features
+                if cls.PREVIEW_FORMAT == "webp" and not features.check("webp"):
+                    errors.append("PREVIEW_FORMAT=webp requires Pillow built with WebP support")
+            except ImportError:
+                warnings.append("Pillow is not installed; image previews are disabled")
+
+        if cls.FASTSTART_ENABLED and cls.FASTSTART_MAX_MOOV_BYTES < 1024:
+            errors.append("FASTSTART_MAX_MOOV_BYTES is too small (<1KB)")
+
+        if cls.FASTSTART_ENABLED and cls.STORAGE_DEDUP:
+            warnings.append("FASTSTART_ENABLED has no effect on shared objects when STORAGE_DEDUP=true")
+
+        if cls.SESSION_QUOTA_BYTES < 0:
+            errors.append("SESSION_QUOTA_BYTES must be 0 (unlimited) or positive")
+
+        if cls.UPLOAD_CHUNK_SIZE < 1024:
+            errors.append("UPLOAD_CHUNK_SIZE is too small (<1KB)")
+
         try:
             pytz.timezone(cls.TIMEZONE)
         except pytz.exceptions.UnknownTimeZoneError:
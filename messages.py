@@ -46,6 +46,10 @@ MESSAGES: Dict[str, Dict[str, str]] = {
         "en": "❌ Failed to generate URL",
         "ja": "❌ URL生成に失敗しました"
     },
+    "discord.error.rate_limited": {
+        "en": "⏳ Too many upload URLs were generated. Please try again in {minutes} minutes",
+        "ja": "⏳ URLの発行回数が上限に達しました。{minutes}分後にもう一度お試しください"
+    },
     "discord.error.service_unavailable": {
         "en": "❌ Cannot connect to service",
         "ja": "❌ サービスに接続できません"
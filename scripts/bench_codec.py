@@ -0,0 +1,83 @@
+import json
+import sys
+import timeit
+import uuid
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# ステータス確認で毎回読み書きされる値と同じ形のサンプル
+FILE_RECORD = {
+    "original_name": "議事録_2026-10-17_最終版.pdf",
+    "stored_name": f"uploads/2026-10-17/{uuid.uuid4()}_議事録_2026-10-17_最終版.pdf",
+    "size": 48_213_775,
+    "mime_type": "application/pdf",
+    "uploaded_at": datetime.utcnow().isoformat(),
+    "uploaded_at_local": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    "virus_scan": "clean",
+    "clamav_result": "clean",
+    "virustotal_result": "clean",
+    "virus_scan_hash": uuid.uuid4().hex * 2,
+    "minio_path": f"uploads/2026-10-17/{uuid.uuid4()}_議事録_2026-10-17_最終版.pdf",
+    "download_enabled": True
+}
+
+SCAN_RESULT = {
+    "upload_time_local": "2026-10-17 12:34:56",
+    "file_name": FILE_RECORD["original_name"],
+    "file_uuid": str(uuid.uuid4()),
+    "file_extension": ".pdf",
+    "file_size": FILE_RECORD["size"],
+    "file_hash": FILE_RECORD["virus_scan_hash"],
+    "clamav_result": "clean",
+    "virustotal_result": "clean",
+    "upload_status": "success",
+    "rejection_reason": None,
+    "discord_user_id": "123456789012345678",
+    "discord_username": "user#0001"
+}
+
+UPLOAD_STATE = {
+    "file_id": str(uuid.uuid4()),
+    "filename": "backup.tar",
+    "size": 4_294_967_296,
+    "status": "uploading",
+    "parts": [{"part_number": i, "etag": uuid.uuid4().hex, "size": 8 * 1024 * 1024} for i in range(1, 65)]
+}
+
+def codecs():
+    yield "json", lambda v: json.dumps(v), json.loads
+    yield "json (compact)", lambda v: json.dumps(v, separators=(",", ":")), json.loads
+    if orjson:
+        yield "orjson", orjson.dumps, orjson.loads
+    if msgpack:
+        # バイナリのため decode_responses=True の接続では保存できない（比較用）
+        yield "msgpack", msgpack.packb, msgpack.unpackb
+
+def measure(encode, decode, value, number: int):
+    data = encode(value)
+    assert decode(data) == value
+    encode_time = min(timeit.repeat(lambda: encode(value), number=number, repeat=5)) / number
+    decode_time = min(timeit.repeat(lambda: decode(data), number=number, repeat=5)) / number
+    return len(data if isinstance(data, bytes) else data.encode("utf-8")), encode_time, decode_time
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for label, value in (("file record", FILE_RECORD), ("scan result", SCAN_RESULT),
+                         ("resumable upload", UPLOAD_STATE)):
+        print(f"\n{label}")
+        print(f"  {'codec':<16}{'bytes':>8}{'encode µs':>12}{'decode µs':>12}")
+        for name, encode, decode in codecs():
+            size, encode_time, decode_time = measure(encode, decode, value, number)
+            print(f"  {name:<16}{size:>8}{encode_time * 1e6:>12.2f}{decode_time * 1e6:>12.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    def __init__(self, rate: int):
+        # 1秒分までのバーストを許す
+        self.rate = rate
+        self.burst = rate
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        # asyncio.Lock は待っている順に取得できるため、待ち行列がそのままラウンドロビンになる
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def consume(self, amount: int):
+        async with self.lock:
+            self._refill()
+            if self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+class BandwidthShaper:
+    # ダウンロードの帯域を接続ごと・セッショントークンごと・全体で制限する。
+    # 共有のバケットは小さな単位ごとに順番に割り当てるので、大きなダウンロードが小さなものを塞がない
+    def __init__(self):
+        self.connection_rate = Config.DOWNLOAD_RATE_LIMIT
+        self.token_rate = Config.DOWNLOAD_TOKEN_RATE_LIMIT
+        self.global_bucket = TokenBucket(Config.DOWNLOAD_GLOBAL_RATE_LIMIT) if Config.DOWNLOAD_GLOBAL_RATE_LIMIT > 0 else None
+        self.token_buckets: Dict[str, TokenBucket] = {}
+        self.token_streams: Dict[str, int] = {}
+        self.active = 0
+
+    def _buckets(self, token: str) -> List[TokenBucket]:
+        buckets = []
+        if self.connection_rate > 0:
+            buckets.append(TokenBucket(self.connection_rate))
+        if self.token_rate > 0:
+            if token not in self.token_buckets:
+                self.token_buckets[token] = TokenBucket(self.token_rate)
+            self.token_streams[token] = self.token_streams.get(token, 0) + 1
+            buckets.append(self.token_buckets[token])
+        if self.global_bucket:
+            buckets.append(self.global_bucket)
+        return buckets
+
+    def _release(self, token: str):
+        if self.token_rate <= 0:
+            return
+        self.token_streams[token] -= 1
+        if not self.token_streams[token]:
+            del self.token_streams[token]
+            del self.token_buckets[token]
+
+    async def shape(self, stream, token: str):
+        buckets = self._buckets(token)
+        # 1回に取るトークンは最小のバーストまで（大きなチャンクは分けて順番待ちする）
+        quantum = min(min(bucket.burst for bucket in buckets), Config.DOWNLOAD_CHUNK_SIZE)
+        self.active += 1
+        try:
+            async for chunk in stream:
+                for offset in range(0, len(chunk), quantum):
+                    amount = min(quantum, len(chunk) - offset)
+                    for bucket in buckets:
+                        await bucket.consume(amount)
+                yield chunk
+        finally:
+            self.active -= 1
+            self._release(token)
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "active_streams": self.active,
+            "active_tokens": len(self.token_streams),
+            "connection_rate": self.connection_rate,
+            "token_rate": self.token_rate,
+            "global_rate": self.global_bucket.rate if self.global_bucket else 0
+        }
+
+def shaping_enabled() -> bool:
+    return (Config.DOWNLOAD_RATE_LIMIT > 0 or Config.DOWNLOAD_TOKEN_RATE_LIMIT > 0
+            or Config.DOWNLOAD_GLOBAL_RATE_LIMIT > 0)
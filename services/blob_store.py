@@ -0,0 +1,101 @@
+import asyncio
+import hashlib
+import logging
+from typing import Optional
+from config import Config
+from services.preview import preview_name
+
+logger = logging.getLogger(__name__)
+
+class BlobStoreService:
+    PREFIX = "blobs/"
+
+    def __init__(self, redis_db, minio):
+        self.redis_db = redis_db
+        self.minio = minio
+
+    @classmethod
+    def object_name(cls, file_hash: str, file_id: str) -> str:
+        # 同じ内容の再登録が削除中のオブジェクトと衝突しないよう、最初の登録者のIDを付ける
+        return f"{cls.PREFIX}{file_hash}/{file_id}"
+
+    @staticmethod
+    async def hash_file(file) -> str:
+        # MinIOへ書き込む前に、受信済みの一時ファイルからハッシュを求める
+        def _hash():
+            sha256 = hashlib.sha256()
+            file.seek(0)
+            while True:
+                chunk = file.read(Config.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha256.update(chunk)
+            file.seek(0)
+            return sha256.hexdigest()
+
+        return await asyncio.get_event_loop().run_in_executor(None, _hash)
+
+    async def acquire(self, file_hash: str, session_id: str, file_id: str) -> Optional[str]:
+        try:
+            object_name = await self.redis_db.acquire_blob(file_hash, session_id, file_id)
+            if object_name:
+                logger.info(f"Reusing stored object for {file_hash[:16]}: {object_name}")
+            return object_name
+        except Exception as e:
+            logger.error(f"Blob acquire error: {e}")
+            return None
+
+    async def register(self, file_hash: str, session_id: str, file_id: str, object_name: str) -> str:
+        try:
+            stored = await self.redis_db.acquire_blob(file_hash, session_id, file_id, object_name)
+        except Exception as e:
+            logger.error(f"Blob register error: {e}")
+            return object_name
+
+        # 同じ内容が並行して保存された場合は先に登録された方を使う
+        if stored != object_name:
+            await self.minio.delete_file(object_name)
+        return stored
+
+    async def adopt(self, file_hash: str, session_id: str, file_id: str, object_name: str) -> Optional[str]:
+        stored = await self.acquire(file_hash, session_id, file_id)
+        if stored:
+            await self.minio.delete_file(object_name)
+            return stored
+
+        # 初めての内容は保存済みのオブジェクトをその場で共有オブジェクトとして登録する（コピーし直さない）
+        return await self.register(file_hash, session_id, file_id, object_name)
+
+    async def release(self, file_hash: str, session_id: str, file_id: str):
+        try:
+            object_name = await self.redis_db.release_blob(file_hash, session_id, file_id)
+        except Exception as e:
+            logger.error(f"Blob release error: {e}")
+            return
+
+        if object_name:
+            await self.minio.delete_file(object_name)
+            await self.minio.delete_file(preview_name(object_name))
+
+    async def collect_expired(self) -> int:
+        deleted = 0
+        while True:
+            expired, object_names = await self.redis_db.expire_blob_refs(Config.BLOB_GC_BATCH_SIZE)
+            for object_name in object_names:
+                if await self.minio.delete_file(object_name):
+                    deleted += 1
+                await self.minio.delete_file(preview_name(object_name))
+            if expired < Config.BLOB_GC_BATCH_SIZE:
+                return deleted
+
+    async def run_gc(self):
+        while True:
+            try:
+                deleted = await self.collect_expired()
+                if deleted:
+                    logger.info(f"Deleted {deleted} unreferenced stored object(s)")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Blob GC error: {e}")
+            await asyncio.sleep(Config.BLOB_GC_INTERVAL)
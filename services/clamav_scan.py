@@ -1,11 +1,83 @@
 import asyncio
 import logging
 import struct
-from typing import Tuple, Optional, Dict
+import time
+from typing import Tuple, Optional, Dict, AsyncIterator, Callable
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+class ClamAVStream:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, chunk_size: int):
+        self.reader = reader
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.sent = 0
+        self.failed: Optional[str] = None
+
+    async def send(self, data: bytes):
+        if self.failed:
+            return
+
+        try:
+            for i in range(0, len(data), self.chunk_size):
+                chunk = data[i:i + self.chunk_size]
+                self.writer.write(struct.pack('>I', len(chunk)))
+                self.writer.write(chunk)
+                self.sent += len(chunk)
+            await self.writer.drain()
+        except (ConnectionError, BrokenPipeError) as e:
+            # clamdはStreamMaxLength超過などで途中切断することがある
+            logger.error(f"Connection to ClamAV was lost after {self.sent:,} bytes: {e}")
+            self.failed = 'Connection lost during scan'
+
+    async def finish(self) -> Tuple[str, str]:
+        try:
+            if self.failed:
+                return 'error', self.failed
+
+            self.writer.write(struct.pack('>I', 0))
+            await self.writer.drain()
+
+            logger.info(f"All data sent ({self.sent:,} bytes), waiting for scan result...")
+
+            response_data = b''
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(
+                        self.reader.read(1024),
+                        timeout=30
+                    )
+                    if not chunk:
+                        break
+                    response_data += chunk
+                    if b'\0' in response_data:
+                        break
+                except asyncio.TimeoutError:
+                    if response_data:
+                        break
+                    raise
+
+            response_str = response_data.decode('utf-8', errors='ignore').strip('\0').strip()
+            logger.info(f"ClamAV response: {response_str}")
+            return ClamAVService.parse_response(response_str)
+
+        except asyncio.TimeoutError:
+            logger.error("ClamAV scan timeout while waiting for result")
+            return 'error', 'Scan timeout'
+        except (ConnectionError, BrokenPipeError):
+            logger.error("Connection to ClamAV was lost (broken pipe)")
+            return 'error', 'Connection lost during scan'
+        finally:
+            await self.close()
+
+    async def close(self):
+        try:
+            self.writer.close()
+            await self.writer.wait_closed()
+        except:
+            pass
+
 class ClamAVService:
     def __init__(self):
         self.host = Config.CLAMAV_HOST if hasattr(Config, 'CLAMAV_HOST') else 'clamav'
@@ -13,12 +85,51 @@ class ClamAVService:
         self.timeout = int(Config.CLAMAV_TIMEOUT) if hasattr(Config, 'CLAMAV_TIMEOUT') else 300
         self.chunk_size = 32768  # 32KB
         self.max_retries = 3
-        
+        self._signature_version = None
+        self._signature_checked_at = 0.0
+
+    async def open_stream(self) -> ClamAVStream:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port),
+            timeout=10
+        )
+
+        logger.info(f"Connected to ClamAV at {self.host}:{self.port}")
+
+        writer.write(b'zINSTREAM\0')
+        await writer.drain()
+
+        return ClamAVStream(reader, writer, self.chunk_size)
+
+    @staticmethod
+    def parse_response(response_str: str) -> Tuple[str, str]:
+        if 'OK' in response_str:
+            return 'clean', 'No threats detected'
+        elif 'FOUND' in response_str:
+            virus_name = response_str.replace('stream: ', '').replace(' FOUND', '').strip()
+            logger.warning(f"ClamAV detected virus: {virus_name}")
+            return 'infected', virus_name
+        elif 'ERROR' in response_str:
+            error_msg = response_str.replace('stream: ', '').replace(' ERROR', '').strip()
+            logger.error(f"ClamAV error: {error_msg}")
+            return 'error', error_msg
+        else:
+            logger.error(f"Unexpected ClamAV response: {response_str}")
+            return 'error', f'Unexpected response: {response_str}'
+
     async def scan_file_content(self, file_content: bytes, 
                                 progress_callback=None) -> Tuple[str, str]:
+        async def chunks():
+            for i in range(0, len(file_content), self.chunk_size * 10):
+                yield file_content[i:i + self.chunk_size * 10]
+
+        return await self.scan_stream(chunks, len(file_content), progress_callback)
+
+    async def scan_stream(self, open_chunks: Callable[[], AsyncIterator[bytes]],
+                          total_size: int, progress_callback=None) -> Tuple[str, str]:
         for attempt in range(self.max_retries):
             try:
-                result = await self._scan_with_instream(file_content, progress_callback)
+                result = await self._scan_with_instream(open_chunks(), total_size, progress_callback)
                 if result[0] != 'error' or attempt == self.max_retries - 1:
                     return result
                     
@@ -32,89 +143,28 @@ class ClamAVService:
                     
         return 'error', 'Maximum retries exceeded'
     
-    async def _scan_with_instream(self, file_content: bytes, 
+    async def _scan_with_instream(self, chunks: AsyncIterator[bytes], total_size: int,
                                   progress_callback=None) -> Tuple[str, str]:
+        stream = None
 
-        reader = None
-        writer = None
-        
         try:
-            reader, writer = await asyncio.wait_for(
-                asyncio.open_connection(self.host, self.port),
-                timeout=10
-            )
+            stream = await self.open_stream()
             
-            logger.info(f"Connected to ClamAV at {self.host}:{self.port}")
-
-            writer.write(b'zINSTREAM\0')
-            await writer.drain()
-            
-            logger.info(f"INSTREAM command sent, starting to send file data ({len(file_content)} bytes)")
-
-            total_size = len(file_content)
-            sent = 0
-            
-            for i in range(0, total_size, self.chunk_size):
-                chunk = file_content[i:i + self.chunk_size]
-                chunk_size = len(chunk)
-
-                size_header = struct.pack('>I', chunk_size)
+            logger.info(f"INSTREAM command sent, starting to send file data ({total_size} bytes)")
 
-                writer.write(size_header)
-                writer.write(chunk)
-                
-                sent += chunk_size
+            async for chunk in chunks:
+                await stream.send(chunk)
+                if stream.failed:
+                    break
 
-                if progress_callback:
-                    progress = (sent / total_size) * 100
+                if progress_callback and total_size:
+                    progress = (stream.sent / total_size) * 100
                     await progress_callback(
                         progress, 
-                        f"スキャン中: {sent:,}/{total_size:,} bytes ({progress:.1f}%)"
+                        f"スキャン中: {stream.sent:,}/{total_size:,} bytes ({progress:.1f}%)"
                     )
 
-                if sent % (self.chunk_size * 10) == 0:
-                    await writer.drain()
-
-            await writer.drain()
-
-            writer.write(struct.pack('>I', 0))
-            await writer.drain()
-            
-            logger.info("All data sent, waiting for scan result...")
-
-            response_data = b''
-            while True:
-                try:
-                    chunk = await asyncio.wait_for(
-                        reader.read(1024),
-                        timeout=30
-                    )
-                    if not chunk:
-                        break
-                    response_data += chunk
-                    if b'\0' in response_data:
-                        break
-                except asyncio.TimeoutError:
-                    if response_data:
-                        break
-                    raise
-            
-            response_str = response_data.decode('utf-8', errors='ignore').strip('\0').strip()
-            logger.info(f"ClamAV response: {response_str}")
-            
-            if 'OK' in response_str:
-                return 'clean', 'No threats detected'
-            elif 'FOUND' in response_str:
-                virus_name = response_str.replace('stream: ', '').replace(' FOUND', '').strip()
-                logger.warning(f"ClamAV detected virus: {virus_name}")
-                return 'infected', virus_name
-            elif 'ERROR' in response_str:
-                error_msg = response_str.replace('stream: ', '').replace(' ERROR', '').strip()
-                logger.error(f"ClamAV error: {error_msg}")
-                return 'error', error_msg
-            else:
-                logger.error(f"Unexpected ClamAV response: {response_str}")
-                return 'error', f'Unexpected response: {response_str}'
+            return await stream.finish()
                 
         except asyncio.TimeoutError:
             logger.error(f"ClamAV scan timeout after {self.timeout} seconds")
@@ -129,12 +179,8 @@ class ClamAVService:
             logger.error(f"ClamAV scan error: {type(e).__name__}: {e}")
             return 'error', str(e)
         finally:
-            if writer:
-                try:
-                    writer.close()
-                    await writer.wait_closed()
-                except:
-                    pass
+            if stream:
+                await stream.close()
     
     async def ping(self) -> bool:
         try:
@@ -186,6 +232,20 @@ class ClamAVService:
             logger.error(f"Failed to get ClamAV version: {e}")
             return None
     
+    async def get_signature_version(self) -> Optional[str]:
+        # VERSION応答 "ClamAV 1.2.1/27100/日付" のうちエンジンと定義DBのバージョンを使う
+        now = time.monotonic()
+        if self._signature_version and now - self._signature_checked_at < Config.VERDICT_CACHE_VERSION_TTL:
+            return self._signature_version
+        
+        version_info = await self.get_version()
+        if not version_info:
+            return None
+        
+        self._signature_version = "/".join(version_info.split("/")[:2])
+        self._signature_checked_at = now
+        return self._signature_version
+    
     async def test_configuration(self) -> Dict[str, any]:
         result = {
             "ping": False,
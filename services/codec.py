@@ -0,0 +1,61 @@
+import json
+import logging
+from typing import Any, Callable, Dict, Optional
+from config import Config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Redisに保存する値の先頭1文字で形式を表す。
+# タグの無い値は以前のバージョンが json.dumps で書いたものとして読む
+TAG_JSON = "\x01"
+TAG_TEXT = "\x02"
+
+def _stdlib_dumps(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"))
+
+def _orjson_dumps(value: Any) -> str:
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+# JSONのエンコーダーは差し替えられる（出力はどれも同じJSONなのでタグは共通）
+ENCODERS: Dict[str, Callable[[Any], str]] = {"json": _stdlib_dumps}
+DECODERS: Dict[str, Callable[[str], Any]] = {"json": json.loads}
+if orjson is not None:
+    ENCODERS["orjson"] = _orjson_dumps
+    DECODERS["orjson"] = orjson.loads
+
+def _select(name: str) -> str:
+    if name in ENCODERS:
+        return name
+    logger.warning(f"Codec {name} is not available, falling back to json")
+    return "json"
+
+_name = _select(Config.SERIALIZATION_CODEC)
+json_dumps = ENCODERS[_name]
+json_loads = DECODERS[_name]
+
+def codec_name() -> str:
+    return _name
+
+def dumps(value: Any) -> str:
+    # 文字列はそのまま、それ以外はJSONにして型を区別する（読むときに推測しない）
+    if isinstance(value, str):
+        return TAG_TEXT + value
+    return TAG_JSON + json_dumps(value)
+
+def loads(data: Optional[str]) -> Any:
+    if data is None:
+        return None
+    if data.startswith(TAG_JSON):
+        return json_loads(data[1:])
+    if data.startswith(TAG_TEXT):
+        return data[1:]
+    # 旧形式: JSONとして読めなければ文字列のまま返す
+    try:
+        return json_loads(data)
+    except ValueError:
+        return data
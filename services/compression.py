@@ -0,0 +1,94 @@
+import logging
+import zlib
+from typing import Optional
+from config import Config
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# 圧縮方式はオブジェクト名の拡張子で表す（重複排除で別レコードのオブジェクトを共有しても方式が分かる）
+SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+def available(encoding: str) -> bool:
+    if encoding == "gzip":
+        return True
+    if encoding == "zstd":
+        return zstandard is not None
+    return False
+
+def choose_encoding(file_ext: str) -> Optional[str]:
+    encoding = Config.STORAGE_COMPRESSION
+    if not encoding or file_ext not in Config.COMPRESSIBLE_EXTENSIONS:
+        return None
+    if not available(encoding):
+        logger.error(f"Compression codec not available: {encoding}")
+        return None
+    return encoding
+
+def encoded_name(object_name: str, encoding: Optional[str]) -> str:
+    return object_name + SUFFIXES[encoding] if encoding else object_name
+
+def encoding_of(object_name: str) -> Optional[str]:
+    for encoding, suffix in SUFFIXES.items():
+        if object_name.endswith(suffix):
+            return encoding
+    return None
+
+def accepts(accept_encoding: Optional[str], encoding: str) -> bool:
+    if not accept_encoding:
+        return False
+
+    for item in accept_encoding.split(","):
+        token, _, params = item.strip().partition(";")
+        if token.strip().lower() not in (encoding, "*"):
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        return q > 0
+    return False
+
+class Compressor:
+    def __init__(self, encoding: str):
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=Config.STORAGE_COMPRESSION_LEVEL).compressobj()
+        else:
+            self._obj = zlib.compressobj(Config.STORAGE_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+class Decompressor:
+    def __init__(self, encoding: str):
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdDecompressor().decompressobj()
+        else:
+            self._obj = zlib.decompressobj(31)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._obj.decompress(data)
+
+    def flush(self) -> bytes:
+        return self._obj.flush() if hasattr(self._obj, "flush") else b""
+
+async def decode_stream(stream, encoding: str):
+    decompressor = Decompressor(encoding)
+    async for chunk in stream:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
@@ -75,6 +75,18 @@ class ScanLogDatabase:
                     hit_count INTEGER DEFAULT 1
                 )
             ''')
+
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS verdict_cache (
+                    file_hash TEXT PRIMARY KEY,
+                    clamav_result TEXT,
+                    clamav_details TEXT,
+                    clamav_version TEXT,
+                    virustotal_result TEXT,
+                    vt_checked_at REAL,
+                    cached_at REAL NOT NULL
+                )
+            ''')
             
             conn.commit()
             logger.info("Database initialized successfully")
@@ -100,8 +112,15 @@ class ScanLogDatabase:
                         upload_status, rejection_reason,
                         session_token, discord_user_id, discord_username
                     ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(file_uuid) DO UPDATE SET
+                        file_hash = excluded.file_hash,
+                        clamav_result = excluded.clamav_result,
+                        virustotal_result = excluded.virustotal_result,
+                        upload_status = excluded.upload_status,
+                        rejection_reason = excluded.rejection_reason,
+                        updated_at = CURRENT_TIMESTAMP
                 ''', (
-                    log_data.get('upload_time_jst'),
+                    log_data.get('upload_time_jst', log_data.get('upload_time_local')),
                     log_data.get('file_name'),
                     log_data.get('file_uuid'),
                     log_data.get('file_extension'),
@@ -202,6 +221,56 @@ class ScanLogDatabase:
         
         return await asyncio.get_event_loop().run_in_executor(None, _check)
     
+    async def save_verdict(self, file_hash: str, verdict: Dict[str, Any]):
+        def _save():
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT OR REPLACE INTO verdict_cache (
+                        file_hash, clamav_result, clamav_details, clamav_version,
+                        virustotal_result, vt_checked_at, cached_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    file_hash,
+                    verdict.get('clamav_result'),
+                    verdict.get('clamav_details'),
+                    verdict.get('clamav_version'),
+                    verdict.get('virustotal_result'),
+                    verdict.get('vt_checked_at'),
+                    verdict.get('cached_at')
+                ))
+                conn.commit()
+        
+        await asyncio.get_event_loop().run_in_executor(None, _save)
+    
+    async def get_verdict(self, file_hash: str) -> Optional[Dict]:
+        def _get():
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT * FROM verdict_cache 
+                    WHERE file_hash = ?
+                ''', (file_hash,))
+                
+                row = cursor.fetchone()
+                if row:
+                    return dict(row)
+                return None
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _get)
+    
+    async def delete_verdict(self, file_hash: str):
+        def _delete():
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    DELETE FROM verdict_cache 
+                    WHERE file_hash = ?
+                ''', (file_hash,))
+                conn.commit()
+        
+        await asyncio.get_event_loop().run_in_executor(None, _delete)
+    
     async def get_recent_logs(self, limit: int = 100) -> List[Dict]:
         def _get():
             with self._get_connection() as conn:
@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+TMP_PREFIX = ".fill-"
+
+class DiskCacheService:
+    # MinIOオブジェクトのローカルディスクキャッシュ（LRU）。
+    # オブジェクトは書き換えられない（uploads/ は file_id ごと、blobs/ は内容ごと）ので無効化は不要
+    def __init__(self, minio):
+        self.minio = minio
+        self.directory = Path(Config.DOWNLOAD_CACHE_DIR)
+        self.max_bytes = Config.DOWNLOAD_CACHE_MAX_BYTES
+        self.max_object = min(Config.DOWNLOAD_CACHE_MAX_OBJECT, self.max_bytes)
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.size = 0
+        self.reserved = 0
+        self.filling: Dict[str, asyncio.Task] = {}
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "bytes_saved": 0,
+            "fills": 0,
+            "fill_errors": 0,
+            "evictions": 0
+        }
+        self._load()
+
+    def _key(self, object_name: str) -> str:
+        return hashlib.sha256(object_name.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key
+
+    def _load(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        found = []
+        for path in self.directory.iterdir():
+            try:
+                if path.name.startswith(TMP_PREFIX):
+                    # 前回の書き込み途中のファイル
+                    path.unlink()
+                    continue
+                stat = path.stat()
+                found.append((stat.st_atime, path.name, stat.st_size))
+            except OSError as e:
+                logger.error(f"Disk cache load error: {path} - {e}")
+
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+
+        self._evict(0)
+        logger.info(f"Disk cache ready: {self.directory} ({len(self.entries)} objects, {self.size} bytes)")
+
+    def _evict(self, needed: int):
+        while self.entries and self.size + self.reserved + needed > self.max_bytes:
+            key, size = self.entries.popitem(last=False)
+            self.size -= size
+            self.stats["evictions"] += 1
+            try:
+                # 配信中のファイルは開いたファイル記述子から読み続けられる
+                self._path(key).unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Disk cache evict error: {key} - {e}")
+
+    def open(self, object_name: str) -> Optional[Tuple[Any, int]]:
+        key = self._key(object_name)
+        size = self.entries.get(key)
+        if size is None:
+            self.stats["misses"] += 1
+            return None
+
+        try:
+            file = open(self._path(key), "rb")
+        except OSError:
+            self.entries.pop(key, None)
+            self.size -= size
+            self.stats["misses"] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return file, size
+
+    def record_served(self, length: int):
+        self.stats["bytes_saved"] += length
+
+    def fill(self, object_name: str, size: int):
+        # 同じオブジェクトの取り込みは1つにまとめ、リクエストの応答は待たせない
+        key = self._key(object_name)
+        if key in self.entries or key in self.filling or size > self.max_object:
+            return
+
+        task = asyncio.ensure_future(self._fill(key, object_name, size))
+        self.filling[key] = task
+        task.add_done_callback(lambda _: self.filling.pop(key, None))
+
+    async def _fill(self, key: str, object_name: str, size: int):
+        loop = asyncio.get_event_loop()
+        tmp_path = self.directory / f"{TMP_PREFIX}{uuid.uuid4().hex}"
+        self._evict(size)
+        self.reserved += size
+        try:
+            stream = await self.minio.get_file_stream(object_name)
+            if stream is None:
+                raise IOError("object not readable")
+
+            written = 0
+            with open(tmp_path, "wb") as f:
+                async for chunk in stream:
+                    await loop.run_in_executor(None, f.write, chunk)
+                    written += len(chunk)
+                    if written > size:
+                        raise IOError(f"object larger than expected ({written} > {size})")
+
+            if written != size:
+                raise IOError(f"size mismatch ({written} != {size})")
+
+            # rename で置き換えるため、読み手が書き込み途中のファイルを見ることはない
+            os.replace(tmp_path, self._path(key))
+            self.entries[key] = size
+            self.size += size
+            self.stats["fills"] += 1
+            logger.info(f"Disk cache filled: {object_name} ({size} bytes)")
+
+        except Exception as e:
+            self.stats["fill_errors"] += 1
+            logger.error(f"Disk cache fill error: {object_name} - {e}")
+        finally:
+            self.reserved -= size
+            try:
+                tmp_path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Disk cache cleanup error: {tmp_path} - {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "objects": len(self.entries),
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+            "filling": len(self.filling)
+        }
+
+    async def close(self):
+        for task in list(self.filling.values()):
+            task.cancel()
+        await asyncio.gather(*self.filling.values(), return_exceptions=True)
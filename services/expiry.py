@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import List
+from config import Config
+from services.preview import preview_name
+
+logger = logging.getLogger(__name__)
+
+class ExpiryReaper:
+    # 期限切れのアップロードを MinIO から削除する。
+    # 通常は set_file が登録した object_expiry（ZSET）から期限の来たものを取り出して消し、
+    # 登録が漏れたものは日付ごとのプレフィックス（uploads/YYYY-MM-DD/）を定期的に掃除して拾う
+    PREFIX = "uploads/"
+    SWEEP_LOCK = "expiry_sweep"
+
+    def __init__(self, redis_db, minio):
+        self.redis_db = redis_db
+        self.minio = minio
+
+    async def _pause(self):
+        # 1バッチごとに間を空け、通常のアップロード・ダウンロードと MinIO を取り合わない
+        if Config.EXPIRY_BATCH_DELAY > 0:
+            await asyncio.sleep(Config.EXPIRY_BATCH_DELAY)
+
+    async def collect_due(self) -> int:
+        deleted = 0
+        while True:
+            lease_until, object_names = await self.redis_db.claim_expired_objects(
+                Config.EXPIRY_BATCH_SIZE, Config.EXPIRY_LEASE
+            )
+            if not object_names:
+                return deleted
+
+            failed = set(await self.minio.delete_files(object_names))
+            await self.minio.delete_files([preview_name(object_name) for object_name in object_names])
+
+            # 失敗したものは ZSET に残し、リースが切れたら再試行する
+            done = [object_name for object_name in object_names if object_name not in failed]
+            await self.redis_db.finish_expired_objects(done, lease_until)
+            deleted += len(done)
+
+            if len(object_names) < Config.EXPIRY_BATCH_SIZE:
+                return deleted
+            await self._pause()
+
+    def _expired_prefixes(self, prefixes: List[str]) -> List[str]:
+        # その日のアップロードが全て期限切れになり、さらに猶予を過ぎた日だけを対象にする
+        cutoff = datetime.utcnow().date() - timedelta(days=Config.URL_EXPIRY_DAYS + Config.EXPIRY_SWEEP_GRACE_DAYS)
+        expired = []
+        for prefix in prefixes:
+            try:
+                day = datetime.strptime(prefix[len(self.PREFIX):].rstrip("/"), "%Y-%m-%d").date()
+            except ValueError:
+                continue
+            if day < cutoff:
+                expired.append(prefix)
+        return sorted(expired)
+
+    async def sweep_prefix(self, prefix: str) -> int:
+        deleted = 0
+        start_after = None
+        while True:
+            object_names = await self.minio.list_object_names(prefix, start_after, Config.EXPIRY_BATCH_SIZE)
+            if not object_names:
+                return deleted
+            start_after = object_names[-1]
+
+            # 後から完了した再開可能アップロードなど、期限がまだ先のものは（プレビューも含めて）残す
+            sources = {object_name: object_name.rsplit(".preview.", 1)[0] for object_name in object_names}
+            expiries = await self.redis_db.get_object_expiries(sorted(set(sources.values())))
+            # 重複排除で共有中のオブジェクトは参照が残る限り消さない
+            shared = await self.redis_db.get_blob_paths(sorted(set(sources.values())))
+            now = time.time()
+            targets = [object_name for object_name, source in sources.items()
+                       if source not in shared and not (expiries.get(source) and expiries[source] > now)]
+
+            if targets:
+                failed = await self.minio.delete_files(targets)
+                deleted += len(targets) - len(failed)
+
+            if len(object_names) < Config.EXPIRY_BATCH_SIZE:
+                return deleted
+            await self._pause()
+
+    async def sweep(self) -> int:
+        deleted = 0
+        for prefix in self._expired_prefixes(await self.minio.list_prefixes(self.PREFIX)):
+            swept = await self.sweep_prefix(prefix)
+            if swept:
+                logger.info(f"Swept {swept} expired object(s) from {prefix}")
+            deleted += swept
+        return deleted
+
+    async def run(self):
+        while True:
+            try:
+                deleted = await self.collect_due()
+                if deleted:
+                    logger.info(f"Deleted {deleted} expired object(s)")
+
+                # ロックの期限を掃除の間隔にして、複数プロセス・再起動をまたいでも間隔ごとに1回だけ掃除する
+                if Config.EXPIRY_SWEEP_INTERVAL > 0 and await self.redis_db.set_if_absent(
+                        self.SWEEP_LOCK, datetime.utcnow().isoformat(), Config.EXPIRY_SWEEP_INTERVAL):
+                    await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Expiry reaper error: {e}")
+            await asyncio.sleep(Config.EXPIRY_INTERVAL)
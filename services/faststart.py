@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import struct
+import sys
+from array import array
+from pathlib import PurePosixPath
+from typing import Any, Dict, List, Optional, Tuple
+from config import Config
+from services.compression import encoding_of
+
+logger = logging.getLogger(__name__)
+
+SOURCE_TYPES = {"video/mp4", "video/quicktime", "video/x-m4v"}
+SOURCE_EXTENSIONS = {".mp4", ".mov", ".m4v"}
+# チャンクオフセット表 (stco/co64) までの経路にあるコンテナだけを辿る
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+MAX_TOP_LEVEL_BOXES = 64
+UINT32_MAX = 0xFFFFFFFF
+
+Box = Tuple[bytes, int, int]
+
+class NotRemuxable(Exception):
+    pass
+
+def faststart_name(object_name: str) -> str:
+    path = PurePosixPath(object_name)
+    return str(path.with_name(f"{path.stem}.faststart{path.suffix}"))
+
+def _box_header(data, offset: int, end: int) -> Tuple[bytes, int, int]:
+    # 戻り値: (種類, ヘッダー長, ボックス全体の長さ)
+    if end - offset < 8:
+        raise NotRemuxable("truncated box header")
+    size, kind = struct.unpack_from(">I4s", data, offset)
+    header = 8
+    if size == 1:
+        if end - offset < 16:
+            raise NotRemuxable("truncated box header")
+        size = struct.unpack_from(">Q", data, offset + 8)[0]
+        header = 16
+    elif size == 0:
+        size = end - offset
+    if size < header or offset + size > end:
+        raise NotRemuxable(f"invalid box size for {kind!r}")
+    return kind, header, size
+
+def _pack_header(kind: bytes, body_length: int) -> bytes:
+    if body_length + 8 <= UINT32_MAX:
+        return struct.pack(">I4s", body_length + 8, kind)
+    return struct.pack(">I4sQ", 1, kind, body_length + 16)
+
+def _offset_table(data, offset: int, end: int, item: str) -> array:
+    count = struct.unpack_from(">I", data, offset + 4)[0]
+    table = array(item)
+    start = offset + 8
+    if start + count * table.itemsize > end:
+        raise NotRemuxable("chunk offset table is truncated")
+    table.frombytes(bytes(data[start:start + count * table.itemsize]))
+    if sys.byteorder == "little":
+        table.byteswap()
+    return table
+
+def _table_bytes(table: array) -> bytes:
+    if sys.byteorder == "little":
+        table = array(table.typecode, table)
+        table.byteswap()
+    return table.tobytes()
+
+def _rewrite(data, offset: int, end: int, shift, to_co64: bool) -> List[bytes]:
+    out = []
+    while offset < end:
+        kind, header, size = _box_header(data, offset, end)
+        body, box_end = offset + header, offset + size
+
+        if kind in CONTAINERS:
+            children = b"".join(_rewrite(data, body, box_end, shift, to_co64))
+            out.append(_pack_header(kind, len(children)) + children)
+        elif kind in (b"stco", b"co64"):
+            table = _offset_table(data, body, box_end, "I" if kind == b"stco" else "Q")
+            shifted = [shift(value) for value in table]
+            if kind == b"stco" and to_co64:
+                kind, table = b"co64", array("Q", shifted)
+            else:
+                table = array(table.typecode, shifted)
+            # version/flags と件数はそのまま残す
+            payload = bytes(data[body:body + 8]) + _table_bytes(table)
+            out.append(_pack_header(kind, len(payload)) + payload)
+        elif kind in (b"moof", b"mvex"):
+            raise NotRemuxable("fragmented files are already streamable")
+        else:
+            out.append(bytes(data[offset:box_end]))
+
+        offset = box_end
+    return out
+
+def rebuild_moov(moov: bytes, insert_at: int, moov_at: int) -> bytes:
+    # moov を insert_at（最初の mdat の位置）へ移すと、その間にあるデータは新しい moov の長さ分だけ後ろにずれる。
+    # 元の moov より後ろにあるデータ（2つ目の mdat など）は、新旧の moov の長さの差だけずれる
+    moov_end = moov_at + len(moov)
+
+    def build(to_co64: bool) -> bytes:
+        # 新しい moov の長さはずらす量によらないので、先に長さを求めてからずらす
+        length = len(b"".join(_rewrite(moov, 0, len(moov), lambda value: value, to_co64)))
+        def shift(value: int) -> int:
+            if value < insert_at:
+                return value
+            if value < moov_at:
+                return value + length
+            if value < moov_end:
+                raise NotRemuxable("chunk offset points into moov")
+            return value + length - len(moov)
+        return b"".join(_rewrite(moov, 0, len(moov), shift, to_co64))
+
+    try:
+        return build(False)
+    except OverflowError:
+        # 32ビットのオフセットに収まらなくなる場合は stco を co64 に置き換える
+        return build(True)
+
+class FaststartService:
+    # MP4/MOV の moov を mdat の前へ移し、再生開始時にファイル末尾まで読まなくて済むようにする
+    def __init__(self, redis_db, minio):
+        self.redis_db = redis_db
+        self.minio = minio
+        self.semaphore = asyncio.Semaphore(max(1, Config.FASTSTART_CONCURRENCY))
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    @staticmethod
+    def can_remux(file_info: Dict[str, Any]) -> bool:
+        object_name = file_info.get("minio_path", "")
+        return (
+            file_info.get("virus_scan") == "clean"
+            and not file_info.get("faststart")
+            and (file_info.get("mime_type") in SOURCE_TYPES
+                 or PurePosixPath(object_name).suffix.lower() in SOURCE_EXTENSIONS)
+            # 重複排除の共有オブジェクトは他のレコードも参照しているので書き換えない
+            and not file_info.get("blob_hash")
+            and not encoding_of(object_name)
+        )
+
+    def schedule(self, session_id: str, file_id: str, file_info: Dict[str, Any]):
+        if not self.can_remux(file_info) or file_id in self.tasks:
+            return
+        task = asyncio.ensure_future(self._process(session_id, file_id, file_info["minio_path"]))
+        self.tasks[file_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(file_id, None))
+
+    async def _read(self, object_name: str, offset: int, length: int) -> bytes:
+        data = await self.minio.get_bytes(object_name, offset, length)
+        if data is None or len(data) != length:
+            raise IOError(f"short read at {offset}")
+        return data
+
+    async def _top_level_boxes(self, object_name: str, total: int) -> List[Box]:
+        boxes = []
+        offset = 0
+        while offset < total:
+            if len(boxes) >= MAX_TOP_LEVEL_BOXES:
+                raise NotRemuxable("too many top-level boxes")
+            header = await self._read(object_name, offset, min(16, total - offset))
+            kind, _, size = _box_header(header + b"\0" * (16 - len(header)), 0, total - offset)
+            boxes.append((kind, offset, size))
+            offset += size
+        return boxes
+
+    async def plan(self, object_name: str, total: int) -> Optional[Tuple[int, int, int]]:
+        # 戻り値: (最初の mdat の位置, moov の位置, moov の長さ)。並べ替え不要なら None
+        boxes = await self._top_level_boxes(object_name, total)
+        kinds = [kind for kind, _, _ in boxes]
+        if kinds.count(b"moov") != 1 or b"mdat" not in kinds:
+            raise NotRemuxable("expected exactly one moov and at least one mdat")
+        if b"moof" in kinds:
+            raise NotRemuxable("fragmented files are already streamable")
+
+        _, moov_at, moov_size = boxes[kinds.index(b"moov")]
+        _, mdat_at, _ = boxes[kinds.index(b"mdat")]
+        if moov_at < mdat_at:
+            return None
+        if moov_size > Config.FASTSTART_MAX_MOOV_BYTES:
+            raise NotRemuxable(f"moov is too large ({moov_size} bytes)")
+        return mdat_at, moov_at, moov_size
+
+    async def remux(self, object_name: str, target_name: str, content_type: str, total: int,
+                    insert_at: int, moov_at: int, moov_size: int):
+        moov = await self._read(object_name, moov_at, moov_size)
+        # オフセット表の書き換えは件数に比例するのでイベントループの外で行う
+        moov = await asyncio.get_event_loop().run_in_executor(None, rebuild_moov, moov, insert_at, moov_at)
+
+        # [mdat より前][新しい moov][mdat 〜 元の moov の手前][元の moov より後] の順に書き出す
+        segments = [(0, insert_at), None, (insert_at, moov_at - insert_at),
+                    (moov_at + moov_size, total - moov_at - moov_size)]
+        upload = await self.minio.start_multipart_upload(target_name, content_type)
+        try:
+            for segment in segments:
+                if segment is None:
+                    await upload.write(moov)
+                    continue
+                start, length = segment
+                if length <= 0:
+                    continue
+                stream = await self.minio.get_file_stream(object_name, start, length)
+                if stream is None:
+                    raise IOError(f"range not readable: {start}-{start + length - 1}")
+                async for chunk in stream:
+                    await upload.write(chunk)
+
+            success = await upload.complete()
+        except BaseException:
+            await upload.abort()
+            raise
+        if not success:
+            raise IOError("failed to store remuxed object")
+        return upload.size, upload.sha256.hexdigest()
+
+    async def _process(self, session_id: str, file_id: str, object_name: str):
+        async with self.semaphore:
+            try:
+                stat = await self.minio.get_file_info(object_name)
+                if not stat:
+                    return
+                layout = await self.plan(object_name, stat["size"])
+                if layout is None:
+                    logger.info(f"Already faststart: {object_name}")
+                    return
+
+                target_name = faststart_name(object_name)
+                size, content_hash = await self.remux(
+                    object_name, target_name, stat["content_type"], stat["size"], *layout
+                )
+            except NotRemuxable as e:
+                logger.info(f"Faststart skipped for {object_name}: {e}")
+                return
+            except Exception as e:
+                logger.error(f"Faststart error: {object_name} - {e}")
+                return
+
+            file_record = await self.redis_db.get_file(session_id, file_id, cached=False)
+            if not file_record or file_record.get("minio_path") != object_name:
+                # 処理中にレコードが消えたか別のオブジェクトに差し替わった
+                await self.minio.delete_file(target_name)
+                return
+
+            # スキャン結果の virus_scan_hash（とスキャンログ）は元の内容のまま残し、配信用のハッシュを別に持つ
+            file_record.update({
+                "minio_path": target_name,
+                "stored_name": target_name,
+                "size": size,
+                "content_hash": content_hash,
+                "faststart": True
+            })
+            await self.redis_db.set_file(session_id, file_id, file_record)
+            logger.info(f"Faststart applied: {object_name} -> {target_name} (moov {layout[2]} bytes)")
+
+        # 差し替え前に発行した署名付きURLや配信中のダウンロードのため、元のオブジェクトは少し待ってから消す
+        await asyncio.sleep(Config.DOWNLOAD_URL_EXPIRY)
+        await self.minio.delete_file(object_name)
+
+    async def close(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
@@ -1,29 +1,247 @@
 import hashlib
 import logging
 import asyncio
+import time
 from datetime import datetime
-from typing import Dict, Tuple, Optional, Any
+from typing import Dict, Tuple, Optional, Any, AsyncIterator, Awaitable, Callable
 from pathlib import Path
 
 from services.clamav_scan import ClamAVService
 from services.virus_scan import VirusScan
 from services.database import ScanLogDatabase
+from services.compression import encoding_of
+from services import codec
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+async def _iter_source(source) -> AsyncIterator[bytes]:
+    if isinstance(source, (bytes, bytearray)):
+        for i in range(0, len(source), Config.UPLOAD_CHUNK_SIZE):
+            yield source[i:i + Config.UPLOAD_CHUNK_SIZE]
+        return
+
+    loop = asyncio.get_event_loop()
+    while True:
+        chunk = await loop.run_in_executor(None, source.read, Config.UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
 class IntegratedScanService:
+    SHARED_RESULT_KEYS = (
+        'clamav_result', 'virustotal_result', 'upload_status',
+        'overall_status', 'rejection_reason', 'allow_upload'
+    )
+
     def __init__(self):
         self.clamav = ClamAVService()
         self.virustotal = VirusScan()
         self.db = ScanLogDatabase(Config.SCAN_LOG_DB_PATH if hasattr(Config, 'SCAN_LOG_DB_PATH') else "db/scan_logs.db")
         self.configured_tz = Config.get_timezone()
+        self.redis_db = None
+        self.minio = None
+        self.blobs = None
+        self.previews = None
+        self.faststart = None
         
     async def scan_file(self, 
                         file_content: bytes, 
                         file_info: Dict[str, Any],
                         session_info: Dict[str, Any],
                         progress_callback=None) -> Dict[str, Any]:
+        async def chunks():
+            for i in range(0, len(file_content), Config.UPLOAD_CHUNK_SIZE):
+                yield file_content[i:i + Config.UPLOAD_CHUNK_SIZE]
+
+        async def rewind():
+            return file_content
+
+        return await self.scan_stream(chunks(), file_info, session_info, progress_callback, rewind=rewind)
+
+    async def scan_object(self,
+                          object_name: str,
+                          file_info: Dict[str, Any],
+                          session_info: Dict[str, Any],
+                          progress_callback=None) -> Dict[str, Any]:
+        # 判定キャッシュに当たった場合は読み出さないよう、ストリームは最初の読み込み時に開く
+        async def chunks():
+            file_stream = await self.minio.get_decoded_stream(object_name)
+            if file_stream is None:
+                raise FileNotFoundError(f"Object not found: {object_name}")
+            async for chunk in file_stream:
+                yield chunk
+
+        spools = []
+
+        async def rewind():
+            spool = await self.minio.download_to_tempfile(object_name)
+            spools.append(spool)
+            return spool
+
+        try:
+            return await self.scan_stream(chunks(), file_info, session_info, progress_callback, rewind=rewind)
+        finally:
+            for spool in spools:
+                if spool:
+                    spool.close()
+
+    async def _scan_chunks(self,
+                           chunks: AsyncIterator[bytes],
+                           total_size: int,
+                           progress_callback=None,
+                           sink=None,
+                           rewind=None) -> Tuple[str, str, str, int]:
+        hasher = hashlib.sha256()
+        received = 0
+        clamav_stream = None
+
+        try:
+            clamav_stream = await self.clamav.open_stream()
+        except Exception as e:
+            logger.error(f"Cannot open ClamAV stream: {type(e).__name__}: {e}")
+
+        try:
+            async for chunk in chunks:
+                hasher.update(chunk)
+                received += len(chunk)
+
+                tasks = []
+                if clamav_stream:
+                    tasks.append(clamav_stream.send(chunk))
+                if sink:
+                    tasks.append(sink.write(chunk))
+                await asyncio.gather(*tasks)
+
+                if progress_callback and total_size:
+                    progress = received / total_size * 100
+                    await progress_callback(
+                        10 + progress * 0.5,
+                        f"ClamAV: スキャン中: {received:,}/{total_size:,} bytes ({progress:.1f}%)"
+                    )
+
+            if clamav_stream:
+                clamav_status, clamav_details = await clamav_stream.finish()
+            else:
+                clamav_status, clamav_details = 'error', 'ClamAV service unavailable'
+        finally:
+            if clamav_stream:
+                await clamav_stream.close()
+
+        if clamav_status == 'error' and rewind:
+            logger.warning(f"ClamAV streaming scan failed ({clamav_details}), rescanning from source")
+
+            async def rescan_chunks():
+                source = await rewind()
+                async for chunk in _iter_source(source):
+                    yield chunk
+
+            clamav_status, clamav_details = await self.clamav.scan_stream(rescan_chunks, received)
+
+        return clamav_status, clamav_details, hasher.hexdigest(), received
+
+    async def scan_stream(self,
+                          chunks: AsyncIterator[bytes],
+                          file_info: Dict[str, Any],
+                          session_info: Dict[str, Any],
+                          progress_callback=None,
+                          sink=None,
+                          rewind: Optional[Callable[[], Awaitable[Any]]] = None) -> Dict[str, Any]:
+        file_hash = file_info.get('sha256')
+        if not (Config.SCAN_SINGLE_FLIGHT and file_hash and self.redis_db):
+            return await self._scan(chunks, file_info, session_info, progress_callback, sink, rewind)
+
+        # 同じ内容のスキャンが他で進行中なら、その結果と進捗を共有する
+        owner = file_info['uuid']
+        flight_ttl = Config.CLAMAV_TIMEOUT + 300
+        leader = await self.redis_db.start_scan_flight(file_hash, owner, flight_ttl)
+        if not leader:
+            shared = await self._follow_scan_flight(file_hash, progress_callback)
+            if shared:
+                return await self._shared_result(shared, chunks, file_info, session_info, sink)
+            leader = await self.redis_db.start_scan_flight(file_hash, owner, flight_ttl)
+
+        if not leader:
+            return await self._scan(chunks, file_info, session_info, progress_callback, sink, rewind)
+
+        async def relay_progress(percent: float, message: str):
+            if progress_callback:
+                await progress_callback(percent, message)
+            await self.redis_db.publish_scan_flight(file_hash, {
+                "type": "progress",
+                "percent": percent,
+                "message": message
+            })
+
+        result = None
+        try:
+            result = await self._scan(chunks, file_info, session_info, relay_progress, sink, rewind)
+            return result
+        finally:
+            # 失敗時は結果を残さずロックだけ外し、待機側にはそれぞれスキャンさせる
+            shared = None
+            if result and result['file_hash'] == file_hash:
+                shared = {key: result[key] for key in self.SHARED_RESULT_KEYS}
+            await self.redis_db.finish_scan_flight(file_hash, owner, shared, Config.SCAN_FLIGHT_RESULT_TTL)
+
+    async def _follow_scan_flight(self, file_hash: str, progress_callback=None) -> Optional[Dict[str, Any]]:
+        logger.info(f"Waiting for in-flight scan of {file_hash}")
+        pubsub = await self.redis_db.subscribe_scan_flight(file_hash)
+        try:
+            while True:
+                active, shared = await self.redis_db.get_scan_flight(file_hash)
+                if shared:
+                    return shared
+                if not active:
+                    # 先行スキャンが結果を残さずに終わった（またはロックが切れた）
+                    return None
+
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if not message:
+                        break
+                    event = codec.json_loads(message["data"])
+                    if event['type'] == 'done':
+                        break
+                    if progress_callback:
+                        await progress_callback(event['percent'], event['message'])
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+
+    async def _shared_result(self, shared: Dict[str, Any], chunks: AsyncIterator[bytes],
+                             file_info: Dict[str, Any], session_info: Dict[str, Any],
+                             sink=None) -> Dict[str, Any]:
+        received = file_info['size']
+        if sink and shared['allow_upload']:
+            received = 0
+            async for chunk in chunks:
+                received += len(chunk)
+                await sink.write(chunk)
+
+        result = {
+            'file_uuid': file_info['uuid'],
+            'file_name': file_info['name'],
+            'file_size': received,
+            'file_extension': file_info.get('extension', ''),
+            'upload_time_local': datetime.now(self.configured_tz).strftime('%Y-%m-%d %H:%M:%S'),
+            'file_hash': file_info['sha256'],
+            **shared
+        }
+        logger.info(f"Shared in-flight scan result for {file_info['name']}: {result['overall_status']}")
+
+        await self._save_log(result, session_info)
+        return result
+
+    async def _scan(self,
+                    chunks: AsyncIterator[bytes],
+                    file_info: Dict[str, Any],
+                    session_info: Dict[str, Any],
+                    progress_callback=None,
+                    sink=None,
+                    rewind: Optional[Callable[[], Awaitable[Any]]] = None) -> Dict[str, Any]:
+        # chunksは一度だけ読み、ハッシュ・ClamAV・sinkへ同時に流す
+        # rewindは先頭から読み直せるファイル（またはbytes）を返す（ClamAV再試行・VirusTotal送信用）
         result = {
             'file_uuid': file_info['uuid'],
             'file_name': file_info['name'],
@@ -41,15 +259,51 @@ class IntegratedScanService:
         
         try:
             if progress_callback:
-                await progress_callback(10, "ハッシュ計算中...")
-            
-            file_hash = hashlib.sha256(file_content).hexdigest()
+                await progress_callback(10, "ClamAVスキャン中...")
+
+            total_size = file_info['size']
+            known_hash = file_info.get('sha256')
+            signature_version = None
+            cached = None
+            blacklist_info = None
+
+            if known_hash:
+                blacklist_info = await self.db.is_blacklisted(known_hash)
+
+            if Config.VERDICT_CACHE_ENABLED and not blacklist_info:
+                signature_version = await self.clamav.get_signature_version()
+                if known_hash:
+                    cached = await self._get_cached_verdict(known_hash, signature_version)
+
+            if blacklist_info:
+                # 既知の感染ファイルはスキャンせずに拒否する
+                clamav_status, clamav_details = 'blacklisted', blacklist_info['detection_source']
+                file_hash = known_hash
+                received = total_size
+            elif cached:
+                # 同じ定義DBで判定済みの内容はClamAVに流さず、保存（sink）だけ行う
+                logger.info(f"Verdict cache hit: {known_hash} ({cached['clamav_version']})")
+                clamav_status, clamav_details = cached['clamav_result'], cached['clamav_details']
+                file_hash = known_hash
+                received = total_size
+                if sink:
+                    received = 0
+                    async for chunk in chunks:
+                        received += len(chunk)
+                        await sink.write(chunk)
+            else:
+                clamav_status, clamav_details, file_hash, received = await self._scan_chunks(
+                    chunks, total_size, progress_callback, sink, rewind
+                )
+
             result['file_hash'] = file_hash
+            result['file_size'] = received
             logger.info(f"File hash calculated: {file_hash}")
             if progress_callback:
-                await progress_callback(20, "ブラックリストチェック中...")
+                await progress_callback(60, "ブラックリストチェック中...")
             
-            blacklist_info = await self.db.is_blacklisted(file_hash)
+            if not blacklist_info:
+                blacklist_info = await self.db.is_blacklisted(file_hash)
             if blacklist_info:
                 logger.warning(f"File {file_info['name']} is blacklisted: {blacklist_info}")
                 result['upload_status'] = 'rejected'
@@ -60,18 +314,6 @@ class IntegratedScanService:
 
                 await self._save_log(result, session_info)
                 return result
-
-            if progress_callback:
-                await progress_callback(30, "ClamAVスキャン中...")
-
-            async def clamav_progress(percent, message):
-                actual_progress = 30 + (percent * 0.3)
-                await progress_callback(actual_progress, f"ClamAV: {message}")
-            
-            clamav_status, clamav_details = await self.clamav.scan_file_content(
-                file_content, 
-                clamav_progress if progress_callback else None
-            )
             
             result['clamav_result'] = clamav_status
             logger.info(f"ClamAV scan result: {clamav_status} - {clamav_details}")
@@ -89,7 +331,12 @@ class IntegratedScanService:
             if progress_callback:
                 await progress_callback(70, "VirusTotalチェック中...")
             
-            if Config.VIRUSTOTAL_API_KEY:
+            cached_vt = self._fresh_vt_result(cached)
+            if cached_vt:
+                result['virustotal_result'] = cached_vt
+                if cached_vt == 'suspicious':
+                    result['overall_status'] = 'suspicious'
+            elif Config.VIRUSTOTAL_API_KEY:
                 try:
                     vt_result = await self.virustotal.check_file_hash(file_hash)
                     result['virustotal_result'] = vt_result
@@ -105,13 +352,15 @@ class IntegratedScanService:
                         await self._save_log(result, session_info)
                         return result
 
-                    elif vt_result == 'unknown' and file_info['size'] <= 32 * 1024 * 1024:
+                    elif vt_result == 'unknown' and result['file_size'] <= 32 * 1024 * 1024:
                         if progress_callback:
                             await progress_callback(75, "VirusTotalに送信中...")
                         
-                        logger.info(f"Submitting file to VirusTotal: {file_info['name']} ({file_info['size']} bytes)")
+                        logger.info(f"Submitting file to VirusTotal: {file_info['name']} ({result['file_size']} bytes)")
 
-                        scan_id = await self.virustotal.submit_file_for_scan(file_content)
+                        scan_id = None
+                        if rewind:
+                            scan_id = await self.virustotal.submit_file_for_scan(await rewind())
                         
                         if scan_id:
                             logger.info(f"VirusTotal submission successful, scan ID: {scan_id}")
@@ -197,6 +446,10 @@ class IntegratedScanService:
                 result['rejection_reason'] = 'スキャンエラー'
                 result['allow_upload'] = False
 
+            if result['allow_upload'] and clamav_status == 'clean' and signature_version and not cached_vt:
+                await self._cache_verdict(file_hash, signature_version, clamav_details,
+                                          result['virustotal_result'], cached)
+
             if progress_callback:
                 await progress_callback(100, "完了")
             
@@ -214,6 +467,125 @@ class IntegratedScanService:
             
             return result
     
+    async def _get_cached_verdict(self, file_hash: str, signature_version: Optional[str]) -> Optional[Dict[str, Any]]:
+        if not signature_version:
+            return None
+
+        try:
+            verdict = await self.redis_db.get_verdict(file_hash) if self.redis_db else None
+            if verdict is None:
+                verdict = await self.db.get_verdict(file_hash)
+                if verdict is None:
+                    return None
+                if self.redis_db:
+                    ttl = Config.VERDICT_CACHE_TTL - (time.time() - verdict['cached_at'])
+                    if ttl > 0:
+                        await self.redis_db.set_verdict(file_hash, verdict, ttl)
+
+            # 定義DBが更新されたか、期限を過ぎた判定は使わない
+            if (verdict['clamav_version'] != signature_version
+                    or time.time() - verdict['cached_at'] >= Config.VERDICT_CACHE_TTL):
+                logger.info(f"Verdict cache invalidated: {file_hash} ({verdict['clamav_version']} -> {signature_version})")
+                await self._invalidate_verdict(file_hash)
+                return None
+
+            return verdict
+        except Exception as e:
+            logger.error(f"Verdict cache lookup error: {e}")
+            return None
+
+    def _fresh_vt_result(self, verdict: Optional[Dict[str, Any]]) -> Optional[str]:
+        # VirusTotalの判定は確定済み（clean/suspicious）かつ新しいものだけ再利用する
+        if not verdict or verdict.get('virustotal_result') not in ('clean', 'suspicious'):
+            return None
+        if not verdict.get('vt_checked_at'):
+            return None
+        if time.time() - verdict['vt_checked_at'] >= Config.VERDICT_CACHE_VT_MAX_AGE:
+            return None
+        return verdict['virustotal_result']
+
+    async def _cache_verdict(self, file_hash: str, signature_version: str, clamav_details: str,
+                             vt_result: str, cached: Optional[Dict[str, Any]] = None):
+        now = time.time()
+        verdict = {
+            'clamav_result': 'clean',
+            'clamav_details': clamav_details,
+            'clamav_version': signature_version,
+            'virustotal_result': vt_result,
+            'vt_checked_at': now if vt_result in ('clean', 'suspicious') else None,
+            # ClamAVの判定を再利用した場合は最初にスキャンした時刻から期限を数える
+            'cached_at': cached['cached_at'] if cached else now
+        }
+
+        try:
+            await self.db.save_verdict(file_hash, verdict)
+            if self.redis_db:
+                await self.redis_db.set_verdict(file_hash, verdict, Config.VERDICT_CACHE_TTL - (now - verdict['cached_at']))
+        except Exception as e:
+            logger.error(f"Verdict cache save error: {e}")
+
+    async def _invalidate_verdict(self, file_hash: str):
+        if self.redis_db:
+            await self.redis_db.delete_verdict(file_hash)
+        await self.db.delete_verdict(file_hash)
+
+    def error_result(self, file_info: Dict[str, Any], reason: str) -> Dict[str, Any]:
+        return {
+            'file_uuid': file_info['uuid'],
+            'file_name': file_info['name'],
+            'file_size': file_info['size'],
+            'file_hash': None,
+            'clamav_result': 'error',
+            'virustotal_result': 'error',
+            'upload_status': 'error',
+            'overall_status': 'error',
+            'rejection_reason': reason,
+            'allow_upload': False
+        }
+
+    async def apply_scan_result(self, session_id: str, file_id: str,
+                                file_path: str, scan_result: Dict[str, Any]):
+        file_record = await self.redis_db.get_file(session_id, file_id, cached=False)
+
+        if not scan_result['allow_upload']:
+            logger.warning(f"Stored file rejected after scan: {file_path} - {scan_result['rejection_reason']}")
+            if file_record and file_record.get('blob_hash'):
+                await self.blobs.release(file_record['blob_hash'], session_id, file_id)
+            elif self.minio and not await self.redis_db.get_blob_paths([file_path]):
+                # レコードが先に期限切れになっていても、共有中のオブジェクトは消さない
+                await self.minio.delete_file(file_path)
+
+        if not file_record:
+            logger.warning(f"File record for {file_id} expired before scan completed")
+            return
+
+        file_record.update({
+            'virus_scan': scan_result['overall_status'],
+            'clamav_result': scan_result['clamav_result'],
+            'virustotal_result': scan_result['virustotal_result'],
+            'virus_scan_hash': scan_result['file_hash'] or file_record.get('virus_scan_hash'),
+            'download_enabled': scan_result['allow_upload']
+        })
+
+        # ハッシュが確定したので、同じ内容の保存済みオブジェクトがあればそちらを参照する
+        if (Config.STORAGE_DEDUP and self.blobs and scan_result['allow_upload']
+                and scan_result['file_hash'] and not file_record.get('blob_hash')):
+            stored_path = await self.blobs.adopt(scan_result['file_hash'], session_id, file_id, file_path)
+            if stored_path:
+                file_record['minio_path'] = stored_path
+                file_record['blob_hash'] = scan_result['file_hash']
+                if encoding_of(stored_path):
+                    file_record['content_encoding'] = encoding_of(stored_path)
+                else:
+                    file_record.pop('content_encoding', None)
+
+        await self.redis_db.set_file(session_id, file_id, file_record)
+
+        if self.previews:
+            self.previews.schedule(file_record)
+        if self.faststart:
+            self.faststart.schedule(session_id, file_id, file_record)
+
     async def _save_log(self, scan_result: Dict, session_info: Dict):
         try:
             log_data = {
@@ -252,6 +624,10 @@ class IntegratedScanService:
             if result:
                 return result
 
+        return await self.find_scan_log(file_uuid)
+    
+    async def find_scan_log(self, file_uuid: str) -> Optional[Dict]:
+        # Redis上のスキャン結果が期限切れになった後は、SQLiteのスキャンログから探す
         logs = await self.db.get_recent_logs(100)
         for log in logs:
             if log['file_uuid'] == file_uuid:
@@ -263,7 +639,7 @@ class IntegratedScanService:
         await self.db.update_scan_result(file_uuid, virustotal_result=vt_result)
         
         if self.redis_db:
-            existing = await self.redis_db.get(f"scan_result:{file_uuid}")
+            existing = await self.redis_db.get(f"scan_result:{file_uuid}", cached=False)
             if existing:
                 existing['virustotal_result'] = vt_result
                 await self.redis_db.set(f"scan_result:{file_uuid}", existing, expire=86400)
\ No newline at end of file
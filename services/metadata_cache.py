@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+from config import Config
+from services import codec
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "metadata_cache:invalidate"
+MISSING = object()
+
+class MetadataCache:
+    # セッション・ファイル情報・スキャン結果のプロセス内キャッシュ（TTL＋LRU）。
+    # 各エントリは元になったRedisのキーを覚えておき、そのキーへの書き込みが pub/sub で届いたら捨てる
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: "OrderedDict[str, Tuple[float, Any, Tuple[str, ...]]]" = OrderedDict()
+        self.dependents: Dict[str, Set[str]] = {}
+        # 読み込み中に無効化が来た値を入れないよう、無効化のたびに進める
+        self.generation = 0
+        # 購読が切れている間は無効化を取りこぼすので、キャッシュを使わない
+        self.listening = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Any:
+        if not self.listening:
+            return MISSING
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, value: Any, depends: Iterable[str], generation: int, ttl: Optional[float] = None):
+        if not self.listening or generation != self.generation:
+            return
+        if key in self.entries:
+            self._drop(key)
+        depends = tuple(depends)
+        expires = time.monotonic() + min(self.ttl, ttl if ttl is not None else self.ttl)
+        self.entries[key] = (expires, value, depends)
+        for redis_key in depends:
+            self.dependents.setdefault(redis_key, set()).add(key)
+        while len(self.entries) > self.max_entries:
+            self._drop(next(iter(self.entries)))
+
+    def _drop(self, key: str):
+        _, _, depends = self.entries.pop(key)
+        for redis_key in depends:
+            keys = self.dependents.get(redis_key)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self.dependents[redis_key]
+
+    def invalidate(self, redis_keys: Iterable[str]):
+        self.generation += 1
+        for redis_key in redis_keys:
+            for key in list(self.dependents.get(redis_key, ())):
+                self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self.entries.clear()
+        self.dependents.clear()
+
+    async def run(self, client):
+        # 他のプロセス（ワーカーを含む）の書き込みを受け取って該当するエントリを捨てる
+        while True:
+            pubsub = client.pubsub()
+            try:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                self.clear()
+                self.listening = True
+                logger.info("Metadata cache invalidation subscribed")
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message:
+                        self.invalidate(codec.json_loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Metadata cache subscription error: {e}")
+            finally:
+                self.listening = False
+                self.clear()
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
+            await asyncio.sleep(1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "listening": self.listening,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations
+        }
+
+def create_cache() -> Optional[MetadataCache]:
+    if not Config.METADATA_CACHE_ENABLED:
+        return None
+    return MetadataCache(Config.METADATA_CACHE_MAX_ENTRIES, Config.METADATA_CACHE_TTL)
@@ -0,0 +1,129 @@
+import asyncio
+import io
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+from config import Config
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Pillowで確実に読める形式だけを対象にする（SVGなどは元ファイルをそのまま表示する）
+SOURCE_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp", "image/tiff"}
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+FAILED_MEMORY = 1024
+
+def available() -> bool:
+    return Image is not None
+
+def preview_name(object_name: str) -> str:
+    # 元のオブジェクトの隣に置き、元を削除するときに一緒に消す
+    return f"{object_name}.preview.{Config.PREVIEW_FORMAT}"
+
+def render(source, max_dimension: int, image_format: str, quality: int) -> bytes:
+    with Image.open(source) as image:
+        # JPEGはデコード時に縮小できるので、巨大な写真でも全画素を展開しない
+        image.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension))
+
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        if has_alpha and image_format == "webp":
+            image = image.convert("RGBA")
+        elif has_alpha:
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+        else:
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        image.save(output, format=image_format.upper(), quality=quality)
+        return output.getvalue()
+
+class PreviewService:
+    # 画像ファイルの縮小プレビュー。スキャンで clean になった後に生成し、MinIOに保存して使い回す
+    def __init__(self, minio):
+        self.minio = minio
+        self.media_type = MEDIA_TYPES[Config.PREVIEW_FORMAT]
+        # デコードと縮小はCPUを使うため、専用の小さなスレッドプールで上限を設ける
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, Config.PREVIEW_WORKERS),
+            thread_name_prefix="preview"
+        )
+        self.pending: Dict[str, asyncio.Task] = {}
+        # 読めない画像を毎回デコードし直さないよう、失敗したものを覚えておく
+        self.failed: "OrderedDict[str, None]" = OrderedDict()
+
+    @staticmethod
+    def can_preview(file_info: Dict[str, Any]) -> bool:
+        return (
+            file_info.get("virus_scan") == "clean"
+            and file_info.get("download_enabled", True)
+            and file_info.get("mime_type") in SOURCE_TYPES
+            and file_info.get("size", 0) <= Config.PREVIEW_MAX_SOURCE_BYTES
+        )
+
+    def schedule(self, file_info: Dict[str, Any]):
+        # スキャン完了時に先に作っておく。応答は待たせない
+        if self.can_preview(file_info) and preview_name(file_info["minio_path"]) not in self.failed:
+            self._start(file_info["minio_path"], check_existing=True)
+
+    async def get(self, file_info: Dict[str, Any]) -> Optional[bytes]:
+        name = preview_name(file_info["minio_path"])
+        data = await self.minio.get_bytes(name)
+        if data is not None or name in self.failed:
+            return data
+        return await asyncio.shield(self._start(file_info["minio_path"]))
+
+    def _start(self, object_name: str, check_existing: bool = False) -> asyncio.Task:
+        # 同じオブジェクトの生成は1つにまとめる（プロセスをまたいで重なっても同じ内容で上書きするだけ）
+        name = preview_name(object_name)
+        task = self.pending.get(name)
+        if task is None:
+            task = asyncio.ensure_future(self._generate(object_name, name, check_existing))
+            self.pending[name] = task
+            task.add_done_callback(lambda _: self.pending.pop(name, None))
+        return task
+
+    async def _generate(self, object_name: str, name: str, check_existing: bool) -> Optional[bytes]:
+        try:
+            if check_existing:
+                data = await self.minio.get_bytes(name)
+                if data is not None:
+                    return data
+
+            source = await self.minio.download_to_tempfile(object_name)
+            if source is None:
+                return None
+
+            try:
+                data = await asyncio.get_event_loop().run_in_executor(
+                    self.executor, render, source,
+                    Config.PREVIEW_MAX_DIMENSION, Config.PREVIEW_FORMAT, Config.PREVIEW_QUALITY
+                )
+            finally:
+                source.close()
+
+            if await self.minio.put_bytes(name, data, self.media_type):
+                logger.info(f"Preview generated: {name} ({len(data)} bytes)")
+            return data
+
+        except Exception as e:
+            logger.error(f"Preview generation error: {object_name} - {e}")
+            self.failed[name] = None
+            if len(self.failed) > FAILED_MEMORY:
+                self.failed.popitem(last=False)
+            return None
+
+    async def close(self):
+        for task in list(self.pending.values()):
+            task.cancel()
+        await asyncio.gather(*self.pending.values(), return_exceptions=True)
+        self.executor.shutdown(wait=False)
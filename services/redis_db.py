@@ -1,127 +1,916 @@
 import redis.asyncio as redis
-import json
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
 import logging
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, List, Tuple
 from config import Config
+from services import codec
+from services.metadata_cache import INVALIDATION_CHANNEL, MISSING, create_cache
 
 logger = logging.getLogger(__name__)
 
+# 実行可能（score <= now）なジョブを1件取り出し、リース期限までscoreを先送りする。
+# ワーカーが落ちてもリースが切れれば再び取り出される。
+CLAIM_SCAN_JOB_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+if #due == 0 then
+    return nil
+end
+redis.call('ZADD', KEYS[1], tonumber(ARGV[1]) + tonumber(ARGV[2]), due[1])
+local attempts = redis.call('HINCRBY', KEYS[2], due[1], 1)
+return {due[1], attempts}
+"""
+
+# 同じハッシュの保存済みオブジェクトがあれば参照を1つ増やしてそのパスを返す。
+# 無ければ ARGV[3] のパスで新規登録する（空なら nil）。
+# 参照は blob_refs の member（hash:session_id:file_id）単位で数えるため、同じファイルの二重登録では増えない。
+# 共有中のオブジェクトは uploads/ にあることもあるので、期限切れの掃除で消さないよう blob_paths に登録する
+ACQUIRE_BLOB_SCRIPT = """
+local path = redis.call('HGET', KEYS[1], 'path')
+if not path then
+    if ARGV[3] == '' then
+        return nil
+    end
+    path = ARGV[3]
+    redis.call('HSET', KEYS[1], 'path', path, 'refs', 0)
+    redis.call('SADD', KEYS[3], path)
+end
+if redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1]) == 1 then
+    redis.call('HINCRBY', KEYS[1], 'refs', 1)
+end
+return path
+"""
+
+# 参照を1つ外し、最後の参照だった場合は削除すべきオブジェクトのパスを返す
+RELEASE_BLOB_SCRIPT = """
+if redis.call('ZREM', KEYS[2], ARGV[1]) == 0 then
+    return nil
+end
+if redis.call('HINCRBY', KEYS[1], 'refs', -1) > 0 then
+    return nil
+end
+local path = redis.call('HGET', KEYS[1], 'path')
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[3], path)
+return path
+"""
+
+# 期限切れの参照をまとめて外し、処理件数と参照が無くなったオブジェクトのパスを返す
+EXPIRE_BLOB_REFS_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local paths = {}
+for _, member in ipairs(due) do
+    redis.call('ZREM', KEYS[1], member)
+    local key = 'blob:' .. string.match(member, '^[^:]+')
+    if redis.call('EXISTS', key) == 1 and redis.call('HINCRBY', key, 'refs', -1) <= 0 then
+        local path = redis.call('HGET', key, 'path')
+        table.insert(paths, path)
+        redis.call('DEL', key)
+        redis.call('SREM', KEYS[2], path)
+    end
+end
+return {#due, paths}
+"""
+
+# 期限を過ぎたオブジェクトをまとめて取り出し、リース期限までscoreを先送りする。
+# 削除の途中でプロセスが落ちてもリースが切れれば再び取り出される
+CLAIM_EXPIRED_OBJECTS_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local lease_until = math.floor(tonumber(ARGV[1])) + tonumber(ARGV[3])
+for _, name in ipairs(due) do
+    redis.call('ZADD', KEYS[1], lease_until, name)
+end
+return {lease_until, due}
+"""
+
+# 削除が終わったものを外す。リース中に登録し直されたもの（scoreが変わったもの）は残す
+FINISH_EXPIRED_OBJECTS_SCRIPT = """
+local removed = 0
+for i = 2, #ARGV do
+    local score = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if score and tonumber(score) == tonumber(ARGV[1]) then
+        removed = removed + redis.call('ZREM', KEYS[1], ARGV[i])
+    end
+end
+return removed
+"""
+
+# 先行スキャンの結果を保存して待機側へ通知し、自分が持っているロックだけを外す
+FINISH_SCAN_FLIGHT_SCRIPT = """
+if ARGV[2] ~= '' then
+    redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+end
+redis.call('PUBLISH', KEYS[3], '{"type": "done"}')
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+end
+return 1
+"""
+
+# ファイルIDを追加し、セッションと同じ期限を付ける。セッションが無ければ 0、旧形式（JSON文字列）なら -1
+ADD_SESSION_FILE_SCRIPT = """
+local kind = redis.call('TYPE', KEYS[1]).ok
+if kind == 'none' then
+    return 0
+end
+if kind == 'string' then
+    return -1
+end
+redis.call('ZADD', KEYS[2], 'NX', ARGV[2], ARGV[1])
+redis.call('HSET', KEYS[1], 'status', 'uploaded')
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl > 0 then
+    redis.call('PEXPIRE', KEYS[2], ttl)
+end
+return 1
+"""
+
+# 旧形式のセッション（JSON文字列）をハッシュ＋ファイルIDのZSETに置き換える。残りの期限は引き継ぐ
+MIGRATE_SESSION_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok ~= 'string' then
+    return 0
+end
+local ttl = redis.call('PTTL', KEYS[1])
+local data = cjson.decode(redis.call('GET', KEYS[1]))
+redis.call('DEL', KEYS[1])
+for field, value in pairs(data) do
+    if field ~= 'files' and value ~= cjson.null and type(value) ~= 'table' then
+        redis.call('HSET', KEYS[1], field, tostring(value))
+    end
+end
+if type(data['files']) == 'table' then
+    for i, file_id in ipairs(data['files']) do
+        redis.call('ZADD', KEYS[2], 'NX', i, file_id)
+    end
+end
+if ttl > 0 then
+    redis.call('PEXPIRE', KEYS[1], ttl)
+    redis.call('PEXPIRE', KEYS[2], ttl)
+end
+return 1
+"""
+
+# ファイル情報の保存。既存のレコードを書き換える場合（スキャン結果の反映など）は残りの期限を変えず、
+# 期限切れの削除対象（object_expiry）や共有オブジェクトの参照（blob_refs）もその期限に揃える。
+# ARGV = 値, 新規時の期限（秒）, 現在時刻, MinIOのパス, 共有オブジェクトの参照（共有しなければ空）
+SET_FILE_SCRIPT = """
+local expire_at
+local ttl = redis.call('PTTL', KEYS[1])
+if ttl > 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'KEEPTTL')
+    expire_at = tonumber(ARGV[3]) + ttl / 1000
+else
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+    expire_at = tonumber(ARGV[3]) + tonumber(ARGV[2])
+end
+if ARGV[5] ~= '' then
+    redis.call('ZADD', KEYS[3], 'XX', expire_at, ARGV[5])
+    -- 共有オブジェクトは参照が無くなったときに blob GC が消すので、期限切れの削除対象から外す
+    if ARGV[4] ~= '' then
+        redis.call('ZREM', KEYS[2], ARGV[4])
+    end
+elseif ARGV[4] ~= '' then
+    redis.call('ZADD', KEYS[2], 'NX', expire_at, ARGV[4])
+end
+return 1
+"""
+
+# ファイルページ・ダウンロード用に、セッション・所属確認・ファイル情報・スキャン結果を1往復で読む。
+# KEYS = session, session_files, file:{session_id}:{file_id}, scan_result:{file_id}（呼び出し側が session_id から組み立てる）。
+# セッションが無いか、ファイルが含まれていないか、session_id が ARGV[3] と違えば nil、旧形式のセッションなら -1
+GET_FILE_CONTEXT_SCRIPT = """
+local kind = redis.call('TYPE', KEYS[1]).ok
+if kind == 'string' then
+    return -1
+end
+if kind == 'none' or not redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    return nil
+end
+if redis.call('HGET', KEYS[1], 'session_id') ~= ARGV[3] then
+    return nil
+end
+local scan_result = false
+if ARGV[2] == '1' then
+    scan_result = redis.call('GET', KEYS[4])
+end
+return {
+    redis.call('HGETALL', KEYS[1]),
+    redis.call('ZCARD', KEYS[2]),
+    redis.call('TTL', KEYS[1]),
+    redis.call('GET', KEYS[3]),
+    scan_result
+}
+"""
+
+# GCRA による複数の制限の一括判定。KEYS ごとに ARGV[3 + 3i..] = (期間あたりの上限, 期間ミリ秒, 消費量)。
+# 値は次に枠が空く理論上の時刻（TAT）。1つでも超えるなら何も消費せず、待つべきミリ秒を返す。
+# 上限を超える消費量は上限として扱う（枠が丸ごと空いていれば通す）
+RATE_LIMIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local wait = 0
+local tats = {}
+for i, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[i * 3])
+    local period = tonumber(ARGV[i * 3 + 1])
+    local cost = math.min(tonumber(ARGV[i * 3 + 2]), limit)
+    local tat = math.max(tonumber(redis.call('GET', key) or 0), now)
+    tats[i] = tat + cost * period / limit
+    wait = math.max(wait, tats[i] - period - now)
+end
+if wait > 0 or ARGV[2] == '1' then
+    return math.ceil(wait)
+end
+for i, key in ipairs(KEYS) do
+    redis.call('SET', key, string.format('%.3f', tats[i]), 'PX', math.ceil(tats[i] - now))
+end
+return 0
+"""
+
+_pool = None
+_client = None
+
+def get_client() -> redis.Redis:
+    # プロセス内の全サービスで1つの接続プールを共有する。
+    # 作成に await を挟まないため、初回アクセスが同時に来ても作られるのは1つだけ
+    global _pool, _client
+    if _client is None:
+        _pool = redis.BlockingConnectionPool.from_url(
+            Config.REDIS_URL,
+            decode_responses=True,
+            max_connections=Config.REDIS_MAX_CONNECTIONS,
+            timeout=Config.REDIS_POOL_TIMEOUT,
+            socket_connect_timeout=Config.REDIS_CONNECT_TIMEOUT,
+            socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+            health_check_interval=Config.REDIS_HEALTH_CHECK_INTERVAL,
+            retry_on_timeout=Config.REDIS_RETRY_ON_TIMEOUT,
+            # 再起動直後に全リクエストが一斉に再接続しないよう、間隔を空けて再試行する
+            retry=Retry(ExponentialBackoff(cap=1.0, base=0.05), Config.REDIS_RETRIES)
+        )
+        _client = redis.Redis(connection_pool=_pool)
+    return _client
+
+def pool_stats() -> Dict[str, Any]:
+    if _pool is None:
+        return {"created": False}
+    in_use = len(_pool._in_use_connections)
+    idle = len(_pool._available_connections)
+    return {
+        "created": True,
+        "max_connections": _pool.max_connections,
+        "connections": in_use + idle,
+        "in_use": in_use,
+        "idle": idle
+    }
+
+async def close_pool():
+    global _pool, _client
+    if _client is not None:
+        await _client.aclose()
+        await _pool.disconnect()
+        _pool, _client = None, None
+
 class RedisDB:
     def __init__(self):
         self.redis_url = Config.REDIS_URL
-        self.redis = None
+        self._claim_scan_job = None
+        self._acquire_blob = None
+        self._release_blob = None
+        self._expire_blob_refs = None
+        self._finish_scan_flight = None
+        self._add_session_file = None
+        self._migrate_session = None
+        self._get_file_context = None
+        self._set_file = None
+        self._rate_limit = None
+        self._claim_expired_objects = None
+        self._finish_expired_objects = None
+        self.cache = create_cache()
     
     async def _get_client(self):
-        if not self.redis:
-            self.redis = await redis.from_url(self.redis_url, decode_responses=True)
-        return self.redis
+        return get_client()
+    
+    def _cache_get(self, key: str) -> Any:
+        return self.cache.get(key) if self.cache else MISSING
+    
+    def _cache_generation(self) -> int:
+        return self.cache.generation if self.cache else 0
+    
+    def _cache_put(self, key: str, value: Any, depends: Tuple[str, ...], generation: int, ttl: float = None):
+        # 値はRedisから読んだままの形で持ち、返すたびに組み立て直す（呼び出し側が書き換えても共有されない）
+        if self.cache and value:
+            self.cache.put(key, value, depends, generation, ttl)
+    
+    async def _invalidate(self, *keys: str):
+        # 自プロセスのキャッシュはすぐに捨て、他のプロセスには pub/sub で知らせる
+        if not self.cache:
+            return
+        self.cache.invalidate(keys)
+        try:
+            client = await self._get_client()
+            await client.publish(INVALIDATION_CHANNEL, codec.json_dumps(keys))
+        except Exception as e:
+            logger.error(f"Redis cache invalidation publish error: {e}")
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.cache.get_stats() if self.cache else {"enabled": False}
     
     async def set_session(self, token: str, session_data: Dict[str, Any], ttl: int = None):
+        # セッションはハッシュ、ファイルIDは追加順のZSET（session_files:{token}）に分けて持つ
         try:
             client = await self._get_client()
             key = f"session:{token}"
-            value = json.dumps(session_data)
+            files_key = f"session_files:{token}"
+            fields = {k: v for k, v in session_data.items()
+                      if k not in ("files", "file_count") and v is not None}
+            files = session_data.get("files") or []
             
             if ttl is None:
                 ttl = Config.URL_EXPIRY_DAYS * 24 * 3600
             
-            await client.setex(key, ttl, value)
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.delete(key, files_key)
+                pipe.hset(key, mapping=fields)
+                pipe.expire(key, ttl)
+                if files:
+                    pipe.zadd(files_key, {file_id: i for i, file_id in enumerate(files, 1)})
+                    pipe.expire(files_key, ttl)
+                await pipe.execute()
+            await self._invalidate(key, files_key)
             return True
         except Exception as e:
             logger.error(f"Redis set_session error: {e}")
             return False
     
-    async def get_session(self, token: str) -> Optional[Dict[str, Any]]:
+    async def get_session(self, token: str, files: bool = True, cached: bool = True) -> Optional[Dict[str, Any]]:
+        # files=False ならファイルIDの一覧は読まず、件数（file_count）だけ返す
         try:
-            client = await self._get_client()
             key = f"session:{token}"
-            value = await client.get(key)
+            files_key = f"session_files:{token}"
+            cache_key = f"{key}:{'files' if files else 'count'}"
             
-            if value:
-                return json.loads(value)
-            return None
+            value = self._cache_get(cache_key) if cached else MISSING
+            if value is not MISSING:
+                session, members = value
+                return self._build_session(session, members, files)
+            
+            client = await self._get_client()
+            generation = self._cache_generation()
+            for _ in range(2):
+                try:
+                    async with client.pipeline(transaction=False) as pipe:
+                        pipe.hgetall(key)
+                        if files:
+                            pipe.zrange(files_key, 0, -1)
+                        else:
+                            pipe.zcard(files_key)
+                        session, members = await pipe.execute()
+                    break
+                except redis.ResponseError as e:
+                    if "WRONGTYPE" not in str(e):
+                        raise
+                    await self.migrate_session(token)
+            
+            if not session:
+                return None
+            self._cache_put(cache_key, (session, members), (key, files_key), generation)
+            return self._build_session(session, members, files)
         except Exception as e:
             logger.error(f"Redis get_session error: {e}")
             return None
     
+    @staticmethod
+    def _build_session(fields: Dict[str, str], members, files: bool) -> Dict[str, Any]:
+        session = dict(fields)
+        if files:
+            session["files"] = list(members)
+            session["file_count"] = len(members)
+        else:
+            session["file_count"] = members
+        return session
+    
+    async def add_session_file(self, token: str, file_id: str) -> bool:
+        # 同じセッションへの同時アップロードでも互いのファイルIDを上書きしない
+        try:
+            client = await self._get_client()
+            if self._add_session_file is None:
+                self._add_session_file = client.register_script(ADD_SESSION_FILE_SCRIPT)
+            
+            for _ in range(2):
+                added = await self._add_session_file(
+                    keys=[f"session:{token}", f"session_files:{token}"],
+                    args=[file_id, time.time()]
+                )
+                if added != -1:
+                    await self._invalidate(f"session:{token}", f"session_files:{token}")
+                    return added == 1
+                await self.migrate_session(token)
+            return False
+        except Exception as e:
+            logger.error(f"Redis add_session_file error: {e}")
+            return False
+    
+    async def migrate_session(self, token: str) -> bool:
+        client = await self._get_client()
+        if self._migrate_session is None:
+            self._migrate_session = client.register_script(MIGRATE_SESSION_SCRIPT)
+        
+        migrated = await self._migrate_session(keys=[f"session:{token}", f"session_files:{token}"])
+        if migrated:
+            await self._invalidate(f"session:{token}", f"session_files:{token}")
+        return bool(migrated)
+    
+    async def migrate_sessions(self) -> int:
+        # 起動時に旧形式のセッションをまとめて移行する（取りこぼしは読み込み時に個別に移行される）
+        try:
+            client = await self._get_client()
+            migrated = 0
+            async for key in client.scan_iter(match="session:*", count=500, _type="string"):
+                if await self.migrate_session(key.split(":", 1)[1]):
+                    migrated += 1
+            return migrated
+        except Exception as e:
+            logger.error(f"Redis migrate_sessions error: {e}")
+            return 0
+    
+    async def _session_id(self, token: str) -> Optional[str]:
+        # session_id はセッションの作成後に変わらないので、セッションの期限までキャッシュする
+        cache_key = f"session_id:{token}"
+        value = self._cache_get(cache_key)
+        if value is not MISSING:
+            return value
+        
+        client = await self._get_client()
+        generation = self._cache_generation()
+        for _ in range(2):
+            try:
+                session_id = await client.hget(f"session:{token}", "session_id")
+                break
+            except redis.ResponseError as e:
+                if "WRONGTYPE" not in str(e):
+                    raise
+                await self.migrate_session(token)
+        else:
+            return None
+        
+        self._cache_put(cache_key, session_id, (f"session:{token}",), generation)
+        return session_id
+    
+    async def get_file_context(self, token: str, file_id: str, scan_result: bool = False
+                               ) -> Optional[Tuple[Dict[str, Any], Optional[Dict[str, Any]], Optional[Dict[str, Any]], int]]:
+        # 戻り値: (セッション, ファイル情報, スキャン結果, セッションの残り秒数)。
+        # セッションが無いかファイルがセッションに含まれていなければ None
+        try:
+            cache_key = f"context:{token}:{file_id}:{int(scan_result)}"
+            value = self._cache_get(cache_key)
+            if value is not MISSING:
+                context, fetched_at = value
+            else:
+                client = await self._get_client()
+                if self._get_file_context is None:
+                    self._get_file_context = client.register_script(GET_FILE_CONTEXT_SCRIPT)
+                
+                generation = self._cache_generation()
+                session_id = await self._session_id(token)
+                if not session_id:
+                    return None
+                
+                # スクリプトが触るキーは全て KEYS で渡す（Redis Cluster でもキーの位置を判断できるように）
+                depends = (f"session:{token}", f"session_files:{token}",
+                           f"file:{session_id}:{file_id}", f"scan_result:{file_id}")
+                for _ in range(2):
+                    context = await self._get_file_context(
+                        keys=list(depends),
+                        args=[file_id, "1" if scan_result else "0", session_id]
+                    )
+                    if context != -1:
+                        break
+                    await self.migrate_session(token)
+                
+                if not context or context == -1:
+                    return None
+                fetched_at = time.monotonic()
+                # セッションの期限より長くは持たない
+                self._cache_put(cache_key, (context, fetched_at), depends, generation, ttl=context[2])
+            
+            fields, file_count, ttl, file_value, scan_value = context
+            ttl = int(ttl - (time.monotonic() - fetched_at))
+            session = dict(zip(fields[::2], fields[1::2]))
+            session["file_count"] = file_count
+            return (
+                session,
+                codec.loads(file_value),
+                codec.loads(scan_value),
+                max(ttl, 0)
+            )
+        except Exception as e:
+            logger.error(f"Redis get_file_context error: {e}")
+            return None
+    
+    async def get_session_ttl(self, token: str) -> int:
+        try:
+            client = await self._get_client()
+            ttl = await client.ttl(f"session:{token}")
+            return max(ttl, 0)
+        except Exception as e:
+            logger.error(f"Redis get_session_ttl error: {e}")
+            return 0
+    
+    async def set_crc32(self, file_hash: str, crc: int):
+        try:
+            client = await self._get_client()
+            await client.setex(f"crc32:{file_hash}", Config.URL_EXPIRY_DAYS * 24 * 3600, str(crc))
+            return True
+        except Exception as e:
+            logger.error(f"Redis set_crc32 error: {e}")
+            return False
+    
+    async def get_crc32s(self, file_hashes: List[str]) -> Dict[str, int]:
+        # ZIPバンドルの Range 配信用。SHA-256 ごとに一度計算したCRC-32を使い回す
+        if not file_hashes:
+            return {}
+        try:
+            client = await self._get_client()
+            values = await client.mget([f"crc32:{h}" for h in file_hashes])
+            return {h: int(v) for h, v in zip(file_hashes, values) if v is not None}
+        except Exception as e:
+            logger.error(f"Redis get_crc32s error: {e}")
+            return {}
+    
     async def set_file(self, session_id: str, file_id: str, file_info: Dict[str, Any]):
         try:
             client = await self._get_client()
+            if self._set_file is None:
+                self._set_file = client.register_script(SET_FILE_SCRIPT)
+            
             key = f"file:{session_id}:{file_id}"
-            value = json.dumps(file_info)
             ttl = Config.URL_EXPIRY_DAYS * 24 * 3600
+            # 共有しないオブジェクトはレコードと同時に期限切れとして削除対象に登録し、
+            # 共有オブジェクトへの参照はレコードと同時に期限切れになるよう揃える
+            member = f"{file_info['blob_hash']}:{session_id}:{file_id}" if file_info.get("blob_hash") else ""
+            await self._set_file(
+                keys=[key, "object_expiry", "blob_refs"],
+                args=[codec.dumps(file_info), ttl, time.time(), file_info.get("minio_path") or "", member]
+            )
+            await self._invalidate(key)
+            return True
+        except Exception as e:
+            logger.error(f"Redis set_file error: {e}")
+            return False
+    
+    async def get_file(self, session_id: str, file_id: str, cached: bool = True) -> Optional[Dict[str, Any]]:
+        try:
+            key = f"file:{session_id}:{file_id}"
+            value = self._cache_get(key) if cached else MISSING
+            if value is MISSING:
+                client = await self._get_client()
+                generation = self._cache_generation()
+                value = await client.get(key)
+                self._cache_put(key, value, (key,), generation)
+            
+            return codec.loads(value)
+        except Exception as e:
+            logger.error(f"Redis get_file error: {e}")
+            return None
+    
+    async def set_upload(self, upload_id: str, upload_data: Dict[str, Any], ttl: int = None):
+        try:
+            client = await self._get_client()
+            key = f"upload:{upload_id}"
+            value = codec.dumps(upload_data)
+            
+            if ttl is None:
+                ttl = Config.URL_EXPIRY_DAYS * 24 * 3600
             
             await client.setex(key, ttl, value)
             return True
         except Exception as e:
-            logger.error(f"Redis set_file error: {e}")
+            logger.error(f"Redis set_upload error: {e}")
             return False
     
-    async def get_file(self, session_id: str, file_id: str) -> Optional[Dict[str, Any]]:
+    async def get_upload(self, upload_id: str) -> Optional[Dict[str, Any]]:
         try:
             client = await self._get_client()
-            key = f"file:{session_id}:{file_id}"
+            key = f"upload:{upload_id}"
             value = await client.get(key)
             
-            if value:
-                return json.loads(value)
+            return codec.loads(value)
+        except Exception as e:
+            logger.error(f"Redis get_upload error: {e}")
             return None
+    
+    async def set_upload_part(self, upload_id: str, part_number: int, part_info: Dict[str, Any]):
+        try:
+            client = await self._get_client()
+            key = f"upload:{upload_id}:parts"
+            ttl = Config.URL_EXPIRY_DAYS * 24 * 3600
+            
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.hset(key, str(part_number), codec.dumps(part_info))
+                pipe.expire(key, ttl)
+                await pipe.execute()
+            return True
         except Exception as e:
-            logger.error(f"Redis get_file error: {e}")
+            logger.error(f"Redis set_upload_part error: {e}")
+            return False
+    
+    async def get_upload_parts(self, upload_id: str) -> Dict[int, Dict[str, Any]]:
+        try:
+            client = await self._get_client()
+            values = await client.hgetall(f"upload:{upload_id}:parts")
+            return {int(k): codec.loads(v) for k, v in values.items()}
+        except Exception as e:
+            logger.error(f"Redis get_upload_parts error: {e}")
+            return {}
+    
+    async def delete_upload(self, upload_id: str):
+        try:
+            client = await self._get_client()
+            await client.delete(f"upload:{upload_id}", f"upload:{upload_id}:parts")
+            return True
+        except Exception as e:
+            logger.error(f"Redis delete_upload error: {e}")
+            return False
+    
+    async def enqueue_scan_job(self, job_id: str, job: Dict[str, Any], delay: int = 0):
+        try:
+            client = await self._get_client()
+            ttl = Config.URL_EXPIRY_DAYS * 24 * 3600
+            
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.setex(f"scan_job:{job_id}", ttl, codec.dumps(job))
+                pipe.zadd("scan_queue", {job_id: time.time() + delay}, nx=True)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Redis enqueue_scan_job error: {e}")
+            return False
+    
+    async def claim_scan_job(self, lease: int) -> Optional[Tuple[Dict[str, Any], int]]:
+        client = await self._get_client()
+        if self._claim_scan_job is None:
+            self._claim_scan_job = client.register_script(CLAIM_SCAN_JOB_SCRIPT)
+        
+        claimed = await self._claim_scan_job(
+            keys=["scan_queue", "scan_queue:attempts"],
+            args=[time.time(), lease]
+        )
+        if not claimed:
+            return None
+        
+        job_id, attempts = claimed[0], int(claimed[1])
+        value = await client.get(f"scan_job:{job_id}")
+        if not value:
+            logger.warning(f"Scan job {job_id} has no payload, dropping")
+            await self.finish_scan_job(job_id)
             return None
+        
+        return codec.loads(value), attempts
     
-    async def set_rate_limit(self, user_id: str, count: int = 1):
+    async def retry_scan_job(self, job_id: str, delay: int):
         try:
             client = await self._get_client()
-            key = f"rate:{user_id}"
-            await client.setex(key, 3600, str(count))  # 1時間
+            await client.zadd("scan_queue", {job_id: time.time() + delay}, xx=True)
             return True
         except Exception as e:
-            logger.error(f"Redis rate_limit error: {e}")
+            logger.error(f"Redis retry_scan_job error: {e}")
             return False
     
-    async def get_rate_limit(self, user_id: str) -> int:
+    async def finish_scan_job(self, job_id: str):
         try:
             client = await self._get_client()
-            key = f"rate:{user_id}"
-            value = await client.get(key)
-            return int(value) if value else 0
+            
+            async with client.pipeline(transaction=True) as pipe:
+                pipe.zrem("scan_queue", job_id)
+                pipe.hdel("scan_queue:attempts", job_id)
+                pipe.delete(f"scan_job:{job_id}")
+                await pipe.execute()
+            return True
+        except Exception as e:
+            logger.error(f"Redis finish_scan_job error: {e}")
+            return False
+    
+    async def get_scan_queue_stats(self) -> Dict[str, int]:
+        try:
+            client = await self._get_client()
+            now = time.time()
+            
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.zcount("scan_queue", "-inf", now)
+                pipe.zcard("scan_queue")
+                ready, total = await pipe.execute()
+            
+            # リース中のジョブと再試行待ちのジョブはどちらも未来のscoreを持つ
+            return {"ready": ready, "leased_or_delayed": total - ready, "total": total}
+        except Exception as e:
+            logger.error(f"Redis get_scan_queue_stats error: {e}")
+            return {}
+    
+    async def acquire_blob(self, file_hash: str, session_id: str, file_id: str,
+                           object_name: str = None) -> Optional[str]:
+        client = await self._get_client()
+        if self._acquire_blob is None:
+            self._acquire_blob = client.register_script(ACQUIRE_BLOB_SCRIPT)
+        
+        # 参照の期限はレコード保存時に set_file で更新される
+        ttl = Config.URL_EXPIRY_DAYS * 24 * 3600
+        return await self._acquire_blob(
+            keys=[f"blob:{file_hash}", "blob_refs", "blob_paths"],
+            args=[f"{file_hash}:{session_id}:{file_id}", time.time() + ttl, object_name or ""]
+        )
+    
+    async def release_blob(self, file_hash: str, session_id: str, file_id: str) -> Optional[str]:
+        client = await self._get_client()
+        if self._release_blob is None:
+            self._release_blob = client.register_script(RELEASE_BLOB_SCRIPT)
+        
+        return await self._release_blob(
+            keys=[f"blob:{file_hash}", "blob_refs", "blob_paths"],
+            args=[f"{file_hash}:{session_id}:{file_id}"]
+        )
+    
+    async def expire_blob_refs(self, limit: int = 100) -> Tuple[int, List[str]]:
+        client = await self._get_client()
+        if self._expire_blob_refs is None:
+            self._expire_blob_refs = client.register_script(EXPIRE_BLOB_REFS_SCRIPT)
+        
+        expired, object_names = await self._expire_blob_refs(keys=["blob_refs", "blob_paths"], args=[time.time(), limit])
+        return expired, object_names
+    
+    async def claim_expired_objects(self, limit: int, lease: int) -> Tuple[int, List[str]]:
+        client = await self._get_client()
+        if self._claim_expired_objects is None:
+            self._claim_expired_objects = client.register_script(CLAIM_EXPIRED_OBJECTS_SCRIPT)
+        
+        lease_until, object_names = await self._claim_expired_objects(
+            keys=["object_expiry"], args=[time.time(), limit, lease]
+        )
+        return lease_until, object_names
+    
+    async def finish_expired_objects(self, object_names: List[str], lease_until: int) -> int:
+        if not object_names:
+            return 0
+        client = await self._get_client()
+        if self._finish_expired_objects is None:
+            self._finish_expired_objects = client.register_script(FINISH_EXPIRED_OBJECTS_SCRIPT)
+        
+        return await self._finish_expired_objects(keys=["object_expiry"], args=[lease_until, *object_names])
+    
+    async def get_object_expiries(self, object_names: List[str]) -> Dict[str, Optional[float]]:
+        client = await self._get_client()
+        scores = await client.zmscore("object_expiry", object_names) if object_names else []
+        return dict(zip(object_names, scores))
+    
+    async def get_blob_paths(self, object_names: List[str]) -> set:
+        client = await self._get_client()
+        members = await client.smismember("blob_paths", object_names) if object_names else []
+        return {name for name, member in zip(object_names, members) if member}
+    
+    async def get_object_expiry_stats(self) -> Dict[str, int]:
+        try:
+            client = await self._get_client()
+            async with client.pipeline(transaction=False) as pipe:
+                pipe.zcard("object_expiry")
+                pipe.zcount("object_expiry", "-inf", time.time())
+                total, due = await pipe.execute()
+            return {"tracked": total, "due": due}
+        except Exception as e:
+            logger.error(f"Redis get_object_expiry_stats error: {e}")
+            return {}
+    
+    async def set_verdict(self, file_hash: str, verdict: Dict[str, Any], ttl: int):
+        try:
+            client = await self._get_client()
+            await client.setex(f"verdict:{file_hash}", max(1, int(ttl)), codec.dumps(verdict))
+            return True
+        except Exception as e:
+            logger.error(f"Redis set_verdict error: {e}")
+            return False
+    
+    async def get_verdict(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        try:
+            client = await self._get_client()
+            value = await client.get(f"verdict:{file_hash}")
+            
+            return codec.loads(value)
+        except Exception as e:
+            logger.error(f"Redis get_verdict error: {e}")
+            return None
+    
+    async def delete_verdict(self, file_hash: str):
+        return await self.delete(f"verdict:{file_hash}")
+    
+    async def start_scan_flight(self, file_hash: str, owner: str, ttl: int) -> bool:
+        return await self.set_if_absent(f"scan_flight:{file_hash}", owner, ttl)
+    
+    async def get_scan_flight(self, file_hash: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        client = await self._get_client()
+        
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.exists(f"scan_flight:{file_hash}")
+            pipe.get(f"scan_flight:{file_hash}:result")
+            active, value = await pipe.execute()
+        
+        return bool(active), codec.loads(value)
+    
+    async def publish_scan_flight(self, file_hash: str, event: Dict[str, Any]):
+        try:
+            client = await self._get_client()
+            await client.publish(f"scan_flight:{file_hash}:events", codec.json_dumps(event))
+        except Exception as e:
+            logger.error(f"Redis publish_scan_flight error: {e}")
+    
+    async def subscribe_scan_flight(self, file_hash: str):
+        client = await self._get_client()
+        pubsub = client.pubsub()
+        await pubsub.subscribe(f"scan_flight:{file_hash}:events")
+        return pubsub
+    
+    async def finish_scan_flight(self, file_hash: str, owner: str,
+                                 result: Optional[Dict[str, Any]], ttl: int):
+        try:
+            client = await self._get_client()
+            if self._finish_scan_flight is None:
+                self._finish_scan_flight = client.register_script(FINISH_SCAN_FLIGHT_SCRIPT)
+            
+            await self._finish_scan_flight(
+                keys=[
+                    f"scan_flight:{file_hash}",
+                    f"scan_flight:{file_hash}:result",
+                    f"scan_flight:{file_hash}:events"
+                ],
+                # ロックの値は set_if_absent で保存した形（タグ付き）と比べる
+                args=[codec.dumps(owner), codec.dumps(result) if result else "", ttl]
+            )
+            return True
         except Exception as e:
-            logger.error(f"Redis get_rate_limit error: {e}")
+            logger.error(f"Redis finish_scan_flight error: {e}")
+            return False
+    
+    async def rate_limit(self, limits: List[Tuple[str, int, int, int]], dry_run: bool = False) -> float:
+        # limits: (キー, 期間あたりの上限, 期間秒, 消費量)。戻り値は待つべき秒数（0 なら許可して消費済み）。
+        # dry_run では消費せずに判定だけ行う
+        if not limits:
             return 0
+        client = await self._get_client()
+        if self._rate_limit is None:
+            self._rate_limit = client.register_script(RATE_LIMIT_SCRIPT)
+        
+        args = [int(time.time() * 1000), "1" if dry_run else "0"]
+        for _, limit, period, cost in limits:
+            args += [limit, period * 1000, cost]
+        wait = await self._rate_limit(keys=[f"rate:{key}" for key, _, _, _ in limits], args=args)
+        return int(wait) / 1000
     
     async def set(self, key: str, value: Any, expire: int = None):
         try:
             client = await self._get_client()
 
-            if isinstance(value, dict):
-                value = json.dumps(value)
-            
+            value = codec.dumps(value)
             if expire:
                 await client.setex(key, expire, value)
             else:
                 await client.set(key, value)
+            await self._invalidate(key)
             return True
         except Exception as e:
             logger.error(f"Redis set error: {e}")
             return False
     
-    async def get(self, key: str) -> Optional[Any]:
+    async def get(self, key: str, cached: bool = True) -> Optional[Any]:
 
         try:
-            client = await self._get_client()
-            value = await client.get(key)
+            value = self._cache_get(key) if cached else MISSING
+            if value is MISSING:
+                client = await self._get_client()
+                generation = self._cache_generation()
+                value = await client.get(key)
+                self._cache_put(key, value, (key,), generation)
             
-            if value:
-                try:
-                    return json.loads(value)
-                except json.JSONDecodeError:
-                    return value
-            return None
+            return codec.loads(value)
         except Exception as e:
             logger.error(f"Redis get error: {e}")
             return None
     
+    async def set_if_absent(self, key: str, value: Any, expire: int) -> bool:
+        try:
+            client = await self._get_client()
+
+            return bool(await client.set(key, codec.dumps(value), ex=expire, nx=True))
+        except Exception as e:
+            logger.error(f"Redis set_if_absent error: {e}")
+            return False
+    
+    async def delete(self, *keys: str):
+        try:
+            client = await self._get_client()
+            await client.delete(*keys)
+            await self._invalidate(*keys)
+            return True
+        except Exception as e:
+            logger.error(f"Redis delete error: {e}")
+            return False
+    
     async def ping(self) -> bool:
         try:
             client = await self._get_client()
@@ -132,5 +921,4 @@ class RedisDB:
             return False
     
     async def close(self):
-        if self.redis:
-            await self.redis.close()
\ No newline at end of file
+        await close_pool()
\ No newline at end of file
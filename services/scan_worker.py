@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from typing import Dict, Any, List
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class ScanWorkerPool:
+    def __init__(self, redis_db, scan_service, concurrency: int = None):
+        self.redis_db = redis_db
+        self.scan_service = scan_service
+        self.concurrency = Config.SCAN_WORKERS if concurrency is None else concurrency
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self):
+        for n in range(self.concurrency):
+            self.tasks.append(asyncio.create_task(self._run(n)))
+        logger.info(f"Started {self.concurrency} scan worker(s)")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        logger.info("Scan workers stopped")
+
+    async def _run(self, n: int):
+        while True:
+            try:
+                claimed = await self.redis_db.claim_scan_job(Config.SCAN_JOB_TIMEOUT)
+                if not claimed:
+                    await asyncio.sleep(Config.SCAN_QUEUE_POLL_INTERVAL)
+                    continue
+
+                job, attempts = claimed
+                logger.info(f"Scan worker {n} picked up {job['job_id']} (attempt {attempts})")
+                await self._process(job, attempts)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Scan worker {n} error: {e}")
+                await asyncio.sleep(Config.SCAN_QUEUE_POLL_INTERVAL)
+
+    async def _process(self, job: Dict[str, Any], attempts: int):
+        job_id = job["job_id"]
+
+        try:
+            scan_result = await self.scan_service.scan_object(
+                job["minio_path"],
+                job["file_info"],
+                job["session_info"]
+            )
+        except Exception as e:
+            logger.error(f"Scan job {job_id} failed: {e}")
+            scan_result = self.scan_service.error_result(job["file_info"], str(e))
+
+        if scan_result['overall_status'] == 'error' and attempts < Config.SCAN_MAX_ATTEMPTS:
+            delay = Config.SCAN_RETRY_DELAY * 2 ** (attempts - 1)
+            logger.warning(f"Scan job {job_id} will be retried in {delay}s: {scan_result.get('rejection_reason')}")
+            await self.redis_db.retry_scan_job(job_id, delay)
+            return
+
+        await self.scan_service.apply_scan_result(
+            job["session_id"],
+            job["file_id"],
+            job["minio_path"],
+            scan_result
+        )
+        await self.redis_db.finish_scan_job(job_id)
+        logger.info(f"Scan job {job_id} finished: {scan_result['overall_status']}")
+
+async def run_scan_workers():
+    from services.redis_db import RedisDB
+    from services.storage import MinIOService
+    from services.integrated_scan import IntegratedScanService
+    from services.blob_store import BlobStoreService
+
+    redis_db = RedisDB()
+    scan_service = IntegratedScanService()
+    scan_service.redis_db = redis_db
+    scan_service.minio = MinIOService()
+    scan_service.virustotal.redis_db = redis_db
+    scan_service.virustotal.minio = scan_service.minio
+    scan_service.blobs = BlobStoreService(redis_db, scan_service.minio)
+    if Config.PREVIEW_ENABLED:
+        from services import preview
+        if preview.available():
+            scan_service.previews = preview.PreviewService(scan_service.minio)
+    if Config.FASTSTART_ENABLED:
+        from services.faststart import FaststartService
+        scan_service.faststart = FaststartService(redis_db, scan_service.minio)
+
+    pool = ScanWorkerPool(redis_db, scan_service, max(1, Config.SCAN_WORKERS))
+    pool.start()
+    try:
+        await asyncio.gather(*pool.tasks)
+    finally:
+        await pool.stop()
+        if scan_service.previews:
+            await scan_service.previews.close()
+        if scan_service.faststart:
+            await scan_service.faststart.close()
+        await redis_db.close()
@@ -1,12 +1,111 @@
 from minio import Minio
 from minio.error import S3Error
+from minio.datatypes import Part
+from minio.deleteobjects import DeleteObject
+import asyncio
+import hashlib
 import io
+import itertools
 import logging
-from typing import Optional
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any
+from datetime import timedelta
 from config import Config
+from services.compression import Compressor, decode_stream, encoding_of
 
 logger = logging.getLogger(__name__)
 
+# minio SDKは同期APIのため、専用のスレッドプールで実行してイベントループを塞がない
+_io_executor = ThreadPoolExecutor(
+    max_workers=Config.MINIO_IO_THREADS,
+    thread_name_prefix="minio-io"
+)
+
+class MultipartUpload:
+    def __init__(self, storage: "MinIOService", object_name: str, upload_id: str,
+                 part_size: int, concurrency: int = 1, encoding: str = None):
+        self.storage = storage
+        self.object_name = object_name
+        self.upload_id = upload_id
+        self.part_size = part_size
+        self.concurrency = max(1, concurrency)
+        self.parts: List[Part] = []
+        # size と sha256 は圧縮前の内容、stored_size は MinIO に保存されるバイト数
+        self.size = 0
+        self.stored_size = 0
+        self.sha256 = hashlib.sha256()
+        self._compressor = Compressor(encoding) if encoding else None
+        self._buffer = bytearray()
+        self._pending = set()
+
+    async def _wait(self, return_when=asyncio.ALL_COMPLETED):
+        done, self._pending = await asyncio.wait(self._pending, return_when=return_when)
+        for future in done:
+            future.result()
+
+    async def _flush(self, data: bytes):
+        # 同時送信数の上限に達したら空きを待つ（メモリ使用量はパート concurrency+1 個分まで）
+        while len(self._pending) >= self.concurrency:
+            await self._wait(asyncio.FIRST_COMPLETED)
+
+        part_number = len(self.parts) + 1
+        self.parts.append(None)
+
+        async def _upload():
+            etag = await self.storage.upload_part(self.object_name, self.upload_id, part_number, data)
+            self.parts[part_number - 1] = Part(part_number, etag)
+
+        self._pending.add(asyncio.ensure_future(_upload()))
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        self.sha256.update(data)
+        if self._compressor:
+            data = await asyncio.get_event_loop().run_in_executor(None, self._compressor.compress, data)
+        self._buffer.extend(data)
+        self.stored_size += len(data)
+
+        await self._flush_full_parts()
+
+    async def _flush_full_parts(self):
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            await self._flush(part)
+
+    async def complete(self) -> bool:
+        try:
+            if self._compressor:
+                tail = self._compressor.flush()
+                self._compressor = None
+                self._buffer.extend(tail)
+                self.stored_size += len(tail)
+                await self._flush_full_parts()
+
+            if self._buffer or not self.parts:
+                await self._flush(bytes(self._buffer))
+                self._buffer = bytearray()
+
+            if self._pending:
+                await self._wait()
+
+            await self.storage.complete_multipart_upload(self.object_name, self.upload_id, self.parts)
+            logger.info(f"Uploaded to MinIO: {self.object_name} ({self.size} bytes, {self.stored_size} stored, {len(self.parts)} parts)")
+            return True
+        except Exception as e:
+            logger.error(f"MinIO multipart complete error: {e}")
+            await self.abort()
+            return False
+
+    async def abort(self):
+        self._buffer = bytearray()
+        if self._pending:
+            await asyncio.wait(self._pending)
+            self._pending = set()
+
+        await self.storage.abort_multipart_upload(self.object_name, self.upload_id)
+
 class MinIOService:
     def __init__(self):
         self.client = Minio(
@@ -16,6 +115,14 @@ class MinIOService:
             secure=False
         )
         self.bucket = Config.MINIO_BUCKET
+        # 署名にはホスト名が含まれるため、ブラウザ向けURLは公開エンドポイントで署名する
+        self.presign_client = Minio(
+            Config.MINIO_PUBLIC_ENDPOINT or Config.MINIO_ENDPOINT,
+            access_key=Config.MINIO_ACCESS_KEY,
+            secret_key=Config.MINIO_SECRET_KEY,
+            secure=Config.MINIO_PUBLIC_USE_SSL,
+            region=Config.MINIO_REGION
+        )
         self._ensure_bucket()
     
     def _ensure_bucket(self):
@@ -26,57 +133,250 @@ class MinIOService:
         except S3Error as e:
             logger.error(f"MinIO bucket error: {e}")
     
-    async def upload_file(self, file, object_name: str) -> bool:
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(_io_executor, func, *args)
+    
+    async def create_multipart_upload(self, object_name: str, content_type: str = None) -> str:
+        headers = {"Content-Type": content_type or "application/octet-stream"}
+        return await self._run(self.client._create_multipart_upload, self.bucket, object_name, headers)
+    
+    async def upload_part(self, object_name: str, upload_id: str, part_number: int, data: bytes) -> str:
+        return await self._run(
+            self.client._upload_part,
+            self.bucket, object_name, data, None, upload_id, part_number
+        )
+    
+    async def complete_multipart_upload(self, object_name: str, upload_id: str, parts: List[Part]):
+        await self._run(
+            self.client._complete_multipart_upload,
+            self.bucket, object_name, upload_id, parts
+        )
+    
+    async def abort_multipart_upload(self, object_name: str, upload_id: str) -> bool:
         try:
-            contents = await file.read()
-            file_size = len(contents)
-            data = io.BytesIO(contents)
-            
-            self.client.put_object(
-                self.bucket,
-                object_name,
-                data,
-                file_size,
-                content_type=file.content_type
+            await self._run(
+                self.client._abort_multipart_upload,
+                self.bucket, object_name, upload_id
             )
-            
-            logger.info(f"Uploaded to MinIO: {object_name}")
+            logger.info(f"Aborted multipart upload: {object_name}")
             return True
+        except Exception as e:
+            logger.error(f"MinIO multipart abort error: {e}")
+            return False
+    
+    async def list_parts(self, object_name: str, upload_id: str) -> Dict[int, Dict[str, Any]]:
+        parts = {}
+        marker = None
+        while True:
+            result = await self._run(
+                self.client._list_parts,
+                self.bucket, object_name, upload_id, None, marker
+            )
+            for part in result.parts:
+                parts[part.part_number] = {"etag": part.etag, "size": part.size}
+            if not result.is_truncated:
+                return parts
+            marker = result.next_part_number_marker
+    
+    def presigned_upload_part_url(self, object_name: str, upload_id: str, part_number: int) -> str:
+        return self.presign_client.get_presigned_url(
+            "PUT",
+            self.bucket,
+            object_name,
+            expires=timedelta(seconds=Config.PRESIGNED_URL_EXPIRY),
+            extra_query_params={"uploadId": upload_id, "partNumber": str(part_number)}
+        )
+    
+    def presigned_download_url(self, object_name: str, content_disposition: str, content_type: str,
+                               content_encoding: str = None) -> str:
+        response_headers = {
+            "response-content-disposition": content_disposition,
+            "response-content-type": content_type
+        }
+        if content_encoding:
+            response_headers["response-content-encoding"] = content_encoding
+        return self.presign_client.get_presigned_url(
+            "GET",
+            self.bucket,
+            object_name,
+            expires=timedelta(seconds=Config.DOWNLOAD_URL_EXPIRY),
+            response_headers=response_headers
+        )
+    
+    async def start_multipart_upload(self, object_name: str, content_type: str = None,
+                                     encoding: str = None) -> MultipartUpload:
+        upload_id = await self.create_multipart_upload(object_name, content_type)
+        return MultipartUpload(
+            self, object_name, upload_id,
+            Config.MINIO_PART_SIZE, Config.MINIO_PART_CONCURRENCY, encoding
+        )
+    
+    async def upload_file(self, file, object_name: str) -> bool:
+        upload = await self.start_multipart_upload(object_name, file.content_type)
+        try:
+            while True:
+                chunk = await file.read(Config.UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await upload.write(chunk)
+            return await upload.complete()
             
         except Exception as e:
             logger.error(f"MinIO upload error: {e}")
+            await upload.abort()
             return False
     
-    async def get_file_stream(self, object_name: str):
+    async def get_file_stream(self, object_name: str, offset: int = 0, length: int = 0):
         try:
-            response = self.client.get_object(self.bucket, object_name)
-
-            async def stream_generator():
-                try:
-                    for data in response.stream(32*1024):
-                        yield data
-                finally:
-                    response.close()
-                    response.release_conn()
-            
-            return stream_generator()
-            
+            # length=0 は offset から末尾まで
+            response = await self._run(self.client.get_object, self.bucket, object_name, offset, length)
         except S3Error as e:
             logger.error(f"MinIO get error: {e}")
             return None
+
+        # 読み出しはスレッドプール側で先行させ、最大 DOWNLOAD_READ_AHEAD チャンクまでキューに溜める
+        queue = asyncio.Queue(maxsize=Config.DOWNLOAD_READ_AHEAD)
+        chunks = response.stream(Config.DOWNLOAD_CHUNK_SIZE)
+        loop = asyncio.get_event_loop()
+
+        async def reader():
+            read = None
+            try:
+                while True:
+                    read = loop.run_in_executor(_io_executor, next, chunks, None)
+                    data = await asyncio.shield(read)
+                    if data is None:
+                        break
+                    await queue.put(data)
+                await queue.put(None)
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"MinIO read error: {object_name} - {e}")
+                await queue.put(e)
+            finally:
+                # 読み込み中のスレッドが終わってから接続を閉じる
+                if read is not None and not read.done():
+                    await asyncio.wait([read])
+                await self._run(response.close)
+                await self._run(response.release_conn)
+
+        async def stream_generator():
+            task = asyncio.ensure_future(reader())
+            try:
+                while True:
+                    data = await queue.get()
+                    if data is None:
+                        break
+                    if isinstance(data, Exception):
+                        raise data
+                    yield data
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        
+        return stream_generator()
+    
+    async def get_decoded_stream(self, object_name: str):
+        # 圧縮して保存したオブジェクトは元の内容に戻して返す（スキャンなど内容を読む処理用）
+        file_stream = await self.get_file_stream(object_name)
+        encoding = encoding_of(object_name)
+        if file_stream is None or not encoding:
+            return file_stream
+        return decode_stream(file_stream, encoding)
+    
+    async def download_to_tempfile(self, object_name: str):
+        spool = tempfile.SpooledTemporaryFile(max_size=Config.UPLOAD_CHUNK_SIZE)
+        file_stream = await self.get_decoded_stream(object_name)
+        if file_stream is None:
+            spool.close()
+            return None
+
+        async for chunk in file_stream:
+            await self._run(spool.write, chunk)
+        await self._run(spool.seek, 0)
+        return spool
     
-    def delete_file(self, object_name: str) -> bool:
+    async def put_bytes(self, object_name: str, data: bytes, content_type: str) -> bool:
         try:
-            self.client.remove_object(self.bucket, object_name)
+            await self._run(
+                lambda: self.client.put_object(self.bucket, object_name, io.BytesIO(data), len(data),
+                                               content_type=content_type)
+            )
+            return True
+        except Exception as e:
+            logger.error(f"MinIO put error: {e}")
+            return False
+    
+    async def get_bytes(self, object_name: str, offset: int = 0, length: int = 0) -> Optional[bytes]:
+        # プレビューやボックスヘッダーなど小さい読み出し用。存在しない場合はエラーにせず None を返す
+        def _read():
+            response = self.client.get_object(self.bucket, object_name, offset, length)
+            try:
+                return response.read()
+            finally:
+                response.close()
+                response.release_conn()
+        
+        try:
+            return await self._run(_read)
+        except S3Error as e:
+            if e.code != "NoSuchKey":
+                logger.error(f"MinIO get error: {e}")
+            return None
+    
+    async def delete_file(self, object_name: str) -> bool:
+        try:
+            await self._run(self.client.remove_object, self.bucket, object_name)
             logger.info(f"Deleted from MinIO: {object_name}")
             return True
         except S3Error as e:
             logger.error(f"MinIO delete error: {e}")
             return False
     
-    def get_file_info(self, object_name: str):
+    async def delete_files(self, object_names: List[str]) -> List[str]:
+        # S3のマルチオブジェクト削除（1リクエスト最大1000件）でまとめて消し、失敗したものを返す。存在しないものは成功扱い
+        failed = []
+        for start in range(0, len(object_names), 1000):
+            batch = object_names[start:start + 1000]
+            try:
+                # remove_objects は結果を読み進めたときに送信されるので、スレッド内で最後まで読む
+                errors = await self._run(
+                    lambda: list(self.client.remove_objects(self.bucket, [DeleteObject(name) for name in batch]))
+                )
+            except Exception as e:
+                logger.error(f"MinIO bulk delete error: {e}")
+                failed.extend(batch)
+                continue
+            for error in errors:
+                logger.error(f"MinIO delete error: {error.name} - {error.code} {error.message}")
+                failed.append(error.name)
+        return failed
+    
+    async def list_prefixes(self, prefix: str) -> List[str]:
+        try:
+            objects = await self._run(lambda: list(self.client.list_objects(self.bucket, prefix=prefix)))
+            return [obj.object_name for obj in objects if obj.is_dir]
+        except Exception as e:
+            logger.error(f"MinIO list error: {e}")
+            return []
+    
+    async def list_object_names(self, prefix: str, start_after: str = None, limit: int = 1000) -> List[str]:
+        # 大きなプレフィックスも一度に全件読まず、start_after で続きから読む
+        try:
+            return await self._run(lambda: [
+                obj.object_name for obj in itertools.islice(
+                    self.client.list_objects(self.bucket, prefix=prefix, recursive=True, start_after=start_after),
+                    limit
+                )
+            ])
+        except Exception as e:
+            logger.error(f"MinIO list error: {e}")
+            return []
+    
+    async def get_file_info(self, object_name: str):
         try:
-            stat = self.client.stat_object(self.bucket, object_name)
+            stat = await self._run(self.client.stat_object, self.bucket, object_name)
             return {
                 "size": stat.size,
                 "etag": stat.etag,
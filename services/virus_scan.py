@@ -67,7 +67,7 @@ class VirusScan:
                         logger.info(f"Scan still pending for {file_id}")
             
             if session_id and redis_db:
-                file_info = await redis_db.get_file(session_id, file_id)
+                file_info = await redis_db.get_file(session_id, file_id, cached=False)
                 if file_info:
                     file_info["virus_scan"] = scan_result
                     file_info["virus_scan_hash"] = file_hash
@@ -86,7 +86,7 @@ class VirusScan:
             return None
         
         try:
-            file_stream = await minio.get_file_stream(file_path)
+            file_stream = await minio.get_decoded_stream(file_path)
             if file_stream:
                 chunks = []
                 async for chunk in file_stream:
@@ -129,8 +129,10 @@ class VirusScan:
             logger.error(f"VirusTotal API error: {e}")
             return "error"
     
-    async def submit_file_for_scan(self, file_content: bytes) -> Optional[str]:
-        if not self.api_key or len(file_content) > 32 * 1024 * 1024:
+    async def submit_file_for_scan(self, file_content) -> Optional[str]:
+        if not self.api_key:
+            return None
+        if isinstance(file_content, (bytes, bytearray)) and len(file_content) > 32 * 1024 * 1024:
             return None
         
         headers = {"x-apikey": self.api_key}
@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import struct
+import zlib
+from datetime import datetime
+from pathlib import PurePosixPath
+from typing import Dict, List, Optional
+
+from services.compression import encoding_of
+
+logger = logging.getLogger(__name__)
+
+ZIP64_LIMIT = 0xFFFFFFFF
+# ビット3: データディスクリプタあり, ビット11: ファイル名がUTF-8
+FLAGS = 0x0808
+
+class ZipEntry:
+    def __init__(self, name: str, object_name: str, size: int, modified: datetime,
+                 file_hash: Optional[str] = None, crc: Optional[int] = None):
+        self.name = name
+        self.encoded_name = name.encode("utf-8")
+        self.object_name = object_name
+        self.size = size
+        self.file_hash = file_hash
+        self.crc = crc
+        self.dos_time, self.dos_date = self._dos_datetime(modified)
+        self.offset = 0
+        self.zip64 = False
+
+    @staticmethod
+    def _dos_datetime(value: datetime):
+        if value.year < 1980:
+            value = datetime(1980, 1, 1)
+        dos_time = (value.hour << 11) | (value.minute << 5) | (value.second // 2)
+        dos_date = ((value.year - 1980) << 9) | (value.month << 5) | value.day
+        return dos_time, dos_date
+
+    @property
+    def version(self) -> int:
+        return 45 if self.zip64 else 20
+
+    def local_header(self) -> bytes:
+        # 全エントリ STORE かつサイズ既知なのでサイズはヘッダーに書き、CRCだけディスクリプタで後から送る
+        extra = b""
+        size = self.size
+        if self.zip64:
+            extra = struct.pack("<HHQQ", 0x0001, 16, self.size, self.size)
+            size = ZIP64_LIMIT
+        return struct.pack(
+            "<IHHHHHIIIHH", 0x04034B50, self.version, FLAGS, 0,
+            self.dos_time, self.dos_date, 0, size, size,
+            len(self.encoded_name), len(extra)
+        ) + self.encoded_name + extra
+
+    def descriptor(self) -> bytes:
+        if self.zip64:
+            return struct.pack("<IIQQ", 0x08074B50, self.crc, self.size, self.size)
+        return struct.pack("<IIII", 0x08074B50, self.crc, self.size, self.size)
+
+    def descriptor_length(self) -> int:
+        return 24 if self.zip64 else 16
+
+    def central_header(self) -> bytes:
+        extra = b""
+        size, offset = self.size, self.offset
+        if self.zip64:
+            extra = struct.pack("<HHQQQ", 0x0001, 24, self.size, self.size, self.offset)
+            size, offset = ZIP64_LIMIT, ZIP64_LIMIT
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII", 0x02014B50, self.version, self.version, FLAGS, 0,
+            self.dos_time, self.dos_date, self.crc, size, size,
+            len(self.encoded_name), len(extra), 0, 0, 0, 0, offset
+        ) + self.encoded_name + extra
+
+class ZipBundle:
+    # MinIOのオブジェクトを一時ファイルなしでZIPとして流す。
+    # 全エントリを STORE にするのでレイアウトは事前に決まり、Content-Length と Range が使える
+    def __init__(self, minio, entries: List[ZipEntry]):
+        self.minio = minio
+        self.entries = entries
+        self.segments = []
+        offset = 0
+        for entry in entries:
+            entry.zip64 = entry.size >= ZIP64_LIMIT or offset >= ZIP64_LIMIT
+            entry.offset = offset
+            offset = self._add(offset, "local", entry, len(entry.local_header()))
+            offset = self._add(offset, "data", entry, entry.size)
+            offset = self._add(offset, "descriptor", entry, entry.descriptor_length())
+
+        self.central_offset = offset
+        self.central_size = sum(46 + len(e.encoded_name) + (28 if e.zip64 else 0) for e in entries)
+        self.zip64 = (any(e.zip64 for e in entries) or len(entries) >= 0xFFFF
+                      or offset >= ZIP64_LIMIT or self.central_size >= ZIP64_LIMIT)
+        end_length = 22 + (56 + 20 if self.zip64 else 0)
+        self.content_length = self._add(offset, "central", None, self.central_size + end_length)
+
+    def _add(self, offset: int, kind: str, entry: Optional[ZipEntry], length: int) -> int:
+        self.segments.append((offset, length, kind, entry))
+        return offset + length
+
+    @property
+    def etag(self) -> str:
+        digest = hashlib.sha256()
+        for entry in self.entries:
+            digest.update(f"{entry.name}\0{entry.object_name}\0{entry.size}\0{entry.file_hash}\n".encode("utf-8"))
+        return f'"{digest.hexdigest()}"'
+
+    def crcs_known(self) -> bool:
+        return all(entry.crc is not None for entry in self.entries)
+
+    def _central_directory(self) -> bytes:
+        records = b"".join(entry.central_header() for entry in self.entries)
+        count, size, offset = len(self.entries), len(records), self.central_offset
+        end = b""
+        if self.zip64:
+            zip64_end = self.central_offset + size
+            end += struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count, count, size, offset)
+            end += struct.pack("<IIQI", 0x07064B50, 0, zip64_end, 1)
+            count, size, offset = 0xFFFF, ZIP64_LIMIT, ZIP64_LIMIT
+        end += struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, size, offset, 0)
+        return records + end
+
+    def _render(self, kind: str, entry: Optional[ZipEntry]) -> bytes:
+        if kind == "local":
+            return entry.local_header()
+        if kind == "descriptor":
+            return entry.descriptor()
+        return self._central_directory()
+
+    async def _read_entry(self, entry: ZipEntry, on_crc=None):
+        stream = await self.minio.get_decoded_stream(entry.object_name)
+        if stream is None:
+            raise IOError(f"Object not readable: {entry.object_name}")
+
+        crc = 0
+        received = 0
+        async for chunk in stream:
+            received += len(chunk)
+            if received > entry.size:
+                raise IOError(f"Object larger than recorded: {entry.object_name}")
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+
+        if received != entry.size:
+            raise IOError(f"Size mismatch for {entry.object_name}: {received} != {entry.size}")
+        if entry.crc is not None and entry.crc != crc:
+            logger.error(f"CRC mismatch for {entry.object_name}: {entry.crc:08x} != {crc:08x}")
+        if entry.crc is None and on_crc:
+            await on_crc(entry, crc)
+        entry.crc = crc
+
+    async def stream(self, on_crc=None):
+        for _, _, kind, entry in self.segments:
+            if kind == "data":
+                async for chunk in self._read_entry(entry, on_crc):
+                    yield chunk
+            else:
+                yield self._render(kind, entry)
+
+    async def open_range(self, start: int, length: int):
+        # Range は全エントリのCRCが分かっている場合のみ（ディスクリプタと中央ディレクトリに必要）
+        return self._range(start, start + length)
+
+    async def _range(self, start: int, end: int):
+        for offset, length, kind, entry in self.segments:
+            if offset + length <= start or offset >= end or length == 0:
+                continue
+            lo = max(start, offset) - offset
+            hi = min(end, offset + length) - offset
+            if kind != "data":
+                yield self._render(kind, entry)[lo:hi]
+                continue
+
+            async for chunk in self._entry_range(entry, lo, hi):
+                yield chunk
+
+    async def _entry_range(self, entry: ZipEntry, lo: int, hi: int):
+        if not encoding_of(entry.object_name):
+            stream = await self.minio.get_file_stream(entry.object_name, lo, hi - lo)
+            if stream is None:
+                raise IOError(f"Object not readable: {entry.object_name}")
+            async for chunk in stream:
+                yield chunk
+            return
+
+        # 圧縮して保存したオブジェクトは先頭から展開して必要な範囲だけ返す
+        stream = await self.minio.get_decoded_stream(entry.object_name)
+        if stream is None:
+            raise IOError(f"Object not readable: {entry.object_name}")
+        pos = 0
+        try:
+            async for chunk in stream:
+                begin, end = max(lo - pos, 0), min(hi - pos, len(chunk))
+                if begin < end:
+                    yield chunk[begin:end]
+                pos += len(chunk)
+                if pos >= hi:
+                    break
+        finally:
+            await stream.aclose()
+
+def entry_name(filename: str, used: Dict[str, int]) -> str:
+    name = filename.replace("/", "_").replace("\\", "_").strip() or "file"
+    key = name.lower()
+    if key not in used:
+        used[key] = 1
+        return name
+
+    # 同名のファイルは "name (2).ext" のように番号を付ける
+    path = PurePosixPath(name)
+    while True:
+        used[key] += 1
+        candidate = f"{path.stem} ({used[key]}){path.suffix}"
+        if candidate.lower() not in used:
+            used[candidate.lower()] = 1
+            return candidate
@@ -129,6 +129,248 @@ document.addEventListener('DOMContentLoaded', function() {
         return (bytes / 1073741824).toFixed(2) + ' GB';
     }
 
+    const MAX_CHUNK_RETRIES = 10;
+
+    function resumeKey(file) {
+        return `discshare-upload:${token}:${file.name}:${file.size}:${file.lastModified}`;
+    }
+
+    function sleep(ms) {
+        return new Promise(resolve => setTimeout(resolve, ms));
+    }
+
+    async function errorDetail(response, fallback) {
+        try {
+            const error = await response.json();
+            return error.detail || fallback;
+        } catch {
+            return fallback;
+        }
+    }
+
+    async function fetchUploadState(uploadId) {
+        const response = await fetch(`/api/upload/${token}/${uploadId}`, { method: 'HEAD' });
+        if (!response.ok) {
+            return null;
+        }
+        return {
+            offset: parseInt(response.headers.get('Upload-Offset'), 10),
+            chunkSize: parseInt(response.headers.get('Upload-Chunk-Size'), 10),
+            mode: response.headers.get('Upload-Mode'),
+            status: response.headers.get('Upload-Status')
+        };
+    }
+
+    async function initUpload(file) {
+        const response = await fetch(`/api/upload/${token}/init`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                filename: file.name,
+                size: file.size,
+                content_type: file.type || 'application/octet-stream'
+            })
+        });
+        if (!response.ok) {
+            throw new Error(await errorDetail(response, 'アップロードに失敗しました'));
+        }
+        return response.json();
+    }
+
+    function sendChunk(uploadId, file, offset, chunkSize) {
+        return new Promise((resolve, reject) => {
+            const chunk = file.slice(offset, Math.min(offset + chunkSize, file.size));
+            const xhr = new XMLHttpRequest();
+
+            xhr.upload.addEventListener('progress', (e) => {
+                if (e.lengthComputable) {
+                    const percentComplete = ((offset + e.loaded) / file.size) * 100;
+                    updateProgress(percentComplete * 0.05, 'アップロード中...');
+                }
+            });
+
+            xhr.addEventListener('load', function() {
+                const serverOffset = parseInt(xhr.getResponseHeader('Upload-Offset'), 10);
+                if (xhr.status === 204 || (xhr.status === 409 && !isNaN(serverOffset))) {
+                    resolve(serverOffset);
+                } else if (!isNaN(serverOffset)) {
+                    reject({ fatal: false });
+                } else if (xhr.status >= 400 && xhr.status < 500 && xhr.status !== 408) {
+                    let detail = 'アップロードに失敗しました';
+                    try {
+                        detail = JSON.parse(xhr.responseText).detail || detail;
+                    } catch {}
+                    reject({ fatal: true, message: detail });
+                } else {
+                    reject({ fatal: false });
+                }
+            });
+
+            xhr.addEventListener('error', () => reject({ fatal: false }));
+            xhr.addEventListener('timeout', () => reject({ fatal: false }));
+
+            xhr.open('PATCH', `/api/upload/${token}/${uploadId}`);
+            xhr.setRequestHeader('Upload-Offset', String(offset));
+            xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+            xhr.send(chunk);
+        });
+    }
+
+    async function sendChunkDirect(uploadId, file, offset, chunkSize) {
+        const partNumber = Math.floor(offset / chunkSize) + 1;
+        const response = await fetch(`/api/upload/${token}/${uploadId}/part/${partNumber}`).catch(() => null);
+        if (!response) {
+            throw { fatal: false };
+        }
+        if (!response.ok) {
+            throw { fatal: response.status < 500, message: await errorDetail(response, 'アップロードに失敗しました') };
+        }
+        const part = await response.json();
+
+        return new Promise((resolve, reject) => {
+            const chunk = file.slice(part.offset, part.offset + part.length);
+            const xhr = new XMLHttpRequest();
+
+            xhr.upload.addEventListener('progress', (e) => {
+                if (e.lengthComputable) {
+                    const percentComplete = ((part.offset + e.loaded) / file.size) * 100;
+                    updateProgress(percentComplete * 0.05, 'アップロード中...');
+                }
+            });
+
+            // 署名期限切れなどストレージ側のエラーは、URLを取り直して再試行する
+            xhr.addEventListener('load', function() {
+                if (xhr.status >= 200 && xhr.status < 300) {
+                    resolve(part.offset + part.length);
+                } else {
+                    reject({ fatal: false });
+                }
+            });
+
+            xhr.addEventListener('error', () => reject({ fatal: false }));
+            xhr.addEventListener('timeout', () => reject({ fatal: false }));
+
+            xhr.open('PUT', part.url);
+            xhr.send(chunk);
+        });
+    }
+
+    async function finalizeUpload(uploadId) {
+        while (true) {
+            let response;
+            try {
+                response = await fetch(`/api/upload/${token}/${uploadId}/finalize`, { method: 'POST' });
+            } catch {
+                await sleep(3000);
+                continue;
+            }
+
+            if (response.status === 202) {
+                await sleep(3000);
+                continue;
+            }
+            if (!response.ok) {
+                throw new Error(await errorDetail(response, 'アップロードに失敗しました'));
+            }
+            return response.json();
+        }
+    }
+
+    // 1チャンクに収まるファイルは1回のリクエストで送り、転送しながらスキャン・保存する
+    function streamingUpload(file) {
+        return new Promise((resolve, reject) => {
+            const formData = new FormData();
+            formData.append('file', file);
+
+            const xhr = new XMLHttpRequest();
+
+            xhr.upload.addEventListener('progress', (e) => {
+                if (e.lengthComputable) {
+                    const percentComplete = (e.loaded / e.total) * 100;
+                    updateProgress(percentComplete * 0.05, 'アップロード中...');
+                }
+            });
+
+            xhr.addEventListener('load', function() {
+                if (xhr.status === 200) {
+                    resolve(JSON.parse(xhr.responseText));
+                    return;
+                }
+                let detail = 'アップロードに失敗しました';
+                try {
+                    detail = JSON.parse(xhr.responseText).detail || detail;
+                } catch {}
+                reject(new Error(detail));
+            });
+
+            xhr.addEventListener('error', () => reject(new Error('通信エラーが発生しました')));
+
+            xhr.open('POST', `/api/upload/${token}`);
+            xhr.send(formData);
+        });
+    }
+
+    async function resumableUpload(file) {
+        const key = resumeKey(file);
+        let uploadId = localStorage.getItem(key);
+        let offset = 0;
+        let chunkSize = 0;
+        let mode = uploadMode;
+
+        if (uploadId) {
+            const state = await fetchUploadState(uploadId);
+            if (state) {
+                offset = state.offset;
+                chunkSize = state.chunkSize;
+                mode = state.mode;
+            } else {
+                uploadId = null;
+            }
+        }
+
+        if (!uploadId) {
+            const init = await initUpload(file);
+            uploadId = init.upload_id;
+            chunkSize = init.chunk_size;
+            offset = init.offset;
+            mode = init.mode;
+            localStorage.setItem(key, uploadId);
+        }
+
+        let retries = 0;
+        while (offset < file.size) {
+            try {
+                if (mode === 'presigned') {
+                    offset = await sendChunkDirect(uploadId, file, offset, chunkSize);
+                } else {
+                    offset = await sendChunk(uploadId, file, offset, chunkSize);
+                }
+                retries = 0;
+            } catch (err) {
+                if (err.fatal) {
+                    localStorage.removeItem(key);
+                    throw new Error(err.message);
+                }
+                if (++retries > MAX_CHUNK_RETRIES) {
+                    throw new Error('通信エラーが発生しました');
+                }
+                updateProgress((offset / file.size) * 5, `再接続中... (${retries}/${MAX_CHUNK_RETRIES})`);
+                await sleep(Math.min(1000 * 2 ** retries, 30000));
+
+                const state = await fetchUploadState(uploadId).catch(() => null);
+                if (state) {
+                    offset = state.offset;
+                }
+            }
+        }
+
+        try {
+            return await finalizeUpload(uploadId);
+        } finally {
+            localStorage.removeItem(key);
+        }
+    }
+
     uploadBtn.addEventListener('click', async () => {
         if (!selectedFile) return;
         if (selectedFile.size > 5 * 1024 * 1024 * 1024) {
@@ -136,47 +378,33 @@ document.addEventListener('DOMContentLoaded', function() {
             return;
         }
         
-        const formData = new FormData();
-        formData.append('file', selectedFile);
+        // 本文を送る前にサーバー側の制限（サイズ・拡張子・容量・レート制限）を確認する
+        const preflight = await fetch(`/api/upload/${token}/preflight`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: selectedFile.name, size: selectedFile.size })
+        }).catch(() => null);
+        if (preflight && !preflight.ok) {
+            showError(await errorDetail(preflight, 'アップロードに失敗しました'));
+            return;
+        }
         
         uploadBtn.disabled = true;
         uploadBtn.textContent = 'スキャン・アップロード中...';
         progressContainer.style.display = 'block';
         message.innerHTML = '';
         
-        const xhr = new XMLHttpRequest();
-        
-        xhr.upload.addEventListener('progress', (e) => {
-            if (e.lengthComputable) {
-                const percentComplete = (e.loaded / e.total) * 100;
-                updateProgress(percentComplete * 0.05, 'アップロード中...');
-            }
-        });
-        
-        xhr.addEventListener('load', function() {
-            if (xhr.status === 200) {
-                const result = JSON.parse(xhr.responseText);
-                showSuccess(result);
-            } else {
-                try {
-                    const error = JSON.parse(xhr.responseText);
-                    showError(error.detail || 'アップロードに失敗しました');
-                } catch {
-                    showError('アップロードに失敗しました');
-                }
-            }
-            uploadBtn.disabled = false;
-            uploadBtn.textContent = 'アップロード';
-        });
-        
-        xhr.addEventListener('error', function() {
-            showError('通信エラーが発生しました');
-            uploadBtn.disabled = false;
-            uploadBtn.textContent = 'アップロード';
-        });
-        
-        xhr.open('POST', `/api/upload/${token}`);
-        xhr.send(formData);
+        try {
+            // 大きなファイルとMinIOへ直接送るモードでは、中断しても続きから送れるチャンク方式を使う
+            const result = uploadMode === 'proxy' && selectedFile.size < resumableChunkSize
+                ? await streamingUpload(selectedFile)
+                : await resumableUpload(selectedFile);
+            showSuccess(result);
+        } catch (err) {
+            showError(err.message || 'アップロードに失敗しました');
+        }
+        uploadBtn.disabled = false;
+        uploadBtn.textContent = 'アップロード';
     });
     
     function showSuccess(result) {
@@ -200,6 +428,15 @@ document.addEventListener('DOMContentLoaded', function() {
                     VirusTotal: ${result.virustotal_result || '確認済み'}
                 </div>
             `;
+        } else if (result.virus_scan === 'pending') {
+            scanIcon = '…';
+            scanColor = '#FF9500';
+            scanStatusHtml = `
+                <div style="color: #FF9500;">
+                    <strong>スキャン中</strong><br>
+                    スキャン完了後にダウンロードできるようになります
+                </div>
+            `;
         } else if (result.virus_scan === 'suspicious') {
             scanIcon = '⚠';
             scanColor = '#FF9500';
@@ -0,0 +1,17 @@
+import asyncio
+from config import Config, setup_logging
+from services.scan_worker import run_scan_workers
+
+logger = setup_logging()
+
+def main():
+    logger.info("=== Scan Worker Starting ===")
+    logger.info(f"Workers: {max(1, Config.SCAN_WORKERS)}")
+
+    try:
+        asyncio.run(run_scan_workers())
+    except KeyboardInterrupt:
+        logger.info("Shutting down...")
+
+if __name__ == "__main__":
+    main()